@@ -0,0 +1,45 @@
+"""Add (timestamp, id) indexes for keyset pagination
+
+Revision ID: 3c7e1b9a6d20
+Revises: 9d4e7a2c1b58
+Create Date: 2026-10-17 16:21:40.118305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c7e1b9a6d20'
+down_revision: Union[str, Sequence[str], None] = '9d4e7a2c1b58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# name, table, columns
+INDEXES = [
+    ('ix_deposit_created_id', 'deposit_transactions', ['created_at', 'id']),
+    ('ix_withdrawal_created_id', 'withdrawal_transactions', ['created_at', 'id']),
+    ('ix_airtime_created_id', 'airtime_purchases', ['created_at', 'id']),
+    ('ix_email_messages_received_id', 'email_messages', ['received_at', 'id']),
+    ('ix_procurement_initiated_id', 'procurements', ['initiation_date', 'id']),
+    ('ix_procurement_company_initiated_id', 'procurements', ['company_id', 'initiation_date', 'id']),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name, table, columns, unique=False,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
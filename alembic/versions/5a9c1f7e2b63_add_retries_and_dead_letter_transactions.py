@@ -0,0 +1,54 @@
+"""Add retry columns and dead_letter_transactions table
+
+Revision ID: 5a9c1f7e2b63
+Revises: e31a6c8d4f02
+Create Date: 2026-10-17 14:22:48.906317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a9c1f7e2b63'
+down_revision: Union[str, Sequence[str], None] = 'e31a6c8d4f02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('pending_transactions', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('pending_transactions', sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_table('dead_letter_transactions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('pending_transaction_id', sa.Integer(), nullable=False),
+    sa.Column('company_id', sa.Integer(), nullable=False),
+    sa.Column('transaction_type', postgresql.ENUM('CASHIN', 'CASHOUT', 'AIRTIME', name='transaction_type_enum', create_type=False), nullable=False),
+    sa.Column('msisdn', sa.String(length=20), nullable=False),
+    sa.Column('amount', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('failure_class', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('error_message', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('replayed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('replayed_by', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+    sa.ForeignKeyConstraint(['pending_transaction_id'], ['pending_transactions.id'], ),
+    sa.ForeignKeyConstraint(['replayed_by'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_dead_letter_transactions_id'), 'dead_letter_transactions', ['id'], unique=False)
+    op.create_index('ix_dead_letter_company_replayed', 'dead_letter_transactions', ['company_id', 'replayed_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_dead_letter_company_replayed', table_name='dead_letter_transactions')
+    op.drop_index(op.f('ix_dead_letter_transactions_id'), table_name='dead_letter_transactions')
+    op.drop_table('dead_letter_transactions')
+    op.drop_column('pending_transactions', 'next_attempt_at')
+    op.drop_column('pending_transactions', 'attempts')
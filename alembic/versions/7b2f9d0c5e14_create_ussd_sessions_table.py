@@ -0,0 +1,49 @@
+"""Create ussd_sessions table
+
+Revision ID: 7b2f9d0c5e14
+Revises: c4d81e2a9f37
+Create Date: 2026-10-17 10:41:07.552093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b2f9d0c5e14'
+down_revision: Union[str, Sequence[str], None] = 'c4d81e2a9f37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('ussd_sessions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('deposit_transaction_id', sa.Integer(), nullable=False),
+    sa.Column('pending_transaction_id', sa.Integer(), nullable=True),
+    sa.Column('sim_name', sa.String(length=20), nullable=False),
+    sa.Column('port_index', sa.Integer(), nullable=False),
+    sa.Column('state', sa.String(length=20), nullable=False),
+    sa.Column('step1_response', sa.Text(), nullable=True),
+    sa.Column('step2_response', sa.Text(), nullable=True),
+    sa.Column('step3_response', sa.Text(), nullable=True),
+    sa.Column('error_message', sa.Text(), nullable=True),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['deposit_transaction_id'], ['deposit_transactions.id'], ),
+    sa.ForeignKeyConstraint(['pending_transaction_id'], ['pending_transactions.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_ussd_sessions_id'), 'ussd_sessions', ['id'], unique=False)
+    op.create_index('ix_ussd_sessions_state_expires', 'ussd_sessions', ['state', 'expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_ussd_sessions_state_expires', table_name='ussd_sessions')
+    op.drop_index(op.f('ix_ussd_sessions_id'), table_name='ussd_sessions')
+    op.drop_table('ussd_sessions')
@@ -0,0 +1,39 @@
+"""Create gmail_sync_states table
+
+Revision ID: 8f2a6d3c1e47
+Revises: 3c7e1b9a6d20
+Create Date: 2026-10-17 17:02:55.630914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f2a6d3c1e47'
+down_revision: Union[str, Sequence[str], None] = '3c7e1b9a6d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'gmail_sync_states',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('account', sa.String(length=50), nullable=False),
+        sa.Column('history_id', sa.String(length=32), nullable=True),
+        sa.Column('last_full_sync_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('account'),
+    )
+    op.create_index(op.f('ix_gmail_sync_states_id'), 'gmail_sync_states', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_gmail_sync_states_id'), table_name='gmail_sync_states')
+    op.drop_table('gmail_sync_states')
@@ -0,0 +1,54 @@
+"""Add partial and composite indexes for open-status queries
+
+Revision ID: 9d4e7a2c1b58
+Revises: 5a9c1f7e2b63
+Create Date: 2026-10-17 15:03:12.442871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d4e7a2c1b58'
+down_revision: Union[str, Sequence[str], None] = '5a9c1f7e2b63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+OPEN_STATUS_SQL = "status IN ('created', 'initiated', 'pending', 'processing')"
+
+# name, table, columns, partial predicate
+INDEXES = [
+    ('ix_deposit_open_recipient_amount', 'deposit_transactions', ['recipient', 'amount', 'created_at'], OPEN_STATUS_SQL),
+    ('ix_deposit_open_created', 'deposit_transactions', ['created_at'], OPEN_STATUS_SQL),
+    ('ix_withdrawal_open_sender_amount', 'withdrawal_transactions', ['sender', 'amount', 'created_at'], OPEN_STATUS_SQL),
+    ('ix_withdrawal_open_created', 'withdrawal_transactions', ['created_at'], OPEN_STATUS_SQL),
+    ('ix_airtime_open_recipient_amount', 'airtime_purchases', ['recipient', 'amount', 'created_at'], OPEN_STATUS_SQL),
+    ('ix_airtime_open_created', 'airtime_purchases', ['created_at'], OPEN_STATUS_SQL),
+    ('ix_pending_status_created', 'pending_transactions', ['status', 'created_at'], None),
+    ('ix_pending_queue_flow', 'pending_transactions', ['transaction_type', 'company_id', 'created_at'], "status = 'pending'"),
+    ('ix_pending_processing_lease', 'pending_transactions', ['lease_expires_at'], "status = 'processing'"),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY keeps the tables writable while the indexes build; it
+    # cannot run inside the migration transaction.
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(
+                name, table, columns, unique=False,
+                postgresql_where=sa.text(where) if where else None,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
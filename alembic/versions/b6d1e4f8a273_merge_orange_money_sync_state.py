@@ -0,0 +1,34 @@
+"""Carry the cashout Gmail cursor over to the merged orange_money mailbox
+
+Revision ID: b6d1e4f8a273
+Revises: 8f2a6d3c1e47
+Create Date: 2026-10-17 17:48:19.204671
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6d1e4f8a273'
+down_revision: Union[str, Sequence[str], None] = '8f2a6d3c1e47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # cashin and cashout synced the same mailbox; keep one cursor for it
+    op.execute(
+        "UPDATE gmail_sync_states SET account = 'orange_money' "
+        "WHERE account = 'cashout' "
+        "AND NOT EXISTS (SELECT 1 FROM gmail_sync_states WHERE account = 'orange_money')"
+    )
+    op.execute("DELETE FROM gmail_sync_states WHERE account IN ('cashin', 'cashout')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # The old per-type entries bootstrap their own cursors again
+    op.execute("DELETE FROM gmail_sync_states WHERE account = 'orange_money'")
@@ -0,0 +1,34 @@
+"""Add lease columns to pending_transactions
+
+Revision ID: c4d81e2a9f37
+Revises: fb940bf9fcce
+Create Date: 2026-10-17 09:12:44.104512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d81e2a9f37'
+down_revision: Union[str, Sequence[str], None] = 'fb940bf9fcce'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('pending_transactions', sa.Column('claim_token', sa.String(length=32), nullable=True))
+    op.add_column('pending_transactions', sa.Column('claimed_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('pending_transactions', sa.Column('lease_expires_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('pending_transactions', sa.Column('dispatched_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('pending_transactions', 'dispatched_at')
+    op.drop_column('pending_transactions', 'lease_expires_at')
+    op.drop_column('pending_transactions', 'claimed_at')
+    op.drop_column('pending_transactions', 'claim_token')
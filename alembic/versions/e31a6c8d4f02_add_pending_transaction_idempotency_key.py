@@ -0,0 +1,32 @@
+"""Add idempotency key to pending_transactions
+
+Revision ID: e31a6c8d4f02
+Revises: 7b2f9d0c5e14
+Create Date: 2026-10-17 13:05:21.318240
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e31a6c8d4f02'
+down_revision: Union[str, Sequence[str], None] = '7b2f9d0c5e14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('pending_transactions', sa.Column('idempotency_key', sa.String(length=100), nullable=True))
+    op.add_column('pending_transactions', sa.Column('request_hash', sa.String(length=64), nullable=True))
+    op.create_index('uq_pending_company_idempotency_key', 'pending_transactions', ['company_id', 'idempotency_key'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_pending_company_idempotency_key', table_name='pending_transactions')
+    op.drop_column('pending_transactions', 'request_hash')
+    op.drop_column('pending_transactions', 'idempotency_key')
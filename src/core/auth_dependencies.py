@@ -1,18 +1,19 @@
 from fastapi import Depends, HTTPException, status, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 
-from src.core.database import get_db
+from src.core.database import get_db, get_async_db
 from src.services.auth_service import AuthService
 from src.models.transaction import User, APIKey
 
 security = HTTPBearer(auto_error=False)
 
 
-def get_current_user(
+async def get_current_user(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     if not credentials:
         raise HTTPException(
@@ -22,7 +23,7 @@ def get_current_user(
         )
 
     token = credentials.credentials
-    user = AuthService.validate_access_token(db, token)
+    user = await AuthService.validate_access_token_async(db, token)
 
     if not user:
         raise HTTPException(
@@ -50,15 +51,15 @@ def get_api_key(
     return api_key
 
 
-def get_optional_user(
+async def get_optional_user(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Optional[User]:
     if not credentials:
         return None
 
     token = credentials.credentials
-    return AuthService.validate_access_token(db, token)
+    return await AuthService.validate_access_token_async(db, token)
 
 
 def require_role(required_roles: list[str]):
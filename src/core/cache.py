@@ -0,0 +1,62 @@
+# src/core/cache.py
+import logging
+import threading
+import time
+from redis.exceptions import RedisError
+from src.core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class VersionedCache:
+    """
+    Process-local snapshot of rarely changing reference data.
+
+    The snapshot is rebuilt when its TTL runs out or when the shared version
+    counter in Redis moves. Writers call invalidate() after committing, which
+    bumps the counter so every API and worker process reloads on its next
+    version check. The counter is only read every check_interval seconds, so
+    the hot path is a dict lookup. If Redis is down the TTL alone applies.
+    """
+
+    def __init__(self, namespace: str, ttl: int, check_interval: int):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.version_key = f"cache:{namespace}:version"
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+
+    def _remote_version(self):
+        try:
+            return get_redis().get(self.version_key)
+        except RedisError as e:
+            logger.warning(f"Cache '{self.namespace}': version check failed ({e}), relying on TTL")
+            return self._version
+
+    def get(self, loader):
+        """Current snapshot, calling loader() to rebuild it when stale."""
+        now = time.monotonic()
+        with self._lock:
+            stale = self._data is None or now - self._loaded_at >= self.ttl
+            if not stale and now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                stale = self._remote_version() != self._version
+            if stale:
+                version = self._remote_version()
+                self._data = loader()
+                self._version = version
+                self._loaded_at = self._checked_at = now
+            return self._data
+
+    def invalidate(self):
+        """Drop the local snapshot and tell every other process to reload."""
+        with self._lock:
+            self._data = None
+        try:
+            get_redis().incr(self.version_key)
+        except RedisError as e:
+            logger.error(f"Cache '{self.namespace}': failed to publish invalidation: {e}")
@@ -14,6 +14,23 @@ class Settings(BaseSettings):
     DATABASE_URL: str
     SQL_ECHO: bool = False
 
+    # Connection pool. DB_POOL_PROFILE picks the sync sizes: "api" for each
+    # uvicorn worker, "worker" for each Celery child process. A uvicorn
+    # worker also has the asyncpg pool (DB_ASYNC_*); Celery never opens it.
+    # Budget: api workers x (api size+overflow + async size+overflow)
+    # + celery children x (worker size+overflow) must stay under Postgres
+    # max_connections.
+    DB_POOL_PROFILE: str = "api"
+    DB_POOL_SIZE_API: int = 3
+    DB_MAX_OVERFLOW_API: int = 2
+    DB_ASYNC_POOL_SIZE: int = 3
+    DB_ASYNC_MAX_OVERFLOW: int = 2
+    DB_POOL_SIZE_WORKER: int = 2
+    DB_MAX_OVERFLOW_WORKER: int = 2
+    DB_POOL_TIMEOUT: int = 10
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+
     # -----------------------------
     # NeoGate / Orange Money Config
     # -----------------------------
@@ -21,6 +38,22 @@ class Settings(BaseSettings):
     NEOGATE_API_USERNAME: str
     NEOGATE_API_PASSWORD: str
     ORANGE_MONEY_PIN: str
+    NEOGATE_CONNECT_TIMEOUT: float = 5
+    NEOGATE_READ_TIMEOUT: float = 30
+    NEOGATE_MAX_CONNECTIONS: int = 20
+    NEOGATE_MAX_KEEPALIVE: int = 10
+    # Per-GSM-port token bucket shared by all workers
+    NEOGATE_RATE_BURST: int = 5
+    NEOGATE_RATE_PER_MINUTE: float = 20
+    NEOGATE_RATE_MAX_WAIT: int = 60
+    # Replies meaning the network refused a new session without running it
+    NEOGATE_TRANSIENT_ERRORS: list = [
+        "temporairement indisponible",
+        "temporarily unavailable",
+        "reessayer plus tard",
+        "réessayer plus tard",
+        "system busy",
+    ]
     MOBILE_MONEY_SIMS: ClassVar[dict] = {
         'orange_money_1': ('orange_money_1', 1),
         'orange_money_2': ('orange_money_2', 2),
@@ -29,6 +62,44 @@ class Settings(BaseSettings):
         'primary_sim': 'orange_money_1',
         'secondary_sim': 'orange_money_2',
     }
+    # Transaction type -> SIMs allowed to serve it (first = preferred).
+    # Every SIM that serves at least one type gets its own queue lane.
+    SIM_ROUTING: dict = {
+        'cashin': ['orange_money_1'],
+        'cashout': ['orange_money_1'],
+        'airtime': ['orange_money_2'],
+    }
+    # SIM health / circuit breaker
+    SIM_HEALTH_EWMA_ALPHA: float = 0.3
+    SIM_CIRCUIT_FAILURE_THRESHOLD: int = 3
+    SIM_CIRCUIT_ERROR_RATE: float = 0.6
+    SIM_CIRCUIT_COOLDOWN: int = 60
+    SIM_FATAL_ERRORS: list = ["Operation is not supported"]
+    LANE_MAX_REQUESTS_PER_RUN: int = 6
+    LANE_LOCK_TIMEOUT: int = 120
+    QUEUE_LEASE_SECONDS: int = 300
+    # Weighted-fair queue: {company_id: weight}, {transaction_type: weight}, {company_id: priority tier}
+    QUEUE_COMPANY_WEIGHTS: dict = {}
+    QUEUE_TYPE_WEIGHTS: dict = {}
+    QUEUE_COMPANY_PRIORITIES: dict = {}
+    # Transient gateway failures: attempts before dead-lettering, exponential backoff bounds
+    QUEUE_MAX_ATTEMPTS: int = 5
+    QUEUE_RETRY_BASE_SECONDS: int = 30
+    QUEUE_RETRY_MAX_SECONDS: int = 900
+    # Submissions wake their lane directly; the beat only sweeps for leftovers
+    QUEUE_SWEEP_INTERVAL: int = 60
+    LANE_BACKLOG_COUNTDOWN: int = 0
+    # Deposit USSD sessions: per-step deadline and sweeper interval
+    USSD_STEP_TIMEOUT_SECONDS: int = 120
+    USSD_SWEEP_INTERVAL: int = 30
+    # MSISDN routing table cache: local snapshot TTL and Redis version-check interval (seconds)
+    COUNTRY_CACHE_TTL: int = 600
+    COUNTRY_CACHE_VERSION_CHECK: int = 5
+    # Operator prefixes including the dial code, e.g. {"22177": "orange"}
+    MSISDN_OPERATOR_PREFIXES: dict = {}
+    # Fee rule cache: local snapshot TTL and Redis version-check interval (seconds)
+    FEE_CACHE_TTL: int = 300
+    FEE_CACHE_VERSION_CHECK: int = 5
 
     # -----------------------------
     # Gmail API Config
@@ -39,6 +110,14 @@ class Settings(BaseSettings):
     GMAIL_WITHDRAWAL_TOKEN: str
     GMAIL_FETCH_INTERVAL: int
     GMAIL_AIRTIME_INTERVAL: int
+    # Push mode: Gmail watch -> Pub/Sub push subscription -> /emails/push
+    GMAIL_PUSH_ENABLED: bool = False
+    GMAIL_PUSH_TOPIC: str = ""  # projects/<project>/topics/<topic>
+    GMAIL_PUSH_VERIFICATION_TOKEN: str = ""  # ?token= on the push endpoint URL
+    # Watched address -> mailbox label, e.g. {"om@example.com": "orange_money"}
+    GMAIL_PUSH_MAILBOXES: dict = {}
+    # Safety-net polling interval while push is enabled
+    GMAIL_PUSH_FALLBACK_INTERVAL: int = 300
 
     # -----------------------------
     # Message broker
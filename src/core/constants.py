@@ -24,6 +24,11 @@ class TransactionType(str, Enum):
     CREDIT_PURCHASE = 'credit_purchase'
 
 
+def transaction_type_key(transaction_type) -> str:
+    """Lowercase string of a transaction type, whether given as an Enum member or a plain string."""
+    return str(getattr(transaction_type, "value", transaction_type) or "").strip().lower()
+
+
 # Used for Gmail background tasks
 class GmailAccountType(str, Enum):
     AIRTIME = 'airtime'
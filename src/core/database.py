@@ -1,16 +1,35 @@
-from sqlalchemy import create_engine
+import logging
+import threading
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from src.core.config import settings
 
+logger = logging.getLogger(__name__)
+
 # -----------------------------------------------------
 # Database Engine + Session
 # -----------------------------------------------------
 
 DATABASE_URL = settings.DATABASE_URL
 
+POOL_PROFILES = {
+    "api": (settings.DB_POOL_SIZE_API, settings.DB_MAX_OVERFLOW_API),
+    "worker": (settings.DB_POOL_SIZE_WORKER, settings.DB_MAX_OVERFLOW_WORKER),
+}
+POOL_SIZE, MAX_OVERFLOW = POOL_PROFILES.get(settings.DB_POOL_PROFILE, POOL_PROFILES["api"])
+
 engine = create_engine(
     DATABASE_URL,
-    echo=settings.SQL_ECHO
+    echo=settings.SQL_ECHO,
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    # Drop connections before server/proxy idle timeouts do
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    # Replace connections killed by a Postgres restart instead of failing the request
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -22,6 +41,96 @@ def get_db():
     finally:
         db.close()
 
+# -----------------------------------------------------
+# Async Engine + Session (FastAPI hot paths)
+# -----------------------------------------------------
+# Same database through asyncpg, so `async def` routes stop blocking the event
+# loop on queries. Celery workers keep using the sync engine above.
+ASYNC_DATABASE_URL = make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
+
+# Its own pool budget: an authenticated sync route holds one connection
+# from each pool, so both count towards the api worker's ceiling.
+ASYNC_POOL_SIZE = settings.DB_ASYNC_POOL_SIZE
+ASYNC_MAX_OVERFLOW = settings.DB_ASYNC_MAX_OVERFLOW
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    echo=settings.SQL_ECHO,
+    pool_size=ASYNC_POOL_SIZE,
+    max_overflow=ASYNC_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+)
+
+# expire_on_commit=False: attributes stay readable after commit without an
+# implicit (and in async, illegal) lazy refresh
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# -----------------------------------------------------
+# Pool metrics
+# -----------------------------------------------------
+_pool_counters = {
+    "sync": {"connects": 0, "checkouts": 0, "invalidations": 0, "high_water": 0},
+    "async": {"connects": 0, "checkouts": 0, "invalidations": 0, "high_water": 0},
+}
+_pool_lock = threading.Lock()
+
+
+def _track_pool(sync_engine, name: str, limit: int):
+    """Count connects/checkouts/invalidations and warn when the pool runs dry."""
+    counters = _pool_counters[name]
+
+    @event.listens_for(sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        with _pool_lock:
+            counters["connects"] += 1
+
+    @event.listens_for(sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        in_use = sync_engine.pool.checkedout()
+        with _pool_lock:
+            counters["checkouts"] += 1
+            counters["high_water"] = max(counters["high_water"], in_use)
+        if in_use >= limit:
+            logger.warning(f"DB {name} pool exhausted ({in_use}/{limit} in use); next checkout waits up to {settings.DB_POOL_TIMEOUT}s")
+
+    @event.listens_for(sync_engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        with _pool_lock:
+            counters["invalidations"] += 1
+
+
+_track_pool(engine, "sync", POOL_SIZE + MAX_OVERFLOW)
+# Pool events of an AsyncEngine fire on its sync_engine
+_track_pool(async_engine.sync_engine, "async", ASYNC_POOL_SIZE + ASYNC_MAX_OVERFLOW)
+
+
+def _occupancy(pool, size: int, overflow: int, name: str) -> dict:
+    with _pool_lock:
+        counters = dict(_pool_counters[name])
+    return {
+        "pool_size": size,
+        "max_overflow": overflow,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        **counters,
+    }
+
+
+def pool_stats() -> dict:
+    """Current occupancy of both pools plus counters since process start."""
+    return {
+        "profile": settings.DB_POOL_PROFILE,
+        **_occupancy(engine.pool, POOL_SIZE, MAX_OVERFLOW, "sync"),
+        "async": _occupancy(async_engine.pool, ASYNC_POOL_SIZE, ASYNC_MAX_OVERFLOW, "async"),
+    }
+
 # -----------------------------------------------------
 # Base Model
 # -----------------------------------------------------
@@ -29,5 +138,3 @@ class Base(DeclarativeBase):
     pass
 
 import src.models
-
-
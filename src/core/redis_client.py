@@ -0,0 +1,15 @@
+import redis
+from functools import lru_cache
+from src.core.config import settings
+
+
+@lru_cache()
+def get_redis() -> redis.Redis:
+    """Shared Redis client (one connection pool per process)"""
+    return redis.Redis.from_url(
+        settings.REDIS_URL,
+        password=settings.REDIS_PASSWORD or None,
+        decode_responses=True,
+        socket_timeout=5,
+        socket_connect_timeout=5,
+    )
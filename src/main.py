@@ -1,5 +1,5 @@
-from src.core.database import Base, engine
-from fastapi import FastAPI
+from src.core.database import Base, engine, async_engine, pool_stats
+from fastapi import FastAPI, Depends
 from fastapi.staticfiles import StaticFiles
 import os
 
@@ -17,6 +17,8 @@ from src.routes.emails import email_router
 from src.routes.company_theme import theme_router
 from src.routes.exports import export_router
 from src.routes.banks import bank_router
+from src.core.auth_dependencies import require_role
+from src.models.transaction import User
 import src.models
 
 app = FastAPI(title="CashMoov API", version="1.0.0")
@@ -50,7 +52,19 @@ app.include_router(bank_router)
 
 
 
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    # Close asyncpg connections while the event loop is still running
+    await async_engine.dispose()
+
+
 @app.get("/")
 def root():
     return {"message": "CashMoov API is running"}
 
+
+@app.get("/metrics/db-pool")
+def db_pool_metrics(current_user: User = Depends(require_role(["ADMIN"]))):
+    """Connection pool occupancy of the uvicorn worker that serves the request."""
+    return pool_stats()
+
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, func
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Index, func
 from src.core.database import Base
 
 
@@ -15,4 +15,17 @@ class EmailMessage(Base):
     parsed_transaction_id = Column(String, index=True, nullable=True)
     matched = Column(Boolean, default=False)
 
+    __table_args__ = (
+        Index('ix_email_messages_received_id', 'received_at', 'id'),
+    )
 
+
+class GmailSyncState(Base):
+    """Per-account users.history.list cursor for incremental Gmail sync."""
+    __tablename__ = 'gmail_sync_states'
+
+    id = Column(Integer, primary_key=True, index=True)
+    account = Column(String(50), unique=True, nullable=False)
+    history_id = Column(String(32), nullable=True)
+    last_full_sync_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -2,11 +2,15 @@ from sqlalchemy import (
     Column, Integer, Text, Numeric, String, DateTime, Boolean, ForeignKey, Sequence, BigInteger,
     UniqueConstraint, Enum as SAEnum, JSON, Index
 )
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from sqlalchemy.orm import relationship
 from src.core.database import Base
 from enum import Enum
 
+# Statuses of transactions still waiting for a confirmation email; the hot
+# queries (matching, blackout, stale sweep) filter on exactly this set.
+OPEN_STATUS_SQL = "status IN ('created', 'initiated', 'pending', 'processing')"
+
 
 # ========== ENUMS ==========
 class TransactionStatus(str, Enum):
@@ -35,6 +39,18 @@ class TransactionType(str, Enum):
     AIRTIME = "airtime"
 
 
+class UssdSessionState(str, Enum):
+    NEW = "new"
+    INITIATING = "initiating"
+    MENU_RECEIVED = "menu_received"
+    CONFIRMING = "confirming"
+    PIN_REQUESTED = "pin_requested"
+    SENDING_PIN = "sending_pin"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    EXPIRED = "expired"
+
+
 class RoleEnum(str, Enum):
     ADMIN = "ADMIN"
     CHECKER = "CHECKER"
@@ -345,6 +361,9 @@ class Procurement(Base):
     __table_args__ = (
         Index('ix_procurement_company_country', 'company_id', 'country_id'),
         Index('ix_procurement_status', 'status'),
+        # Keyset pagination: newest first, per company for non-admin listings
+        Index('ix_procurement_initiated_id', 'initiation_date', 'id'),
+        Index('ix_procurement_company_initiated_id', 'company_id', 'initiation_date', 'id'),
     )
 
 # ========== DEPOSIT TRANSACTION ==========
@@ -403,6 +422,13 @@ class DepositTransaction(Base):
     balance = relationship("CompanyCountryBalance")
     pending_transaction = relationship("PendingTransaction")
 
+    __table_args__ = (
+        Index('ix_deposit_open_recipient_amount', 'recipient', 'amount', 'created_at',
+              postgresql_where=text(OPEN_STATUS_SQL)),
+        Index('ix_deposit_open_created', 'created_at', postgresql_where=text(OPEN_STATUS_SQL)),
+        Index('ix_deposit_created_id', 'created_at', 'id'),
+    )
+
 
 # ========== WITHDRAWAL TRANSACTION ==========
 class WithdrawalTransaction(Base):
@@ -460,6 +486,13 @@ class WithdrawalTransaction(Base):
     balance = relationship("CompanyCountryBalance")
     pending_transaction = relationship("PendingTransaction")
 
+    __table_args__ = (
+        Index('ix_withdrawal_open_sender_amount', 'sender', 'amount', 'created_at',
+              postgresql_where=text(OPEN_STATUS_SQL)),
+        Index('ix_withdrawal_open_created', 'created_at', postgresql_where=text(OPEN_STATUS_SQL)),
+        Index('ix_withdrawal_created_id', 'created_at', 'id'),
+    )
+
 
 # ========== AIRTIME PURCHASE ==========
 class AirtimePurchase(Base):
@@ -517,6 +550,13 @@ class AirtimePurchase(Base):
     balance = relationship("CompanyCountryBalance")
     pending_transaction = relationship("PendingTransaction")
 
+    __table_args__ = (
+        Index('ix_airtime_open_recipient_amount', 'recipient', 'amount', 'created_at',
+              postgresql_where=text(OPEN_STATUS_SQL)),
+        Index('ix_airtime_open_created', 'created_at', postgresql_where=text(OPEN_STATUS_SQL)),
+        Index('ix_airtime_created_id', 'created_at', 'id'),
+    )
+
 
 # ========== PENDING TRANSACTION ==========
 class PendingTransaction(Base):
@@ -536,6 +576,20 @@ class PendingTransaction(Base):
     error_message = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     processed_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Queue lease (set when a worker claims the row)
+    claim_token = Column(String(32), nullable=True)
+    claimed_at = Column(DateTime(timezone=True), nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    dispatched_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Partner-supplied Idempotency-Key and a hash of the request it came with
+    idempotency_key = Column(String(100), nullable=True)
+    request_hash = Column(String(64), nullable=True)
+
+    # Retries of transient gateway failures
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)
     
     # Relationship
     company = relationship("Company")
@@ -545,6 +599,81 @@ class PendingTransaction(Base):
     withdrawal_transactions = relationship("WithdrawalTransaction", back_populates="pending_transaction")
     airtime_purchases = relationship("AirtimePurchase", back_populates="pending_transaction")
 
+    __table_args__ = (
+        Index('uq_pending_company_idempotency_key', 'company_id', 'idempotency_key', unique=True),
+        Index('ix_pending_status_created', 'status', 'created_at'),
+        # Queue claims: per-(company, type) flows of claimable rows
+        Index('ix_pending_queue_flow', 'transaction_type', 'company_id', 'created_at',
+              postgresql_where=text("status = 'pending'")),
+        # Lease reclaim sweep
+        Index('ix_pending_processing_lease', 'lease_expires_at',
+              postgresql_where=text("status = 'processing'")),
+    )
+
+
+# ========== USSD SESSION ==========
+class UssdSession(Base):
+    """Persisted progress of a multi-step USSD deposit on one GSM port."""
+    __tablename__ = "ussd_sessions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    deposit_transaction_id = Column(Integer, ForeignKey("deposit_transactions.id"), nullable=False)
+    pending_transaction_id = Column(Integer, ForeignKey("pending_transactions.id"), nullable=True)
+
+    sim_name = Column(String(20), nullable=False)
+    port_index = Column(Integer, nullable=False)
+    state = Column(String(20), nullable=False, default=UssdSessionState.NEW.value)
+
+    step1_response = Column(Text, nullable=True)
+    step2_response = Column(Text, nullable=True)
+    step3_response = Column(Text, nullable=True)
+    error_message = Column(Text, nullable=True)
+
+    # Deadline of the current step; past it the session is resolved by the sweeper
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    deposit_transaction = relationship("DepositTransaction")
+    pending_transaction = relationship("PendingTransaction")
+
+    __table_args__ = (
+        Index('ix_ussd_sessions_state_expires', 'state', 'expires_at'),
+    )
+
+
+# ========== DEAD LETTER ==========
+class DeadLetterTransaction(Base):
+    """A pending transaction that failed for good, kept for inspection and replay."""
+    __tablename__ = "dead_letter_transactions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    pending_transaction_id = Column(Integer, ForeignKey("pending_transactions.id"), nullable=False)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
+    transaction_type = Column(
+        SAEnum(TransactionType, name="transaction_type_enum"),
+        nullable=False
+    )
+    msisdn = Column(String(20), nullable=False)
+    amount = Column(Numeric(14, 2), nullable=False)
+
+    # exhausted: transient errors past the retry budget
+    # rejected: failed before any money could move
+    # unknown: gateway outcome unknown, check the statement before replaying
+    failure_class = Column(String(20), nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    error_message = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    replayed_at = Column(DateTime(timezone=True), nullable=True)
+    replayed_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+
+    pending_transaction = relationship("PendingTransaction")
+
+    __table_args__ = (
+        Index('ix_dead_letter_company_replayed', 'company_id', 'replayed_at'),
+    )
+
 
 class Bank(Base):
     __tablename__ = "banks"
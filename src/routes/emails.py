@@ -1,12 +1,55 @@
-from fastapi import APIRouter, Depends
+import hmac
+import logging
+from typing import Optional
+from fastapi import APIRouter, Depends, Query, HTTPException, Body, Response, status
 from sqlalchemy.orm import Session
+from src.core.config import settings
 from src.core.database import get_db
 from src.services.email_service import list_emails
+from src.services.gmail_push import handle_push_notification
 from src.schemas.email_message import EmailMessageListResponse, EmailMessageResponse
 
+logger = logging.getLogger(__name__)
+
 email_router = APIRouter(prefix="/emails", tags=['Emails'])
 
 @email_router.get("/", response_model=EmailMessageListResponse)
-def read_emails(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    items, total = list_emails(db, skip=skip, limit=limit)
-    return {'emails': items, 'total': total}
\ No newline at end of file
+def read_emails(
+    skip: int = Query(0, ge=0, deprecated=True, description="Legacy offset; not allowed with a cursor"),
+    limit: int = Query(100, ge=1, le=500),
+    after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    before: Optional[str] = Query(None, description="prev_cursor of the previous page"),
+    with_total: bool = Query(False, description="Include an approximate total"),
+    db: Session = Depends(get_db)
+):
+    page = list_emails(db, skip=skip, limit=limit, after=after, before=before, with_total=with_total)
+    return {
+        'emails': page['items'],
+        'total': page['total'],
+        'next_cursor': page['next_cursor'],
+        'prev_cursor': page['prev_cursor'],
+        'has_more': page['has_more'],
+    }
+
+
+@email_router.post("/push", status_code=status.HTTP_204_NO_CONTENT)
+def gmail_push(envelope: dict = Body(...), token: str = Query("")):
+    """
+    Pub/Sub push endpoint for Gmail watch notifications.
+
+    Point the push subscription at /emails/push?token=<GMAIL_PUSH_VERIFICATION_TOKEN>.
+    Any 2xx acknowledges the message, so malformed notifications are logged
+    and acknowledged instead of being redelivered forever.
+    """
+    if not settings.GMAIL_PUSH_ENABLED:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Gmail push is disabled")
+    if not settings.GMAIL_PUSH_VERIFICATION_TOKEN or not hmac.compare_digest(
+        token, settings.GMAIL_PUSH_VERIFICATION_TOKEN
+    ):
+        raise HTTPException(status.HTTP_403_FORBIDDEN, "Invalid push token")
+
+    try:
+        handle_push_notification(envelope)
+    except (KeyError, TypeError, ValueError) as e:
+        logger.warning(f"Malformed Gmail push notification dropped: {e}")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -4,20 +4,24 @@ import json
 from pathlib import Path
 
 import logging
-from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Query, status, Form
+from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Query, status, Form, Header, Response
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.responses import FileResponse
 
 from typing import List, Optional
 from src.models.transaction import User, ProcurementStatus
 from src.services.finance_service import FinanceService
+from src.services.fee_service import quote_fees
+from src.services.dead_letter import list_dead_letters, replay_dead_letter
 
-from src.core.database import get_db
+from src.core.database import get_db, get_async_db
 from src.core.auth_dependencies import get_current_user, require_role
 from src.services.transaction_service import *
 from src.services.auth_service import AuthService
 from src.schemas.transaction import *
 from src.utils.files import save_image  
+from src.utils.pagination import set_cursor_headers
 from src.schemas.email_message import PasswordResetRequest, PasswordResetWithOTP
  
 logger = logging.getLogger("router logging")
@@ -291,61 +295,143 @@ def upload_company_logo(
 
 # ---------------------- DEPOSIT ----------------------
 @transaction_router.post("/send/orange-money/", response_model=QueuedTransactionResponse)
-async def send_deposit(deposit: DepositCreate, db: Session = Depends(get_db)):
+async def send_deposit(
+    deposit: DepositCreate,
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=100)
+):
     try:
-        result = await create_deposit(db, deposit)
+        result = await create_deposit(db, deposit, idempotency_key)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=429, detail=str(e))
 
 # ---------------------- AIRTIME ----------------------
 @transaction_router.post("/purchase/airtime/", response_model=QueuedTransactionResponse)
-async def purchase_airtime(airtime: AirtimeCreate, db: Session = Depends(get_db)):
+async def purchase_airtime(
+    airtime: AirtimeCreate,
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=100)
+):
     try:
-        result = await create_airtime_purchase(db, airtime)
+        result = await create_airtime_purchase(db, airtime, idempotency_key)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=429, detail=str(e))
 
 # ---------------------- WITHDRAWAL ----------------------
 @transaction_router.post("/initiate/withdrawal/", response_model=QueuedTransactionResponse)
-async def initiate_withdrawal(withdrawal: WithdrawalCreate, db: Session = Depends(get_db)):
+async def initiate_withdrawal(
+    withdrawal: WithdrawalCreate,
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=100)
+):
     try:
-        result = await initiate_withdrawal_transaction(db, withdrawal)
+        result = await initiate_withdrawal_transaction(db, withdrawal, idempotency_key)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=429, detail=str(e))
     
 
+# ---------------------- BULK DEPOSIT / AIRTIME ----------------------
+@transaction_router.post("/bulk/", response_model=BulkSubmissionResponse)
+def submit_bulk(payload: BulkTransactionCreate, db: Session = Depends(get_db)):
+    """Queue up to 5,000 deposit/airtime items; returns one result per item, in order."""
+    return create_bulk_transactions(db, payload)
+
+# ---------------------- QUEUE METRICS ----------------------
+@transaction_router.get("/queue/metrics", response_model=List[QueueDepthResponse])
+def queue_metrics(
+    company_id: Optional[int] = Query(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_role(["ADMIN"]))
+):
+    """Per-company queue depth, to watch that small partners are not starved."""
+    return get_queue_depth(db, company_id)
+
+# ---------------------- DEAD LETTERS ----------------------
+@transaction_router.get("/dead-letters", response_model=List[DeadLetterResponse])
+def get_dead_letters(
+    company_id: Optional[int] = Query(None),
+    include_replayed: bool = Query(False),
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_role(["ADMIN"]))
+):
+    return list_dead_letters(db, company_id, include_replayed, limit, offset)
+
+@transaction_router.post("/dead-letters/{dead_letter_id}/replay", response_model=DeadLetterResponse)
+def replay_dead_letter_endpoint(
+    dead_letter_id: int,
+    force: bool = Query(False, description="Required to replay a request whose gateway outcome is unknown"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_role(["ADMIN"]))
+):
+    return replay_dead_letter(db, dead_letter_id, current_user, force)
+
 # ---------- GET deposits ----------
 @transaction_router.get("/deposits", response_model=List[DepositResponse])
-def get_deposits(
+async def get_deposits(
+    response: Response,
     recipient: Optional[str] = Query(None),
     partner_id: Optional[int] = Query(None),
     status: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    before: Optional[str] = Query(None, description="X-Prev-Cursor of the previous page"),
+    with_total: bool = Query(False, description="Add an approximate X-Total-Count-Estimate header"),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    return get_deposit_transactions(db, recipient, partner_id, status)
+    page = await get_deposit_transactions(
+        db, recipient, partner_id, status, limit=limit, after=after, before=before, with_total=with_total
+    )
+    set_cursor_headers(response, page)
+    return page["items"]
 
 # ---------- GET withdrawals ----------
 @transaction_router.get("/withdrawals", response_model=List[WithdrawalResponse])
-def get_withdrawals(
+async def get_withdrawals(
+    response: Response,
     sender: Optional[str] = Query(None),
     partner_id: Optional[int] = Query(None),
     status: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    before: Optional[str] = Query(None, description="X-Prev-Cursor of the previous page"),
+    with_total: bool = Query(False, description="Add an approximate X-Total-Count-Estimate header"),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    return get_withdrawal_transactions(db, sender, partner_id, status)
+    page = await get_withdrawal_transactions(
+        db, sender, partner_id, status, limit=limit, after=after, before=before, with_total=with_total
+    )
+    set_cursor_headers(response, page)
+    return page["items"]
 
 # ---------- GET airtime purchases ----------
 @transaction_router.get("/airtime", response_model=List[AirtimeResponse])
-def get_airtime(
+async def get_airtime(
+    response: Response,
     recipient: Optional[str] = Query(None),
     partner_id: Optional[int] = Query(None),
     status: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    before: Optional[str] = Query(None, description="X-Prev-Cursor of the previous page"),
+    with_total: bool = Query(False, description="Add an approximate X-Total-Count-Estimate header"),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    return get_airtime_purchase_transactions(db, recipient, partner_id, status)
+    page = await get_airtime_purchase_transactions(
+        db, recipient, partner_id, status, limit=limit, after=after, before=before, with_total=with_total
+    )
+    set_cursor_headers(response, page)
+    return page["items"]
 
 @country_router.post("/", response_model=CountryResponse)
 def create(data: CountryCreate, db: Session = Depends(get_db)):
@@ -539,6 +625,15 @@ def create(
 ):
     return create_fee_config(db, data, current_user)
 
+@fee_router.post("/quote", response_model=FeeQuoteResponse)
+def quote(
+    data: FeeQuoteRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Fees for a list of amounts under the active config (served from the fee cache)."""
+    return quote_fees(db, data.destination_country_id, data.transaction_type, data.amounts)
+
 @fee_router.get("/", response_model=list[FeeConfigResponse])
 def list_all(db: Session = Depends(get_db)):
     return list_fee_configs(db)
@@ -590,7 +685,7 @@ async def create_procurement_endpoint(
     amount: Decimal = Form(...),
     slip: UploadFile = File(None),
     current_user: User = Depends(require_role(["ADMIN", "MAKER", "USER"])),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Build schema
     parsed_data = ProcurementCreate(
@@ -618,12 +713,14 @@ async def create_procurement_endpoint(
             f.write(await slip.read())
     from src.services.procurement_service import ProcurementService
 
-    # Create procurement
-    procurement = ProcurementService.create_procurement(
-        db=db,
-        procurement_data=parsed_data,
-        initiated_by_user_id=current_user.id,
-        file_path=file_path
+    # Create procurement (sync service, run on the async session's connection)
+    procurement = await db.run_sync(
+        lambda session: ProcurementService.create_procurement(
+            db=session,
+            procurement_data=parsed_data,
+            initiated_by_user_id=current_user.id,
+            file_path=file_path
+        )
     )
 
     # Return ORM → schema (clean & safe)
@@ -742,7 +839,10 @@ def list_procurements_endpoint(
     country_id: Optional[int] = None,
     status: Optional[ProcurementStatus] = None,
     limit: int = Query(100, ge=1, le=1000),
-    offset: int = Query(0, ge=0),
+    offset: int = Query(0, ge=0, deprecated=True, description="Legacy offset; not allowed with a cursor"),
+    after: Optional[str] = Query(None, description="pagination.next_cursor of the previous page"),
+    before: Optional[str] = Query(None, description="pagination.prev_cursor of the previous page"),
+    with_total: bool = Query(False, description="Include an approximate total"),
     current_user: User = Depends(require_role(["ADMIN", "CHECKER", "MAKER", "USER"])),
     db: Session = Depends(get_db)
 ):
@@ -752,18 +852,21 @@ def list_procurements_endpoint(
     if current_user.role != "ADMIN":
         company_id = current_user.company_id
 
-    procurements, total = ProcurementService.get_procurements(
+    page = ProcurementService.get_procurements(
         db=db,
         company_id=company_id,
         country_id=country_id,
         status=status,
         limit=limit,
-        offset=offset
+        offset=offset,
+        after=after,
+        before=before,
+        with_total=with_total
     )
 
     response_items = []
 
-    for proc in procurements:
+    for proc in page["items"]:
         # ORM → Pydantic
         item = ProcurementResponse.model_validate(proc, from_attributes=True)
 
@@ -782,10 +885,12 @@ def list_procurements_endpoint(
     return {
         "procurements": response_items,
         "pagination": {
-            "total": total,
+            "total": page["total"],
             "limit": limit,
             "offset": offset,
-            "has_more": (offset + len(response_items)) < total
+            "has_more": page["has_more"],
+            "next_cursor": page["next_cursor"],
+            "prev_cursor": page["prev_cursor"]
         }
     }
     
\ No newline at end of file
@@ -38,7 +38,10 @@ class EmailMessageResponse(EmailMessageInDBBase):
 
 class EmailMessageListResponse(BaseModel):
     emails: list[EmailMessageResponse]
-    total: int
+    total: Optional[int] = Field(None, description="Approximate, only when with_total=true")
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    has_more: bool = False
 
 
 class PasswordResetRequest(BaseModel):
@@ -59,6 +59,12 @@ class WithdrawalCreate(WithdrawalBase):
 class AirtimeCreate(AirtimeBase):
     pass 
 
+class BulkTransactionCreate(BaseModel):
+    """Deposit/airtime items validated one by one so a bad row never rejects the batch."""
+    company_id: int
+    items: List[Dict[str, Any]] = Field(..., min_length=1, max_length=5000)
+
+
 # -------------------------- RESPONSE SCHEMAS -------------------------------
 
 class DepositResponse(BaseModel):
@@ -176,6 +182,41 @@ class QueuedTransactionResponse(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)
 
+class BulkItemResult(BaseModel):
+    index: int
+    status: str  # queued | rejected
+    pending_transaction_id: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkSubmissionResponse(BaseModel):
+    total: int
+    queued: int
+    rejected: int
+    results: List[BulkItemResult]
+
+class QueueDepthResponse(BaseModel):
+    company_id: int
+    transaction_type: TransactionType
+    pending: int
+    processing: int
+    oldest_pending_seconds: Optional[int] = None
+
+class DeadLetterResponse(BaseModel):
+    id: int
+    pending_transaction_id: int
+    company_id: int
+    transaction_type: TransactionType
+    msisdn: str
+    amount: Decimal
+    failure_class: str
+    attempts: int
+    error_message: Optional[str] = None
+    created_at: datetime
+    replayed_at: Optional[datetime] = None
+    replayed_by: Optional[int] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
 # ------------------------- GENERIC OPERATION RESPONSE -------------------------
 
 class OperationResponse(BaseModel):
@@ -380,6 +421,23 @@ class FeeConfigUpdate(BaseModel):
     max_fee: Optional[Decimal] = None
     is_active: Optional[bool] = None
 
+class FeeQuoteRequest(BaseModel):
+    transaction_type: TransactionType
+    destination_country_id: int = Field(..., example=2)
+    amounts: List[Decimal] = Field(..., min_length=1, max_length=500, example=["5000", "10000", "25000"])
+
+class FeeQuote(BaseModel):
+    amount: Decimal
+    fee_amount: Decimal
+    net_amount: Decimal
+
+class FeeQuoteResponse(BaseModel):
+    transaction_type: TransactionType
+    destination_country_id: int
+    fee_config_id: Optional[int] = None
+    fee_config_version: Optional[int] = None
+    quotes: List[FeeQuote]
+
 class FeeConfigResponse(BaseModel):
     id: int
     transaction_type: TransactionType
@@ -0,0 +1,161 @@
+"""
+EXPLAIN ANALYZE the hot status-filtered queries and report which scan each
+plan uses.
+
+    python -m src.scripts.explain_hot_queries            # current data
+    python -m src.scripts.explain_hot_queries --seed 200000
+
+--seed inserts synthetic rows (mostly closed, a few open, like production)
+and runs ANALYZE inside a transaction that is rolled back at the end, so
+nothing is left behind. Run it before and after `alembic upgrade head` to see
+the plans move from Seq Scan to the partial indexes.
+
+The queue claim is not hand-written here: both of its statements (the
+weighted-fair ranking and the FOR UPDATE SKIP LOCKED lease update) are built
+by QueueClaimer itself, so the plan shown is the one the lanes run.
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+OPEN = "('created', 'initiated', 'pending', 'processing')"
+
+HOT_QUERIES = {
+    "matching (deposit)": f"""
+        SELECT id FROM deposit_transactions
+        WHERE status IN {OPEN} AND amount = :amount AND recipient = :msisdn
+        ORDER BY created_at ASC LIMIT 1
+    """,
+    "matching (withdrawal)": f"""
+        SELECT id FROM withdrawal_transactions
+        WHERE status IN {OPEN} AND amount = :amount AND sender = :msisdn
+        ORDER BY created_at ASC LIMIT 1
+    """,
+    "blackout (airtime)": f"""
+        SELECT id FROM airtime_purchases
+        WHERE status IN {OPEN} AND recipient = :msisdn
+        ORDER BY created_at DESC LIMIT 1
+    """,
+    "stale sweep (deposit)": f"""
+        SELECT id FROM deposit_transactions
+        WHERE status IN {OPEN} AND created_at <= now() - interval '24 hours'
+    """,
+    "lease reclaim (pending)": """
+        SELECT id FROM pending_transactions
+        WHERE status = 'processing' AND lease_expires_at < now()
+    """,
+}
+
+SEED_SQL = {
+    "deposit_transactions": """
+        INSERT INTO deposit_transactions
+            (amount, recipient, status, company_id, country_id, partner_id, net_amount, created_at)
+        SELECT (1000 + (g % 500) * 100), '22177' || lpad((g % 100000)::text, 7, '0'),
+               CASE WHEN g % 200 = 0 THEN 'initiated' ELSE 'success' END,
+               :company_id, :country_id, 'bench', (1000 + (g % 500) * 100),
+               now() - (g || ' seconds')::interval
+        FROM generate_series(1, :rows) AS g
+    """,
+    "withdrawal_transactions": """
+        INSERT INTO withdrawal_transactions
+            (amount, sender, status, company_id, country_id, partner_id, net_amount, created_at)
+        SELECT (1000 + (g % 500) * 100), '22177' || lpad((g % 100000)::text, 7, '0'),
+               CASE WHEN g % 200 = 0 THEN 'initiated' ELSE 'success' END,
+               :company_id, :country_id, 'bench', (1000 + (g % 500) * 100),
+               now() - (g || ' seconds')::interval
+        FROM generate_series(1, :rows) AS g
+    """,
+    "airtime_purchases": """
+        INSERT INTO airtime_purchases
+            (amount, recipient, status, company_id, country_id, partner_id, net_amount, created_at)
+        SELECT (1000 + (g % 50) * 100), '22177' || lpad((g % 100000)::text, 7, '0'),
+               CASE WHEN g % 200 = 0 THEN 'initiated' ELSE 'success' END,
+               :company_id, :country_id, 'bench', (1000 + (g % 50) * 100),
+               now() - (g || ' seconds')::interval
+        FROM generate_series(1, :rows) AS g
+    """,
+    "pending_transactions": """
+        INSERT INTO pending_transactions
+            (transaction_type, msisdn, amount, partner_id, company_id, status, created_at)
+        SELECT (ARRAY['CASHIN', 'CASHOUT', 'AIRTIME'])[1 + g % 3]::transaction_type_enum,
+               '22177' || lpad((g % 100000)::text, 7, '0'), 5000, 'bench', :company_id,
+               CASE WHEN g % 500 = 0 THEN 'pending' ELSE 'done' END,
+               now() - (g || ' seconds')::interval
+        FROM generate_series(1, :rows) AS g
+    """,
+}
+
+PARAMS = {"amount": 5000, "msisdn": "221770000200"}
+
+
+def _scans(node: dict) -> list:
+    found = []
+    if "Scan" in node.get("Node Type", ""):
+        found.append(f"{node['Node Type']}({node.get('Index Name') or node.get('Relation Name')})")
+    for child in node.get("Plans", []):
+        found.extend(_scans(child))
+    return found
+
+
+def claim_queries(conn) -> dict:
+    """The statements QueueClaimer.claim_batch() runs for a cashin/cashout lane."""
+    from src.core.config import settings
+    from src.models.transaction import TransactionType
+    from src.tasks.transaction_queue import QueueClaimer
+
+    rank = QueueClaimer.fair_order(
+        [TransactionType.CASHIN, TransactionType.CASHOUT], settings.LANE_MAX_REQUESTS_PER_RUN
+    )
+    ordered_ids = conn.execute(rank).scalars().all() or [0]
+    lock = QueueClaimer.claim_update(ordered_ids, "explain", datetime.now(timezone.utc))
+    return {"queue claim (rank)": rank, "queue claim (lock)": lock}
+
+
+def seed(conn, rows: int):
+    ids = conn.execute(text(
+        "SELECT (SELECT id FROM companies ORDER BY id LIMIT 1), (SELECT id FROM countries ORDER BY id LIMIT 1)"
+    )).one()
+    if ids[0] is None or ids[1] is None:
+        raise SystemExit("Seeding needs at least one company and one country")
+
+    for table, sql in SEED_SQL.items():
+        started = time.perf_counter()
+        conn.execute(text(sql), {"rows": rows, "company_id": ids[0], "country_id": ids[1]})
+        conn.execute(text(f"ANALYZE {table}"))
+        print(f"Seeded {rows} rows into {table} in {time.perf_counter() - started:.1f}s")
+
+
+def explain_all(conn):
+    print(f"\n{'query':28} {'ms':>9}  scans")
+    for label, query in {**HOT_QUERIES, **claim_queries(conn)}.items():
+        if isinstance(query, str):
+            plan = conn.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}"), PARAMS).scalar()
+        else:
+            sql = query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+            plan = conn.exec_driver_sql(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}").scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        root = plan[0]
+        scans = ", ".join(_scans(root["Plan"]))
+        flag = "  <-- seq scan" if "Seq Scan" in scans else ""
+        print(f"{label:28} {root['Execution Time']:9.2f}  {scans}{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=0, help="synthetic rows per table (rolled back afterwards)")
+    args = parser.parse_args()
+
+    from src.core.database import engine
+
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            if args.seed:
+                seed(conn, args.seed)
+            explain_all(conn)
+        finally:
+            trans.rollback()
@@ -0,0 +1,57 @@
+"""
+Local stand-in for Google Pub/Sub: POST Gmail watch notifications to the push
+endpoint, shaped exactly like a push subscription delivery.
+
+    python -m src.scripts.fake_gmail_push --email om@example.com
+    python -m src.scripts.fake_gmail_push --email om@example.com --count 20 --interval 0.5
+
+The API needs GMAIL_PUSH_ENABLED=true and the address listed in
+GMAIL_PUSH_MAILBOXES. Each notification queues a history delta sync for that
+mailbox, so send a real email to it first to see it land within seconds.
+"""
+import argparse
+import base64
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+
+def envelope(email_address: str, history_id: int) -> dict:
+    data = json.dumps({"emailAddress": email_address, "historyId": history_id})
+    return {
+        "message": {
+            "data": base64.b64encode(data.encode()).decode(),
+            "messageId": uuid.uuid4().hex,
+            "publishTime": datetime.now(timezone.utc).isoformat(),
+        },
+        "subscription": "projects/local/subscriptions/gmail-push-fake",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000/emails/push")
+    parser.add_argument("--token", default=os.getenv("GMAIL_PUSH_VERIFICATION_TOKEN", ""))
+    parser.add_argument("--email", required=True, help="Watched mailbox address")
+    parser.add_argument("--history-id", type=int, default=None, help="Defaults to a time-based value")
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between notifications")
+    args = parser.parse_args()
+
+    history_id = args.history_id or int(time.time())
+    with httpx.Client(timeout=10) as client:
+        for i in range(args.count):
+            started = time.perf_counter()
+            resp = client.post(args.url, params={"token": args.token}, json=envelope(args.email, history_id + i))
+            elapsed = (time.perf_counter() - started) * 1000
+            print(f"#{i + 1} historyId={history_id + i} -> {resp.status_code} ({elapsed:.1f} ms)")
+            if i + 1 < args.count:
+                time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 # src/services/auth_service.py (FINAL CLEAN VERSION)
 import logging
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime, timezone, timedelta
 from typing import Optional, Dict, List, Any
@@ -398,6 +400,29 @@ class AuthService:
             User.is_active == True
         ).first()
     
+    @staticmethod
+    async def validate_access_token_async(db: AsyncSession, token: str) -> Optional[User]:
+        """
+        validate_access_token() on the async engine, for request-path dependencies.
+        """
+        payload = SecurityUtils.verify_access_token(token)
+        if not payload:
+            return None
+
+        blacklisted = await db.scalar(
+            select(JWTBlacklist.id).where(JWTBlacklist.jti == payload.get("jti")).limit(1)
+        )
+        if blacklisted:
+            return None
+
+        user_id = payload.get("sub")
+        if not user_id:
+            return None
+
+        return await db.scalar(
+            select(User).where(User.id == int(user_id), User.is_active == True)
+        )
+    
     @staticmethod
     def refresh_tokens(db: Session, refresh_token: str, device_info: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
         """
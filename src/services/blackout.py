@@ -0,0 +1,207 @@
+# src/services/blackout.py
+import logging
+from datetime import datetime, timezone, timedelta
+from fastapi.concurrency import run_in_threadpool
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from src.core.constants import transaction_type_key
+from src.core.redis_client import get_redis
+from src.models.transaction import DepositTransaction, WithdrawalTransaction, AirtimePurchase
+
+logger = logging.getLogger(__name__)
+
+# Minimum intervals
+BLACKOUT_TIMES = {
+    "CASHIN": timedelta(minutes=10),
+    "CASHOUT": timedelta(minutes=10),
+    "AIRTIME": timedelta(minutes=4),
+}
+
+OPEN_STATUSES = ["created", "initiated", "pending", "processing"]
+
+# Transaction model -> (blackout type, column holding the number)
+BLACKOUT_PARTIES = {
+    DepositTransaction: ("CASHIN", "recipient"),
+    WithdrawalTransaction: ("CASHOUT", "sender"),
+    AirtimePurchase: ("AIRTIME", "recipient"),
+}
+
+
+def _interval(tx_type: str):
+    return BLACKOUT_TIMES.get(transaction_type_key(tx_type).upper())
+
+
+def blackout_key(tx_type: str, msisdn: str) -> str:
+    return f"blackout:{transaction_type_key(tx_type).upper()}:{msisdn.strip()}"
+
+
+def _party_column(model, tx_type: str):
+    return model.sender if transaction_type_key(tx_type).upper() == "CASHOUT" else model.recipient
+
+
+# ----------------- DATABASE (cold fallback) ----------------- #
+async def check_blackout(db: AsyncSession, model, msisdn: str, tx_type: str) -> bool:
+    interval = _interval(tx_type)
+    if not interval:
+        return False
+
+    msisdn = msisdn.strip()
+
+    last_tx = (await db.execute(
+        select(model)
+        .where(model.status.in_(OPEN_STATUSES))
+        .where(_party_column(model, tx_type) == msisdn)
+        .order_by(model.created_at.desc())
+        .limit(1)
+    )).scalars().first()
+
+    if last_tx:
+        if last_tx.created_at.tzinfo is None:
+            last_created = last_tx.created_at.replace(tzinfo=timezone.utc)
+        else:
+            last_created = last_tx.created_at
+
+        now = datetime.now(timezone.utc)
+        if (now - last_created) < interval:
+            return True
+
+    return False
+
+
+def blacked_out_msisdns(db: Session, model, msisdns: set, tx_type: str) -> set:
+    """Set-based check_blackout(): numbers with an open transaction inside the window."""
+    interval = _interval(tx_type)
+    if not interval or not msisdns:
+        return set()
+
+    column = _party_column(model, tx_type)
+    since = datetime.now(timezone.utc) - interval
+    rows = (
+        db.query(column)
+        .filter(model.status.in_(OPEN_STATUSES))
+        .filter(column.in_(msisdns))
+        .filter(model.created_at >= since)
+        .distinct()
+        .all()
+    )
+    return {row[0] for row in rows}
+
+
+# ----------------- REDIS (hot path) ----------------- #
+def _redis_is_warm(redis_client, tx_type: str, interval: timedelta) -> bool:
+    """
+    True once Redis has been recording slots for a full window.
+
+    Until then (first deploy, flushed or replaced Redis) a missing key does not
+    prove the number is free, so the database is consulted as well.
+    """
+    warm_key = f"blackout:warm:{transaction_type_key(tx_type).upper()}"
+    now = datetime.now(timezone.utc).timestamp()
+    redis_client.set(warm_key, now, nx=True)
+    started = float(redis_client.get(warm_key) or now)
+    return now - started >= interval.total_seconds()
+
+
+def _claim_slot(tx_type: str, msisdn: str, interval: timedelta) -> tuple:
+    """SET NX EX the window key; returns (claimed, redis_is_warm). Raises RedisError."""
+    redis_client = get_redis()
+    key = blackout_key(tx_type, msisdn)
+    if not redis_client.set(key, datetime.now(timezone.utc).isoformat(), nx=True, ex=int(interval.total_seconds())):
+        return False, True
+    return True, _redis_is_warm(redis_client, tx_type, interval)
+
+
+async def acquire_blackout_slot(db: AsyncSession, model, msisdn: str, tx_type: str) -> bool:
+    """
+    Atomically claim the blackout window for one number; False if it is taken.
+
+    SET NX EX makes concurrent submissions for the same number race on Redis
+    rather than on a read-then-insert, so only one of them gets through.
+
+    Same rule as the database check: the number is blocked while its last
+    transaction in the window is open. The slot is released when that
+    transaction fails (release_blackout_slot) or is confirmed
+    (release_settled_slot), so it only runs the full window while open.
+    """
+    interval = _interval(tx_type)
+    if not interval:
+        return True
+
+    try:
+        # redis-py is blocking; keep it off the event loop
+        claimed, warm = await run_in_threadpool(_claim_slot, tx_type, msisdn, interval)
+    except RedisError as e:
+        logger.warning(f"Blackout cache unavailable ({e}), falling back to the database")
+        return not await check_blackout(db, model, msisdn, tx_type)
+
+    if not claimed:
+        return False
+    if not warm and await check_blackout(db, model, msisdn, tx_type):
+        # Keep the key: the window the database knows about is still open
+        return False
+    return True
+
+
+def acquire_blackout_slots(db: Session, model, msisdns: list, tx_type: str) -> set:
+    """acquire_blackout_slot() for many numbers in one pipeline; returns the blocked ones."""
+    interval = _interval(tx_type)
+    if not interval or not msisdns:
+        return set()
+
+    msisdns = list(dict.fromkeys(m.strip() for m in msisdns))
+    try:
+        redis_client = get_redis()
+        stamp = datetime.now(timezone.utc).isoformat()
+        pipe = redis_client.pipeline(transaction=False)
+        for msisdn in msisdns:
+            pipe.set(blackout_key(tx_type, msisdn), stamp, nx=True, ex=int(interval.total_seconds()))
+        claimed = pipe.execute()
+        blocked = {m for m, ok in zip(msisdns, claimed) if not ok}
+        try:
+            if not _redis_is_warm(redis_client, tx_type, interval):
+                blocked |= blacked_out_msisdns(db, model, set(msisdns) - blocked, tx_type)
+        except Exception:
+            # Don't leave the windows just claimed set for requests that never get queued
+            keys = [blackout_key(tx_type, m) for m, ok in zip(msisdns, claimed) if ok]
+            if keys:
+                redis_client.delete(*keys)
+            raise
+        return blocked
+    except RedisError as e:
+        logger.warning(f"Blackout cache unavailable ({e}), falling back to the database")
+        return blacked_out_msisdns(db, model, set(msisdns), tx_type)
+
+
+def release_blackout_slot(tx_type: str, msisdn: str):
+    """Free the window again when the request it was claimed for never got queued or failed."""
+    try:
+        get_redis().delete(blackout_key(tx_type, msisdn))
+    except RedisError as e:
+        logger.warning(f"Could not release blackout slot for {msisdn}: {e}")
+
+
+def release_settled_slot(transaction):
+    """
+    Free the window of a transaction that left the open statuses (confirmed).
+
+    A slot claimed after the transaction was created belongs to a newer
+    request and is kept.
+    """
+    tx_type, party = BLACKOUT_PARTIES.get(type(transaction), (None, None))
+    if not tx_type or not _interval(tx_type):
+        return
+
+    msisdn = getattr(transaction, party) or ""
+    created_at = transaction.created_at
+    if created_at and created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    try:
+        redis_client = get_redis()
+        key = blackout_key(tx_type, msisdn)
+        claimed_at = redis_client.get(key)
+        if claimed_at and (created_at is None or datetime.fromisoformat(claimed_at) <= created_at):
+            redis_client.delete(key)
+    except RedisError as e:
+        logger.warning(f"Could not release blackout slot for {msisdn}: {e}")
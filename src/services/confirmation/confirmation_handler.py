@@ -7,6 +7,7 @@ from src.models.transaction import (
     AirtimePurchase,
     CompanyCountryBalance,
 )
+from src.services.blackout import release_settled_slot
 
 def confirm_transaction(db: Session, transaction, parsed_data, email_obj):
     # 1️⃣ Mark transaction as successful
@@ -46,6 +47,9 @@ def confirm_transaction(db: Session, transaction, parsed_data, email_obj):
     db.commit()
     db.refresh(transaction)
 
+    # A confirmed transaction no longer holds its number's blackout window
+    release_settled_slot(transaction)
+
     return transaction
 
 # from datetime import datetime, timezone
@@ -0,0 +1,91 @@
+# src/services/dead_letter.py
+import random
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+from src.core.config import settings
+from src.models.transaction import PendingTransaction, DeadLetterTransaction, User
+from src.services.queue_notifier import wake_queue_lane
+
+EXHAUSTED = "exhausted"
+REJECTED = "rejected"
+UNKNOWN = "unknown"
+
+
+def next_attempt_at(attempts: int) -> Optional[datetime]:
+    """Exponential backoff with jitter; None once the retry budget is spent."""
+    if attempts >= settings.QUEUE_MAX_ATTEMPTS:
+        return None
+    delay = min(settings.QUEUE_RETRY_MAX_SECONDS, settings.QUEUE_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    delay *= random.uniform(0.8, 1.2)
+    return datetime.now(timezone.utc) + timedelta(seconds=delay)
+
+
+def dead_letter(db: Session, req: PendingTransaction, failure_class: str, error: str) -> DeadLetterTransaction:
+    """Record a failed request; committed by the caller with the failure itself."""
+    entry = DeadLetterTransaction(
+        pending_transaction_id=req.id,
+        company_id=req.company_id,
+        transaction_type=req.transaction_type,
+        msisdn=req.msisdn,
+        amount=req.amount,
+        failure_class=failure_class,
+        attempts=req.attempts or 0,
+        error_message=(error or "")[:1000],
+    )
+    db.add(entry)
+    return entry
+
+
+def list_dead_letters(
+    db: Session,
+    company_id: Optional[int] = None,
+    include_replayed: bool = False,
+    limit: int = 50,
+    offset: int = 0
+):
+    query = db.query(DeadLetterTransaction)
+    if company_id is not None:
+        query = query.filter(DeadLetterTransaction.company_id == company_id)
+    if not include_replayed:
+        query = query.filter(DeadLetterTransaction.replayed_at.is_(None))
+    return query.order_by(DeadLetterTransaction.id.desc()).offset(offset).limit(limit).all()
+
+
+def replay_dead_letter(db: Session, dead_letter_id: int, user: User, force: bool = False) -> DeadLetterTransaction:
+    """Put a dead-lettered request back on the queue with a fresh retry budget."""
+    entry = db.query(DeadLetterTransaction).filter(DeadLetterTransaction.id == dead_letter_id).first()
+    if not entry:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Dead letter not found")
+    if entry.replayed_at:
+        raise HTTPException(status.HTTP_409_CONFLICT, "Dead letter already replayed")
+    if entry.failure_class == UNKNOWN and not force:
+        raise HTTPException(
+            status.HTTP_409_CONFLICT,
+            "Gateway outcome unknown: check the operator statement, then replay with force=true"
+        )
+
+    req = db.query(PendingTransaction).filter(
+        PendingTransaction.id == entry.pending_transaction_id
+    ).with_for_update().first()
+    if not req or req.status != "failed":
+        raise HTTPException(status.HTTP_409_CONFLICT, "Pending transaction is no longer failed")
+
+    req.status = "pending"
+    req.error_message = None
+    req.attempts = 0
+    req.next_attempt_at = None
+    req.claim_token = None
+    req.claimed_at = None
+    req.lease_expires_at = None
+    req.dispatched_at = None
+    req.processed_at = None
+
+    entry.replayed_at = datetime.now(timezone.utc)
+    entry.replayed_by = user.id
+    db.commit()
+    db.refresh(entry)
+
+    wake_queue_lane(req.transaction_type)
+    return entry
@@ -1,5 +1,7 @@
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from src.models.email_message import EmailMessage
+from src.utils.pagination import keyset, keyset_page, explain_rows, plan_rows
 from src.schemas.email_message import EmailMessageCreate
 import smtplib
 import logging
@@ -41,10 +43,14 @@ def mark_email_matched(db: Session, email_obj: EmailMessage):
     db.refresh(email_obj)
     return email_obj
 
-def list_emails(db: Session, skip: int = 0, limit: int = 100):
-    q = db.query(EmailMessage).order_by(EmailMessage.received_at.desc()).offset(skip).limit(limit).all()
-    total = db.query(EmailMessage).count()
-    return q, total
+def list_emails(db: Session, skip: int = 0, limit: int = 100, after: str = None, before: str = None,
+                with_total: bool = False) -> dict:
+    """Newest-first keyset page on (received_at, id); total is a planner estimate, only on request."""
+    query = select(EmailMessage)
+    total = plan_rows(db.scalar(explain_rows(query))) if with_total else None
+    stmt = keyset(query, EmailMessage.received_at, EmailMessage.id, limit, after, before, offset=skip)
+    rows = db.scalars(stmt).all()
+    return {**keyset_page(rows, limit, "received_at", before, after), "total": total}
 
 
 class EmailService:
@@ -0,0 +1,83 @@
+# src/services/fee_service.py
+from collections import namedtuple
+from decimal import Decimal
+from sqlalchemy.orm import Session
+from src.core.cache import VersionedCache
+from src.core.config import settings
+from src.core.constants import transaction_type_key
+from src.models.transaction import FeeConfig
+
+# Plain snapshot of an active FeeConfig, safe to share across sessions/threads
+FeeRule = namedtuple(
+    "FeeRule",
+    ["id", "version", "fee_type", "flat_fee", "percent_fee", "min_fee", "max_fee"]
+)
+
+fee_rules = VersionedCache(
+    "fee_rules",
+    ttl=settings.FEE_CACHE_TTL,
+    check_interval=settings.FEE_CACHE_VERSION_CHECK,
+)
+
+
+def _load_fee_rules(db: Session) -> dict:
+    rules = {}
+    configs = db.query(FeeConfig).filter(FeeConfig.is_active == True).order_by(FeeConfig.id.asc()).all()
+    for config in configs:
+        key = (config.destination_country_id, transaction_type_key(config.transaction_type))
+        rules.setdefault(key, FeeRule(
+            id=config.id,
+            version=config.version,
+            fee_type=config.fee_type,
+            flat_fee=config.flat_fee,
+            percent_fee=config.percent_fee,
+            min_fee=config.min_fee,
+            max_fee=config.max_fee,
+        ))
+    return rules
+
+
+def get_fee_rule(db: Session, destination_country_id: int, transaction_type):
+    """Active fee rule for a (destination country, transaction type), from the cache."""
+    rules = fee_rules.get(lambda: _load_fee_rules(db))
+    return rules.get((destination_country_id, transaction_type_key(transaction_type)))
+
+
+def invalidate_fee_rules():
+    """Call after committing any change to an active fee config."""
+    fee_rules.invalidate()
+
+
+def apply_fee(rule, amount: Decimal) -> dict:
+    if not rule:
+        return {"fee_amount": Decimal('0'), "net_amount": amount}
+
+    if rule.fee_type == "flat":
+        fee_amount = Decimal(rule.flat_fee)
+    elif rule.fee_type == "percent":
+        fee_amount = (amount * Decimal(rule.percent_fee)) / Decimal('100')
+    else:
+        fee_amount = Decimal('0')
+
+    if rule.min_fee and fee_amount < Decimal(rule.min_fee):
+        fee_amount = Decimal(rule.min_fee)
+    if rule.max_fee and fee_amount > Decimal(rule.max_fee):
+        fee_amount = Decimal(rule.max_fee)
+
+    return {"fee_amount": fee_amount, "net_amount": amount - fee_amount}
+
+
+def quote_fees(db: Session, destination_country_id: int, transaction_type, amounts: list) -> dict:
+    """Fees for many amounts against one rule lookup (pricing screens)."""
+    rule = get_fee_rule(db, destination_country_id, transaction_type)
+    quotes = []
+    for amount in amounts:
+        amount = Decimal(str(amount))
+        quotes.append({"amount": amount, **apply_fee(rule, amount)})
+    return {
+        "transaction_type": transaction_type,
+        "destination_country_id": destination_country_id,
+        "fee_config_id": rule.id if rule else None,
+        "fee_config_version": rule.version if rule else None,
+        "quotes": quotes,
+    }
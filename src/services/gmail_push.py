@@ -0,0 +1,50 @@
+import base64
+import json
+import logging
+from typing import Optional
+from src.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SYNC_TASK = "src.tasks.gmail_sync.sync_account"
+
+
+def mailbox_tokens() -> dict:
+    """Mailbox label -> token file, the same pairs the beat schedule syncs."""
+    return {
+        "orange_money": settings.GMAIL_WITHDRAWAL_TOKEN,
+        "airtime": settings.GMAIL_AIRTIME_TOKEN,
+    }
+
+
+def sync_dirty_key(label: str) -> str:
+    return f"gmail:sync:{label}:dirty"
+
+
+def parse_push_notification(envelope: dict) -> dict:
+    """{"emailAddress", "historyId"} out of a Pub/Sub push request body."""
+    return json.loads(base64.b64decode(envelope["message"]["data"]))
+
+
+def handle_push_notification(envelope: dict) -> Optional[str]:
+    """
+    Start a history delta sync for the mailbox a Gmail watch notification is about.
+
+    The notification only says "something changed up to historyId N"; the
+    sync task fetches the delta from the stored cursor as usual. Returns the
+    mailbox label, or None when the address is not one we watch.
+    """
+    notification = parse_push_notification(envelope)
+    address = notification.get("emailAddress", "").lower()
+    label = {k.lower(): v for k, v in settings.GMAIL_PUSH_MAILBOXES.items()}.get(address)
+    token_path = mailbox_tokens().get(label)
+    if not token_path:
+        logger.warning(f"Gmail push for unwatched mailbox {address!r} ignored")
+        return None
+
+    # Overlapping pushes are cheap: a sync that finds another one running
+    # only leaves the dirty flag, and an empty history delta is one call.
+    from src.worker_app import celery_app
+    celery_app.send_task(SYNC_TASK, args=[label, token_path])
+    logger.info(f"Gmail push for {label} (historyId {notification.get('historyId')}): sync queued")
+    return label
@@ -151,23 +151,83 @@ import base64
 import quopri
 from email import message_from_bytes
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from src.core.config import settings
 from bs4 import BeautifulSoup
 import re
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
 from datetime import datetime, timezone   # <<< ADD THIS
 
 
+logger = logging.getLogger(__name__)
+
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+PAGE_SIZE = 500
+BATCH_SIZE = 100  # Gmail's cap on calls per batch request
+BATCH_RETRIES = 3
+RETRY_STATUSES = {429, 500, 503}
+# Response masks: only what _parse_message() reads
+FULL_FIELDS = "id,threadId,internalDate,snippet,payload(headers(name,value),body/data,parts)"
+METADATA_FIELDS = "id,threadId,internalDate,snippet,payload/headers(name,value)"
 
 
 def _load_credentials(token_path: str) -> Credentials:
     return Credentials.from_authorized_user_file(token_path, SCOPES)
 
 
+# ----------------- SERVICE CACHE (per worker process) ----------------- #
+_services = {}  # token_path -> (token file mtime, credentials, service)
+_services_lock = threading.Lock()
+
+
+def _save_credentials(token_path: str, creds: Credentials) -> int:
+    """Write refreshed credentials back atomically; returns the new file mtime."""
+    directory = os.path.dirname(os.path.abspath(token_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".token-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(creds.to_json())
+        shutil.copymode(token_path, tmp_path)
+        os.replace(tmp_path, token_path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    return os.stat(token_path).st_mtime_ns
+
+
 def build_service_for_token(token_path: str):
-    creds = _load_credentials(token_path)
-    service = build('gmail', 'v1', credentials=creds)
+    """
+    Gmail service for a token file, built once per process.
+
+    The discovery document bundled with google-api-python-client is used
+    instead of fetching it, the access token is refreshed before it expires
+    and written back to the file, and the cached service is rebuilt when the
+    token file changes on disk (e.g. re-authorised by hand).
+    """
+    mtime = os.stat(token_path).st_mtime_ns
+    with _services_lock:
+        cached = _services.get(token_path)
+        if cached and cached[0] == mtime:
+            _, creds, service = cached
+        else:
+            creds = _load_credentials(token_path)
+            service = build('gmail', 'v1', credentials=creds, static_discovery=True, cache_discovery=False)
+
+        if not creds.valid and creds.refresh_token:
+            creds.refresh(Request())
+            try:
+                mtime = _save_credentials(token_path, creds)
+            except OSError as e:
+                logger.warning(f"Could not save refreshed Gmail token to {token_path}: {e}")
+
+        _services[token_path] = (mtime, creds, service)
     return service
 
 
@@ -210,6 +270,29 @@ def clean_email_body(html: str) -> str:
     return cleaned.strip()
 
 
+def _parse_message(msg: dict) -> dict:
+    payload = msg.get('payload', {})
+    headers = payload.get('headers', [])
+
+    subject = next((h['value'] for h in headers if h.get('name', '').lower() == 'subject'), '')
+    sender = next((h['value'] for h in headers if h.get('name', '').lower() == 'from'), '')
+    body = _extract_body(payload) or msg.get('snippet', '')
+
+    # <<<<<< FIX HERE: convert Gmail milliseconds into real datetime >>>>>
+    internal_date_ms = int(msg.get('internalDate', 0))
+    internal_date = datetime.fromtimestamp(internal_date_ms / 1000, tz=timezone.utc)
+
+    return {
+        'id': msg.get('id'),
+        'threadId': msg.get('threadId'),
+        'subject': subject,
+        'sender': sender,
+        'body': body,
+        'snippet': msg.get('snippet'),
+        'internalDate': internal_date,  # datetime object
+    }
+
+
 def fetch_recent_emails(token_path: str, max_results: int = 100, query: str = None):
     svc = build_service_for_token(token_path)
 
@@ -225,29 +308,132 @@ def fetch_recent_emails(token_path: str, max_results: int = 100, query: str = No
     resp = svc.users().messages().list(**params).execute()
     msgs = resp.get('messages', [])
 
-    result = []
-
-    for m in msgs:
-        msg = svc.users().messages().get(userId='me', id=m['id'], format='full').execute()
-        payload = msg.get('payload', {})
-        headers = payload.get('headers', [])
-
-        subject = next((h['value'] for h in headers if h.get('name', '').lower() == 'subject'), '')
-        sender = next((h['value'] for h in headers if h.get('name', '').lower() == 'from'), '')
-        body = _extract_body(payload) or msg.get('snippet', '')
-
-        # <<<<<< FIX HERE: convert Gmail milliseconds into real datetime >>>>>
-        internal_date_ms = int(msg.get('internalDate', 0))
-        internal_date = datetime.fromtimestamp(internal_date_ms / 1000, tz=timezone.utc)
-
-        result.append({
-            'id': msg.get('id'),
-            'threadId': msg.get('threadId'),
-            'subject': subject,
-            'sender': sender,
-            'body': body,
-            'snippet': msg.get('snippet'),
-            'internalDate': internal_date,  # datetime object
-        })
+    return fetch_messages(svc, [m['id'] for m in msgs])
+
+
+def _get_params(with_body: bool) -> dict:
+    if with_body:
+        return {"format": "full", "fields": FULL_FIELDS}
+    return {"format": "metadata", "metadataHeaders": ["Subject", "From"], "fields": METADATA_FIELDS}
+
+
+def fetch_messages(svc, message_ids: list, with_body: bool = True) -> list:
+    """
+    Parsed messages for the given ids, in the same order, via HTTP batch requests.
+
+    Up to BATCH_SIZE gets share one round trip. Parts of a batch that come
+    back rate limited or 5xx are retried in a later batch; a message deleted
+    in the meantime (404) is skipped. with_body=False fetches headers and
+    snippet only.
+    """
+    message_ids = list(dict.fromkeys(message_ids))
+    params = _get_params(with_body)
+    results = {}
+
+    pending = message_ids
+    for attempt in range(BATCH_RETRIES + 1):
+        retry, failures = [], []
+
+        def on_response(request_id, response, exception):
+            if exception is None:
+                results[request_id] = _parse_message(response)
+            elif isinstance(exception, HttpError) and exception.resp.status == 404:
+                pass  # Deleted between the listing and the fetch
+            elif isinstance(exception, HttpError) and exception.resp.status in RETRY_STATUSES:
+                retry.append(request_id)
+            else:
+                failures.append(exception)
+
+        for start in range(0, len(pending), BATCH_SIZE):
+            batch = svc.new_batch_http_request(callback=on_response)
+            for message_id in pending[start:start + BATCH_SIZE]:
+                batch.add(svc.users().messages().get(userId='me', id=message_id, **params), request_id=message_id)
+            batch.execute()
+
+        if failures:
+            raise failures[0]
+        if not retry:
+            break
+        if attempt == BATCH_RETRIES:
+            raise RuntimeError(f"Gmail batch fetch still throttled for {len(retry)} messages")
+        time.sleep(2 ** attempt)
+        pending = retry
+
+    return [results[m] for m in message_ids if m in results]
+
+
+# ----------------- INCREMENTAL SYNC (history API) ----------------- #
+class HistoryExpired(Exception):
+    """The stored historyId is too old for users.history.list; a full resync is needed."""
+
+
+def current_history_id(svc) -> str:
+    """Mailbox's latest historyId; take it before a full listing so nothing falls between."""
+    return str(svc.users().getProfile(userId='me').execute()['historyId'])
+
+
+def list_message_ids(svc, query: str = None) -> list:
+    """Every message id matching `query`, following nextPageToken to the end."""
+    ids, page_token = [], None
+    while True:
+        params = {"userId": "me", "maxResults": PAGE_SIZE, "includeSpamTrash": True}
+        if query:
+            params["q"] = query
+        if page_token:
+            params["pageToken"] = page_token
+        resp = svc.users().messages().list(**params).execute()
+        ids.extend(m['id'] for m in resp.get('messages', []))
+        page_token = resp.get('nextPageToken')
+        if not page_token:
+            # messages.list is newest first; process oldest first
+            return list(reversed(ids))
+
+
+def list_history(svc, start_history_id: str) -> tuple:
+    """
+    Ids of messages added since start_history_id, oldest first, and the
+    historyId to resume from next time. Follows every page, so a burst of
+    any size comes back in one call.
+    """
+    ids, seen, page_token = [], set(), None
+    latest = start_history_id
+    while True:
+        params = {
+            "userId": "me",
+            "startHistoryId": start_history_id,
+            "historyTypes": ["messageAdded"],
+            "maxResults": PAGE_SIZE,
+        }
+        if page_token:
+            params["pageToken"] = page_token
+        try:
+            resp = svc.users().history().list(**params).execute()
+        except HttpError as e:
+            if e.resp.status == 404:
+                raise HistoryExpired(start_history_id) from e
+            raise
+        for record in resp.get('history', []):
+            for added in record.get('messagesAdded', []):
+                message_id = added['message']['id']
+                if message_id not in seen:
+                    seen.add(message_id)
+                    ids.append(message_id)
+        latest = str(resp.get('historyId', latest))
+        page_token = resp.get('nextPageToken')
+        if not page_token:
+            return ids, latest
+
+
+# ----------------- PUSH NOTIFICATIONS (users.watch) ----------------- #
+def start_watch(svc, topic_name: str) -> dict:
+    """
+    (Re)register the mailbox with Gmail push notifications on a Pub/Sub topic.
+
+    A watch lapses after 7 days, so this has to be repeated; Gmail treats a
+    repeat call as a renewal.
+    """
+    return svc.users().watch(
+        userId='me',
+        body={"topicName": topic_name, "labelIds": ["INBOX"], "labelFilterBehavior": "include"},
+    ).execute()
 
-    return result
@@ -0,0 +1,113 @@
+# src/services/msisdn_router.py
+from collections import namedtuple
+from sqlalchemy.orm import Session
+from src.core.cache import VersionedCache
+from src.core.config import settings
+from src.models.transaction import Country
+
+# Plain snapshot of a countries row, safe to share across sessions/threads
+CountryRef = namedtuple("CountryRef", ["id", "name", "iso_code", "phone_code", "is_active"])
+Route = namedtuple("Route", ["country", "operator"])
+
+# Dial codes for countries whose phone_code column is not filled in yet
+DEFAULT_DIAL_CODES = {
+    'SN': '221', 'GN': '224', 'ML': '223', 'CI': '225', 'BF': '226'
+}
+DEFAULT_COUNTRY_ISO = 'SN'
+
+
+def _digits(value: str) -> str:
+    return "".join(ch for ch in (value or "") if ch.isdigit())
+
+
+class PrefixTrie:
+    """Digit trie; lookup returns the values of the longest matching prefixes."""
+
+    __slots__ = ("root",)
+
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, prefix: str, field: str, value):
+        node = self.root
+        for digit in prefix:
+            node = node.setdefault(digit, {})
+        node[field] = value
+
+    def longest_match(self, digits: str) -> dict:
+        """Deepest value seen for each field along the path of digits."""
+        found = {}
+        node = self.root
+        for digit in digits:
+            node = node.get(digit)
+            if node is None:
+                break
+            for field in ("country", "operator"):
+                if field in node:
+                    found[field] = node[field]
+        return found
+
+
+class MsisdnRoutingTable:
+    """Countries by ISO code plus a dial-code/operator-prefix trie."""
+
+    def __init__(self, countries: list, operator_prefixes: dict):
+        self.by_iso = {c.iso_code.upper(): c for c in countries}
+        self.trie = PrefixTrie()
+        for country in countries:
+            dial_code = _digits(country.phone_code) or DEFAULT_DIAL_CODES.get(country.iso_code.upper())
+            if dial_code:
+                self.trie.insert(dial_code, "country", country)
+        # Operator prefixes include the dial code, e.g. {"22177": "orange"}
+        for prefix, operator in operator_prefixes.items():
+            self.trie.insert(_digits(prefix), "operator", operator)
+
+    def active_country(self, iso_code: str):
+        country = self.by_iso.get((iso_code or "").upper())
+        return country if country and country.is_active else None
+
+    def route(self, msisdn: str) -> Route:
+        """
+        Longest-prefix match. An unknown prefix falls back to the default
+        country; a prefix owned by an inactive country routes nowhere.
+        """
+        found = self.trie.longest_match(_digits(msisdn))
+        country = found.get("country")
+        if country is None:
+            country = self.by_iso.get(DEFAULT_COUNTRY_ISO)
+        elif not country.is_active:
+            country = None
+        return Route(country=country, operator=found.get("operator"))
+
+
+routing_table = VersionedCache(
+    "msisdn_routes",
+    ttl=settings.COUNTRY_CACHE_TTL,
+    check_interval=settings.COUNTRY_CACHE_VERSION_CHECK,
+)
+
+
+def _load_routing_table(db: Session) -> MsisdnRoutingTable:
+    countries = [
+        CountryRef(c.id, c.name, c.iso_code, c.phone_code, c.is_active)
+        for c in db.query(Country).all()
+    ]
+    return MsisdnRoutingTable(countries, settings.MSISDN_OPERATOR_PREFIXES)
+
+
+def get_routing_table(db: Session) -> MsisdnRoutingTable:
+    return routing_table.get(lambda: _load_routing_table(db))
+
+
+def resolve_destination_country(db: Session, country_iso: str, msisdn: str):
+    """Requested ISO code if active, else the MSISDN's country (or the default)."""
+    table = get_routing_table(db)
+    country = table.active_country(country_iso) if country_iso else None
+    if not country and msisdn:
+        country = table.route(msisdn).country
+    return country
+
+
+def invalidate_routing_table():
+    """Call after committing any change to the countries table."""
+    routing_table.invalidate()
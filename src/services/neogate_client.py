@@ -1,24 +1,55 @@
 # src/services/neogate_client.py
+import asyncio
+import time
 from urllib.parse import quote_plus
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 from src.core.config import settings
 from .sim_manager import SIMManager
+from .rate_limiter import TokenBucket
 from datetime import datetime, timezone
 from fastapi import HTTPException
 
 
-class NeoGateTG400Client:
+class TransientGatewayError(Exception):
+    """
+    A session-opening USSD request that provably did not run: it was never
+    sent (circuit open, no rate token, connection refused/timed out on
+    connect) or the network answered with a transient rejection. Nothing can
+    have moved, so the request is safe to retry.
+
+    Read timeouts and failures inside an open session are ambiguous and are
+    never reported this way.
+    """
+
+
+def _never_sent(error: Exception) -> bool:
+    if isinstance(error, (requests.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class _NeoGateBase:
+    """Configuration and USSD helpers shared by the sync and async clients."""
+
     def __init__(self):
         self.base_url = settings.NEOGATE_BASE_URL
         self.api_username = settings.NEOGATE_API_USERNAME
         self.api_password = settings.NEOGATE_API_PASSWORD
         self.sim_manager = SIMManager()
         self.orange_pin = settings.ORANGE_MONEY_PIN
+        self.rate_limiter = TokenBucket(
+            capacity=settings.NEOGATE_RATE_BURST,
+            refill_per_second=settings.NEOGATE_RATE_PER_MINUTE / 60,
+            prefix="neogate:port",
+        )
 
-    def send_ussd_request(self, gsm_port_index: int, ussd_code: str, sim_name: str = None) -> str:
-        """Send USSD request via specified GSM port."""
+    def _ussd_url(self, gsm_port_index: int, ussd_code: str) -> str:
         encoded_ussd = quote_plus(ussd_code)
-        url = (
+        return (
             f"{self.base_url}/cgi/WebCGI?"
             f"1500102=&"
             f"account={self.api_username}&"
@@ -26,41 +57,160 @@ class NeoGateTG400Client:
             f"port={gsm_port_index}&"
             f"content={encoded_ussd}"
         )
+
+    def _circuit_open(self, gsm_port_index: int, sim_name: str = None) -> bool:
+        sim_name = sim_name or self.sim_manager.sim_for_port(gsm_port_index)
+        # Claims the half-open probe, so only one new session tests a recovering SIM
+        if sim_name and not self.sim_manager.health.acquire_request(sim_name):
+            print(f"🚫 Circuit open for {sim_name}, not sending to port {gsm_port_index}")
+            return True
+        return False
+
+    @staticmethod
+    def is_transient_response(response: str) -> bool:
+        return bool(response) and any(p.lower() in response.lower() for p in settings.NEOGATE_TRANSIENT_ERRORS)
+
+    def _record_health(self, gsm_port_index: int, started: float, response: str = None, error: str = None):
+        sim_name = self.sim_manager.sim_for_port(gsm_port_index)
+        if not sim_name:
+            return
+        latency = time.monotonic() - started
+        if response is not None:
+            fatal = next((p for p in settings.SIM_FATAL_ERRORS if p.lower() in response.lower()), None)
+            failed = fatal is not None or self.is_transient_response(response)
+            self.sim_manager.health.record(sim_name, success=not failed, latency=latency, error=response if failed else None)
+        else:
+            self.sim_manager.health.record(sim_name, success=False, latency=latency, error=error)
+
+    def _resolve_sim(self, transaction_type: str, sim_name: str = None):
+        """Use the SIM the caller's lane runs on, else the configured one."""
+        if sim_name:
+            return self.sim_manager.sims[sim_name]
+        return self.sim_manager.get_sim_for_type(transaction_type)
+
+    def _deposit_code(self, recipient_phone: str, amount: float) -> str:
+        return f"*142*1*{amount}*{recipient_phone}*1*{self.orange_pin}#"
+
+    def _credit_code(self, recipient_phone: str, amount: float) -> str:
+        return f"*142*4*{recipient_phone}*{amount}*{self.orange_pin}#"
+
+    def _withdraw_code(self, agent_number: str, amount: float) -> str:
+        return f"*142*2*1*{amount}*{agent_number}*1*{self.orange_pin}#"
+
+    @staticmethod
+    def _has_confirmation_menu(response: str) -> bool:
+        return bool(response) and "Confirmer" in response and "1.Confirmer" in response
+
+    @staticmethod
+    def _asks_for_pin(response: str) -> bool:
+        return bool(response) and ("code secret" in response.lower() or "pin" in response.lower())
+
+    @staticmethod
+    def _final_status(response: str) -> str:
+        return 'success' if response and "success" in response.lower() else 'pending'
+
+    @staticmethod
+    def _no_menu_result(sim_name: str, step1_response: str) -> dict:
+        return {
+            'status': 'failed',
+            'sim_used': sim_name,
+            'response': step1_response,
+            'reason': 'No confirmation menu received'
+        }
+
+    @staticmethod
+    def _credit_result(sim_name, ussd_code, response, amount, recipient_phone) -> dict:
+        return {
+            "sim_used": sim_name,
+            "ussd_code": ussd_code,
+            "response": response,
+            "amount": amount,
+            "recipient": recipient_phone,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+
+    @staticmethod
+    def _withdraw_result(sim_name, response) -> dict:
+        return {
+            "status": "processing",
+            "message": "Withdrawal initiated. Checking confirmation in background.",
+            "sim_used": sim_name,
+            "initial_response": response
+        }
+
+
+class NeoGateTG400Client(_NeoGateBase):
+    def __init__(self):
+        super().__init__()
+        # Keep-alive connections to the gateway instead of one TCP handshake per USSD step
+        self.http = requests.Session()
+        self.http.mount("http://", HTTPAdapter(pool_maxsize=settings.NEOGATE_MAX_CONNECTIONS))
+        self.http.mount("https://", HTTPAdapter(pool_maxsize=settings.NEOGATE_MAX_CONNECTIONS))
+
+    def send_ussd_request(self, gsm_port_index: int, ussd_code: str, sim_name: str = None, rate_limited: bool = True) -> str:
+        """
+        Send USSD request via specified GSM port.
+
+        New USSD sessions take a token from the port's bucket and are refused
+        while the SIM's circuit is open; replies inside an open session (menu
+        choice, PIN) pass rate_limited=False. Every call feeds the SIM health
+        registry.
+
+        A new session that provably did not run raises TransientGatewayError;
+        any other failure returns None.
+        """
+        if rate_limited and self._circuit_open(gsm_port_index, sim_name):
+            raise TransientGatewayError(f"Circuit open for port {gsm_port_index}")
+        if rate_limited and not self.rate_limiter.acquire(str(gsm_port_index), settings.NEOGATE_RATE_MAX_WAIT):
+            print(f"⏳ Rate limit: no token for port {gsm_port_index} within {settings.NEOGATE_RATE_MAX_WAIT}s")
+            raise TransientGatewayError(f"No rate token for port {gsm_port_index}")
+
+        url = self._ussd_url(gsm_port_index, ussd_code)
         print(f"🚀 Sending USSD to port {gsm_port_index}: {ussd_code}")
         print(f"🔗 URL: {url}")
+        started = time.monotonic()
         try:
-            response = requests.get(url, timeout=30)
+            response = self.http.get(
+                url,
+                timeout=(settings.NEOGATE_CONNECT_TIMEOUT, settings.NEOGATE_READ_TIMEOUT)
+            )
             print(f"✅ Response: {response.text}")
-            return response.text
+            self._record_health(gsm_port_index, started, response=response.text)
         except requests.RequestException as e:
             print(f"❌ API Request failed: {e}")
+            self._record_health(gsm_port_index, started, error=str(e))
+            if rate_limited and _never_sent(e):
+                raise TransientGatewayError(f"NeoGate unreachable: {e}") from e
             return None
 
-    def send_deposit_with_confirmation(self, recipient_phone: str, amount: float) -> dict:
+        if rate_limited and self.is_transient_response(response.text):
+            raise TransientGatewayError(f"Transient gateway rejection: {response.text}")
+        return response.text
+
+    def send_deposit_with_confirmation(self, recipient_phone: str, amount: float, sim_name: str = None) -> dict:
         """
         Send deposit with interactive confirmation flow via USSD.
         """
-        sim_name, port_index = self.sim_manager.sims["orange_money_1"]
+        sim_name, port_index = self._resolve_sim("cashin", sim_name)
         print(f"💰 Initiating deposit of {amount} to {recipient_phone}")
 
         # Step 1: Initiate deposit (gets confirmation menu)
-        deposit_code = f"*142*1*{amount}*{recipient_phone}*1*{self.orange_pin}#"
-        step1_response = self.send_ussd_request(port_index, deposit_code)
+        step1_response = self.send_ussd_request(port_index, self._deposit_code(recipient_phone, amount))
         print(f"📋 Step 1 Response: {step1_response}")
 
         # Check for confirmation menu
-        if step1_response and "Confirmer" in step1_response and "1.Confirmer" in step1_response:
+        if self._has_confirmation_menu(step1_response):
             print("✅ Got confirmation menu, proceeding to confirm...")
 
             # Step 2: Confirm transaction
             confirmation_code = "1"  # Select "1.Confirmer"
-            step2_response = self.send_ussd_request(port_index, confirmation_code)
+            step2_response = self.send_ussd_request(port_index, confirmation_code, rate_limited=False)
             print(f"✅ Step 2 Response: {step2_response}")
 
             # Step 3: Check if PIN required after confirmation
-            if step2_response and ("code secret" in step2_response.lower() or "pin" in step2_response.lower()):
+            if self._asks_for_pin(step2_response):
                 print("🔐 PIN required, sending PIN...")
-                step3_response = self.send_ussd_request(port_index, self.orange_pin)
+                step3_response = self.send_ussd_request(port_index, self.orange_pin, rate_limited=False)
                 print(f"✅ Step 3 Response: {step3_response}")
 
                 return {
@@ -69,7 +219,7 @@ class NeoGateTG400Client:
                     'step1_response': step1_response,
                     'step2_response': step2_response,
                     'step3_response': step3_response,
-                    'final_status': 'success' if step3_response and "success" in step3_response.lower() else 'pending'
+                    'final_status': self._final_status(step3_response)
                 }
 
             return {
@@ -77,28 +227,22 @@ class NeoGateTG400Client:
                 'sim_used': sim_name,
                 'step1_response': step1_response,
                 'step2_response': step2_response,
-                'final_status': 'success' if step2_response and "success" in step2_response.lower() else 'pending'
+                'final_status': self._final_status(step2_response)
             }
 
         # Step 1 failed: no confirmation menu received
-        return {
-            'status': 'failed',
-            'sim_used': sim_name,
-            'response': step1_response,
-            'reason': 'No confirmation menu received'
-        }
-    
+        return self._no_menu_result(sim_name, step1_response)
+
 
-    def purchase_credit(self, recipient_phone: str, amount: float):
+    def purchase_credit(self, recipient_phone: str, amount: float, sim_name: str = None):
         """
         Purchase airtime/credit using USSD:
         *142*4*<phone>*<amount>*<PIN>#
         """
-        orange_pin = self.orange_pin
-        sim_name, port_index = self.sim_manager.sims["orange_money_2"]
+        sim_name, port_index = self._resolve_sim("airtime", sim_name)
 
         # Build USSD request
-        ussd_code = f"*142*4*{recipient_phone}*{amount}*{orange_pin}#"
+        ussd_code = self._credit_code(recipient_phone, amount)
 
         print(f"📱 Purchasing {amount} credit for {recipient_phone}")
         print(f"🔗 USSD Code: {ussd_code}")
@@ -109,28 +253,19 @@ class NeoGateTG400Client:
         if response is None:
             raise HTTPException(status_code=500, detail="No response from NeoGate device")
 
+        return self._credit_result(sim_name, ussd_code, response, amount, recipient_phone)
 
-        return {
-            "sim_used": sim_name,
-            "ussd_code": ussd_code,
-            "response": response,
-            "amount": amount,
-            "recipient": recipient_phone,
-            "timestamp": datetime.now(timezone.utc).isoformat()        
-        }
-    
-    def withdraw_cash(self, agent_number: str, amount: float):
+    def withdraw_cash(self, agent_number: str, amount: float, sim_name: str = None):
         """
         Initiate withdrawal and return immediately - don't wait for confirmation.
         Compatible with FastAPI + async SQLAlchemy.
         """
-        orange_pin = self.orange_pin
-        sim_name, port_index = self.sim_manager.sims["orange_money_1"]
+        sim_name, port_index = self._resolve_sim("cashout", sim_name)
 
         amount_str = str(amount)
         agent_number_str = str(agent_number)
 
-        ussd_code = f"*142*2*1*{amount_str}*{agent_number_str}*1*{orange_pin}#"
+        ussd_code = self._withdraw_code(agent_number_str, amount_str)
 
         print(f"💰 Withdrawing {amount_str} from agent {agent_number_str}")
         print(f"🔗 USSD Code: {ussd_code}")
@@ -138,11 +273,125 @@ class NeoGateTG400Client:
         # Send USSD request
         response = self.send_ussd_request(port_index, ussd_code)
 
+        return self._withdraw_result(sim_name, response)
+
+
+class AsyncNeoGateTG400Client(_NeoGateBase):
+    """
+    httpx-based NeoGate client with the same API as NeoGateTG400Client.
+
+    One instance holds a keep-alive connection pool, so a single event loop
+    can run many USSD sessions at once; the deposit session steps
+    (tasks.ussd_sessions.advance_ussd_sessions) go through it. Use it as an
+    async context manager (or call aclose()) so the pool is closed cleanly.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                settings.NEOGATE_READ_TIMEOUT,
+                connect=settings.NEOGATE_CONNECT_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=settings.NEOGATE_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.NEOGATE_MAX_KEEPALIVE,
+            ),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def _acquire_token(self, gsm_port_index: int) -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.NEOGATE_RATE_MAX_WAIT
+        while True:
+            # The Redis round trip runs off the event loop
+            wait = await asyncio.to_thread(self.rate_limiter.try_acquire, str(gsm_port_index))
+            if wait <= 0:
+                return True
+            if loop.time() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+    async def send_ussd_request(self, gsm_port_index: int, ussd_code: str, sim_name: str = None, rate_limited: bool = True) -> str:
+        """Send USSD request via specified GSM port (see NeoGateTG400Client)."""
+        if rate_limited and await asyncio.to_thread(self._circuit_open, gsm_port_index, sim_name):
+            raise TransientGatewayError(f"Circuit open for port {gsm_port_index}")
+        if rate_limited and not await self._acquire_token(gsm_port_index):
+            print(f"⏳ Rate limit: no token for port {gsm_port_index} within {settings.NEOGATE_RATE_MAX_WAIT}s")
+            raise TransientGatewayError(f"No rate token for port {gsm_port_index}")
+
+        url = self._ussd_url(gsm_port_index, ussd_code)
+        print(f"🚀 Sending USSD to port {gsm_port_index}: {ussd_code}")
+        started = time.monotonic()
+        try:
+            response = await self.http.get(url)
+            print(f"✅ Response: {response.text}")
+            await asyncio.to_thread(self._record_health, gsm_port_index, started, response.text)
+        except httpx.HTTPError as e:
+            print(f"❌ API Request failed: {e}")
+            await asyncio.to_thread(self._record_health, gsm_port_index, started, None, str(e))
+            if rate_limited and _never_sent(e):
+                raise TransientGatewayError(f"NeoGate unreachable: {e}") from e
+            return None
+
+        if rate_limited and self.is_transient_response(response.text):
+            raise TransientGatewayError(f"Transient gateway rejection: {response.text}")
+        return response.text
+
+    async def send_deposit_with_confirmation(self, recipient_phone: str, amount: float, sim_name: str = None) -> dict:
+        """Send deposit with interactive confirmation flow via USSD."""
+        sim_name, port_index = self._resolve_sim("cashin", sim_name)
+        print(f"💰 Initiating deposit of {amount} to {recipient_phone}")
+
+        step1_response = await self.send_ussd_request(port_index, self._deposit_code(recipient_phone, amount))
+        if not self._has_confirmation_menu(step1_response):
+            return self._no_menu_result(sim_name, step1_response)
+
+        step2_response = await self.send_ussd_request(port_index, "1", rate_limited=False)
+        if self._asks_for_pin(step2_response):
+            step3_response = await self.send_ussd_request(port_index, self.orange_pin, rate_limited=False)
+            return {
+                'status': 'completed',
+                'sim_used': sim_name,
+                'step1_response': step1_response,
+                'step2_response': step2_response,
+                'step3_response': step3_response,
+                'final_status': self._final_status(step3_response)
+            }
 
         return {
-            "status": "processing",
-            "message": "Withdrawal initiated. Checking confirmation in background.",
-            "sim_used": sim_name,
-            "initial_response": response
+            'status': 'completed',
+            'sim_used': sim_name,
+            'step1_response': step1_response,
+            'step2_response': step2_response,
+            'final_status': self._final_status(step2_response)
         }
 
+    async def purchase_credit(self, recipient_phone: str, amount: float, sim_name: str = None):
+        """Purchase airtime/credit using USSD: *142*4*<phone>*<amount>*<PIN>#"""
+        sim_name, port_index = self._resolve_sim("airtime", sim_name)
+        ussd_code = self._credit_code(recipient_phone, amount)
+        print(f"📱 Purchasing {amount} credit for {recipient_phone}")
+
+        response = await self.send_ussd_request(port_index, ussd_code)
+        if response is None:
+            raise HTTPException(status_code=500, detail="No response from NeoGate device")
+
+        return self._credit_result(sim_name, ussd_code, response, amount, recipient_phone)
+
+    async def withdraw_cash(self, agent_number: str, amount: float, sim_name: str = None):
+        """Initiate withdrawal and return immediately - don't wait for confirmation."""
+        sim_name, port_index = self._resolve_sim("cashout", sim_name)
+        ussd_code = self._withdraw_code(str(agent_number), str(amount))
+        print(f"💰 Withdrawing {amount} from agent {agent_number}")
+
+        response = await self.send_ussd_request(port_index, ussd_code)
+        return self._withdraw_result(sim_name, response)
@@ -1,5 +1,6 @@
 from decimal import Decimal
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timezone
 import logging
@@ -13,6 +14,7 @@ from src.models.transaction import (
     User
 )
 from src.schemas.transaction import ProcurementCreate, ProcurementAction
+from src.utils.pagination import keyset, keyset_page, explain_rows, plan_rows
 
 logger = logging.getLogger(__name__)
 
@@ -191,29 +193,30 @@ class ProcurementService:
         country_id: int = None,
         status: ProcurementStatus = None,
         limit: int = 100,
-        offset: int = 0
-    ) -> tuple[list[Procurement], int]:
-        """Get procurements with filtering and pagination"""
-        query = db.query(Procurement)
+        offset: int = 0,
+        after: str = None,
+        before: str = None,
+        with_total: bool = False
+    ) -> dict:
+        """Get procurements with filtering and keyset pagination on (initiation_date, id)"""
+        query = select(Procurement)
         
         if company_id:
-            query = query.filter(Procurement.company_id == company_id)
+            query = query.where(Procurement.company_id == company_id)
         
         if country_id:
-            query = query.filter(Procurement.country_id == country_id)
+            query = query.where(Procurement.country_id == country_id)
         
         if status:
-            query = query.filter(Procurement.status == status)
+            query = query.where(Procurement.status == status)
         
-        # Get total count
-        total = query.count()
+        # Planner estimate instead of a COUNT(*) over every matching row
+        total = plan_rows(db.scalar(explain_rows(query))) if with_total else None
         
-        # Apply pagination
-        procurements = query.order_by(
-            Procurement.initiation_date.desc()
-        ).offset(offset).limit(limit).all()
+        stmt = keyset(query, Procurement.initiation_date, Procurement.id, limit, after, before, offset=offset)
+        procurements = db.scalars(stmt.options(selectinload(Procurement.balance))).all()
         
-        return procurements, total
+        return {**keyset_page(procurements, limit, "initiation_date", before, after), "total": total}
     
     @staticmethod
     def get_procurement_summary(db: Session, company_id: int = None) -> dict:
@@ -0,0 +1,38 @@
+import logging
+from src.core.redis_client import get_redis
+from src.services.sim_manager import SIMManager
+
+logger = logging.getLogger(__name__)
+
+LANE_TASK = "src.tasks.transaction_queue.process_sim_lane"
+
+
+def lane_dirty_key(sim_name: str) -> str:
+    return f"queue:lane:{sim_name}:dirty"
+
+
+def wake_lane(sim_name: str) -> None:
+    """Start (or flag for another run) the lane of one SIM; failures are only logged."""
+    try:
+        get_redis().set(lane_dirty_key(sim_name), 1)
+
+        from src.worker_app import celery_app
+        celery_app.send_task(LANE_TASK, args=[sim_name])
+    except Exception as e:
+        logger.warning(f"Could not wake queue lane {sim_name}: {e}")
+
+
+def wake_queue_lane(transaction_type: str) -> None:
+    """
+    Tell the lane serving this transaction type that new work is queued.
+
+    The dirty flag lets a lane that is already running pick the row up
+    before it stops; the task message starts the lane if it is idle. Any
+    failure here is only logged: the beat sweep still finds the row.
+    """
+    try:
+        sim_name, _ = SIMManager().get_sim_for_type(transaction_type)
+    except Exception as e:
+        logger.warning(f"Could not wake queue lane for {transaction_type}: {e}")
+        return
+    wake_lane(sim_name)
@@ -0,0 +1,84 @@
+import logging
+import threading
+import time
+from redis.exceptions import RedisError
+from src.core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+# KEYS[1] = bucket key, ARGV[1] = capacity, ARGV[2] = refill rate (tokens/s).
+# Returns "0" when a token was taken, otherwise the seconds to wait for one.
+# Uses the Redis clock so every worker sees the same time.
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """
+    Token bucket shared by all processes through Redis.
+
+    If Redis is unreachable it degrades to a per-process bucket with the same
+    parameters, so the gateway is still protected, just not globally.
+    """
+
+    def __init__(self, capacity: int, refill_per_second: float, prefix: str = "ratelimit"):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.prefix = prefix
+        self._script = None
+        self._local = {}
+        self._local_lock = threading.Lock()
+
+    def _try_redis(self, key: str) -> float:
+        if self._script is None:
+            self._script = get_redis().register_script(TOKEN_BUCKET_LUA)
+        wait = self._script(keys=[f"{self.prefix}:{key}"], args=[self.capacity, self.refill_per_second])
+        return float(wait)
+
+    def _try_local(self, key: str) -> float:
+        with self._local_lock:
+            now = time.monotonic()
+            tokens, ts = self._local.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - ts) * self.refill_per_second)
+            if tokens >= 1:
+                self._local[key] = (tokens - 1, now)
+                return 0.0
+            self._local[key] = (tokens, now)
+            return (1 - tokens) / self.refill_per_second
+
+    def try_acquire(self, key: str) -> float:
+        """Take a token if one is available; return 0 or the seconds to wait."""
+        try:
+            return self._try_redis(key)
+        except RedisError as e:
+            logger.warning(f"Rate limiter falling back to in-process bucket for {key}: {e}")
+            return self._try_local(key)
+
+    def acquire(self, key: str, max_wait: float) -> bool:
+        """Block until a token is taken, or give up after max_wait seconds."""
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.try_acquire(key)
+            if wait <= 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
@@ -1,25 +1,183 @@
 from src.core.config import settings
+from src.core.constants import transaction_type_key
+from src.core.redis_client import get_redis
+from redis.exceptions import RedisError
+import logging
 import random
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class SIMHealthRegistry:
+    """
+    Health of each SIM shared by all workers (Redis hash per SIM).
+
+    Tracks an error-rate and latency EWMA, the last gateway error and a
+    circuit breaker: CLOSED -> OPEN after repeated failures or a fatal error
+    such as "Operation is not supported", OPEN -> HALF_OPEN after a cooldown
+    (one probe allowed), HALF_OPEN -> CLOSED on success or back to OPEN.
+    Falls back to process-local state when Redis is unreachable.
+
+    The half-open probe is claimed atomically (SET NX EX) by acquire_request()
+    before a new USSD session goes out; every other caller is refused until
+    record() closes or reopens the circuit. A probe whose worker died lapses
+    after SIM_CIRCUIT_COOLDOWN.
+    """
+
+    def __init__(self):
+        self._local = {}
+        self._local_probes = {}
+
+    @staticmethod
+    def _key(sim_name: str) -> str:
+        return f"sim:health:{sim_name}"
+
+    @staticmethod
+    def _probe_key(sim_name: str) -> str:
+        return f"sim:probe:{sim_name}"
+
+    def get(self, sim_name: str) -> dict:
+        try:
+            raw = get_redis().hgetall(self._key(sim_name))
+        except RedisError:
+            raw = self._local.get(sim_name, {})
+        return {
+            "state": raw.get("state", CLOSED),
+            "error_ewma": float(raw.get("error_ewma", 0)),
+            "latency_ewma": float(raw.get("latency_ewma", 0)),
+            "consecutive_failures": int(raw.get("consecutive_failures", 0)),
+            "opened_at": float(raw.get("opened_at", 0)),
+            "last_error": raw.get("last_error", ""),
+            "last_error_at": float(raw.get("last_error_at", 0)),
+        }
+
+    def _save(self, sim_name: str, health: dict):
+        mapping = {k: v for k, v in health.items() if v is not None}
+        try:
+            get_redis().hset(self._key(sim_name), mapping=mapping)
+        except RedisError:
+            self._local[sim_name] = {k: str(v) for k, v in mapping.items()}
+
+    def state(self, sim_name: str) -> str:
+        """Current circuit state, moving OPEN to HALF_OPEN once the cooldown passed."""
+        health = self.get(sim_name)
+        if health["state"] == OPEN and time.time() - health["opened_at"] >= settings.SIM_CIRCUIT_COOLDOWN:
+            health["state"] = HALF_OPEN
+            self._save(sim_name, health)
+            print(f"🟡 {sim_name} circuit half-open, allowing a probe")
+        return health["state"]
+
+    def _probe_taken(self, sim_name: str) -> bool:
+        try:
+            return bool(get_redis().exists(self._probe_key(sim_name)))
+        except RedisError:
+            return self._local_probes.get(sim_name, 0) > time.time()
+
+    def _claim_probe(self, sim_name: str) -> bool:
+        try:
+            return bool(get_redis().set(self._probe_key(sim_name), 1, nx=True, ex=settings.SIM_CIRCUIT_COOLDOWN))
+        except RedisError:
+            if self._local_probes.get(sim_name, 0) > time.time():
+                return False
+            self._local_probes[sim_name] = time.time() + settings.SIM_CIRCUIT_COOLDOWN
+            return True
+
+    def _clear_probe(self, sim_name: str):
+        self._local_probes.pop(sim_name, None)
+        try:
+            get_redis().delete(self._probe_key(sim_name))
+        except RedisError:
+            pass
+
+    def allows_request(self, sim_name: str) -> bool:
+        """Whether the SIM can take new work (routing, lanes); claims nothing."""
+        state = self.state(sim_name)
+        if state == HALF_OPEN:
+            return not self._probe_taken(sim_name)
+        return state == CLOSED
+
+    def acquire_request(self, sim_name: str) -> bool:
+        """Permission to send a new USSD session now; in HALF_OPEN only the probe's claimer gets it."""
+        state = self.state(sim_name)
+        if state != HALF_OPEN:
+            return state == CLOSED
+        if not self._claim_probe(sim_name):
+            return False
+        print(f"🟡 {sim_name} probe claimed")
+        return True
+
+    def record(self, sim_name: str, success: bool, latency: float, error: str = None):
+        # Each port carries one USSD session at a time, so read-modify-write is safe here
+        health = self.get(sim_name)
+        probing = health["state"] == HALF_OPEN
+        alpha = settings.SIM_HEALTH_EWMA_ALPHA
+        health["error_ewma"] = alpha * (0 if success else 1) + (1 - alpha) * health["error_ewma"]
+        health["latency_ewma"] = alpha * latency + (1 - alpha) * health["latency_ewma"] if health["latency_ewma"] else latency
+
+        if success:
+            health["consecutive_failures"] = 0
+            if health["state"] != CLOSED:
+                print(f"✅ {sim_name} circuit closed")
+            health["state"] = CLOSED
+        else:
+            health["consecutive_failures"] += 1
+            health["last_error"] = (error or "no response")[:200]
+            health["last_error_at"] = time.time()
+            fatal = any(p.lower() in (error or "").lower() for p in settings.SIM_FATAL_ERRORS)
+            if (
+                fatal
+                or health["state"] == HALF_OPEN
+                or health["consecutive_failures"] >= settings.SIM_CIRCUIT_FAILURE_THRESHOLD
+                or health["error_ewma"] >= settings.SIM_CIRCUIT_ERROR_RATE
+            ):
+                if health["state"] != OPEN:
+                    print(f"🚫 {sim_name} circuit opened: {health['last_error']}")
+                health["state"] = OPEN
+                health["opened_at"] = time.time()
+
+        self._save(sim_name, health)
+        if probing and health["state"] != HALF_OPEN:
+            # Probe answered: the next half-open period gets a fresh one
+            self._clear_probe(sim_name)
+
+    def force(self, sim_name: str, state: str):
+        health = self.get(sim_name)
+        health["state"] = state
+        if state == OPEN:
+            health["opened_at"] = time.time()
+        else:
+            health["consecutive_failures"] = 0
+            health["error_ewma"] = 0
+        self._save(sim_name, health)
+        self._clear_probe(sim_name)
 
 
 class SIMManager:
     def __init__(self):
         self.sims = settings.MOBILE_MONEY_SIMS
         self.config = getattr(settings, 'SIM_CONFIG', {})
-        self.failed_sims = set()
+        self.routing = getattr(settings, 'SIM_ROUTING', {})
+        self.health = SIMHealthRegistry()
         self.current_index = 0  # 0 or 1 for 2 SIMs
 
     def get_available_sims(self):
-        """Get SIMs that haven't failed"""
-        return {name: port for name, port in self.sims.items() 
-                if name not in self.failed_sims}
+        """Get SIMs whose circuit is not open"""
+        return {name: port for name, port in self.sims.items()
+                if self.health.allows_request(name)}
+
+    def sim_for_port(self, port_index: int):
+        return next((name for name, (_, port) in self.sims.items() if port == port_index), None)
 
     def get_sim_round_robin(self):
         """Simple toggle between 2 SIMs"""
         available_sims = list(self.get_available_sims().items())
         
         if not available_sims:
-            self.failed_sims.clear()
             available_sims = list(self.sims.items())
         
         # Simple toggle: 0→1, 1→0
@@ -37,7 +195,6 @@ class SIMManager:
         available_sims = list(self.get_available_sims().items())
         
         if not available_sims:
-            self.failed_sims.clear()
             available_sims = list(self.sims.items())
         
         sim_name, port_index = random.choice(available_sims)
@@ -61,16 +218,53 @@ class SIMManager:
             if available:
                 return random.choice(available)
             else:
-                self.failed_sims.clear()
                 return primary, self.sims[primary]
 
+    def get_sim_for_type(self, transaction_type):
+        """
+        Healthiest SIM allowed to serve a transaction type (see SIM_ROUTING).
+
+        Candidates with an open circuit are skipped; among the rest the lowest
+        error EWMA wins, then latency, then configured preference order.
+        """
+        name = self.pick_sim_name(transaction_type)
+        if not name:
+            raise ValueError(f"No healthy SIM available for transaction type '{transaction_type}'")
+        return self.sims[name]
+
+    def pick_sim_name(self, transaction_type):
+        tx_type = transaction_type_key(transaction_type)
+        candidates = self.routing.get(tx_type, [])
+        healthy = [
+            (self.health.get(name), position, name)
+            for position, name in enumerate(candidates)
+            if self.health.allows_request(name)
+        ]
+        if not healthy:
+            return None
+        _, _, name = min(
+            healthy,
+            key=lambda h: (round(h[0]["error_ewma"], 1), round(h[0]["latency_ewma"]), h[1])
+        )
+        return name
+
+    def lane_types(self, sim_name):
+        """Transaction types currently routed to this SIM's queue lane"""
+        return [
+            tx_type for tx_type in self.routing
+            if self.pick_sim_name(tx_type) == sim_name
+        ]
+
+    def lanes(self):
+        """SIMs that currently own at least one transaction type"""
+        return [name for name in self.sims if self.lane_types(name)]
+
     def mark_sim_failed(self, sim_name):
-        """Mark SIM as failed"""
-        self.failed_sims.add(sim_name)
+        """Mark SIM as failed (opens its circuit for every worker)"""
+        self.health.force(sim_name, OPEN)
         print(f"🚫 Marked {sim_name} as failed")
 
     def mark_sim_recovered(self, sim_name):
-        """Mark SIM as recovered"""
-        if sim_name in self.failed_sims:
-            self.failed_sims.remove(sim_name)
-            print(f"✅ Marked {sim_name} as recovered")
\ No newline at end of file
+        """Mark SIM as recovered (closes its circuit for every worker)"""
+        self.health.force(sim_name, CLOSED)
+        print(f"✅ Marked {sim_name} as recovered")
\ No newline at end of file
@@ -1,10 +1,26 @@
+import asyncio
+import hashlib
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timezone, timedelta
 from fastapi import HTTPException, status
 from typing import List, Optional
-from sqlalchemy import or_, func
+from pydantic import ValidationError
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 from src.models.transaction import User
+from src.services.queue_notifier import wake_queue_lane
+from src.services.fee_service import invalidate_fee_rules
+from src.services.msisdn_router import invalidate_routing_table
+from src.utils.pagination import keyset, keyset_page, explain_rows, plan_rows
+from src.services.blackout import (
+    BLACKOUT_TIMES,
+    acquire_blackout_slot,
+    acquire_blackout_slots,
+    release_blackout_slot,
+)
 
 
 # MODELS
@@ -13,6 +29,7 @@ from src.models.transaction import (
     WithdrawalTransaction,
     AirtimePurchase,
     PendingTransaction,
+    TransactionType,
     Country,
     CompanyCountryBalance,
     Company,
@@ -24,6 +41,7 @@ from src.schemas.transaction import (
     DepositCreate,
     WithdrawalCreate,
     AirtimeCreate,
+    BulkTransactionCreate,
     CountryCreate,
     CountryUpdate,
     CompanyCreate,
@@ -33,13 +51,6 @@ from src.schemas.transaction import (
 )
 
 
-# Minimum intervals
-BLACKOUT_TIMES = {
-    "CASHIN": timedelta(minutes=10),
-    "CASHOUT": timedelta(minutes=10),
-    "AIRTIME": timedelta(minutes=4),
-}
-
 def ussd_is_failure(text: str | None) -> bool:
     if not text:
         return True
@@ -64,39 +75,85 @@ def ussd_is_failure(text: str | None) -> bool:
     return any(p in text_l for p in failure_patterns)
 
 
-def check_blackout(db: Session, model, msisdn: str, tx_type: str) -> bool:
-    interval = BLACKOUT_TIMES.get(tx_type)
-    if not interval:
-        return False
+# ====================================================
+# IDEMPOTENCY
+# ====================================================
+IDEMPOTENCY_REPLAY_WAITS = (0.1, 0.25, None)
 
-    msisdn = msisdn.strip()
 
-    last_tx = (
-        db.query(model)
-        .filter(model.status.in_(["created", "initiated", "pending", "processing"]))
-        .filter((model.recipient == msisdn) if tx_type != "CASHOUT" else (model.sender == msisdn))
-        .order_by(model.created_at.desc())
-        .first()
-    )
+def request_fingerprint(payload) -> str:
+    return hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
 
-    if last_tx:
-        if last_tx.created_at.tzinfo is None:
-            last_created = last_tx.created_at.replace(tzinfo=timezone.utc)
-        else:
-            last_created = last_tx.created_at
 
-        now = datetime.now(timezone.utc)
-        if (now - last_created) < interval:
-            return True
+async def find_idempotent_request(db: AsyncSession, company_id: int, idempotency_key: Optional[str], request_hash: str):
+    """Request already queued under this key, if any (one unique-index lookup)."""
+    if not idempotency_key:
+        return None
+    existing = (await db.execute(
+        select(PendingTransaction).where(
+            PendingTransaction.company_id == company_id,
+            PendingTransaction.idempotency_key == idempotency_key
+        )
+    )).scalars().first()
+    if existing and existing.request_hash != request_hash:
+        raise HTTPException(
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            "Idempotency-Key was already used with a different request"
+        )
+    return existing
 
-    return False
+
+async def queue_pending_transaction(db: AsyncSession, pending: PendingTransaction) -> PendingTransaction:
+    company_id, idempotency_key, request_hash = pending.company_id, pending.idempotency_key, pending.request_hash
+    tx_type, msisdn = pending.transaction_type, pending.msisdn
+    db.add(pending)
+    try:
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        if isinstance(e, IntegrityError) and idempotency_key:
+            # A concurrent retry with the same key inserted first; the blackout
+            # slot belongs to that request, so it is not released here
+            existing = await find_idempotent_request(db, company_id, idempotency_key, request_hash)
+            if existing:
+                return existing
+        await run_in_threadpool(release_blackout_slot, tx_type, msisdn)
+        raise
+    await db.refresh(pending)
+
+    # Redis flag + broker publish are blocking calls
+    await run_in_threadpool(wake_queue_lane, pending.transaction_type)
+    return pending
+
+
+async def find_blackout_winner(db: AsyncSession, company_id: int, idempotency_key: Optional[str], request_hash: str):
+    """
+    After a lost blackout claim: the request that won it, if it was a concurrent
+    retry with the same Idempotency-Key. The winner claims the slot before it
+    commits, so give it a moment to land.
+    """
+    if not idempotency_key:
+        return None
+    for delay in IDEMPOTENCY_REPLAY_WAITS:
+        existing = await find_idempotent_request(db, company_id, idempotency_key, request_hash)
+        if existing or delay is None:
+            return existing
+        await asyncio.sleep(delay)
 
 
 # ====================================================
 # DEPOSIT (QUEUE MODE)
 # ====================================================
-async def create_deposit(db: Session, deposit: DepositCreate):
-    if check_blackout(db, DepositTransaction, deposit.recipient, "cashin"):
+async def create_deposit(db: AsyncSession, deposit: DepositCreate, idempotency_key: Optional[str] = None):
+    request_hash = request_fingerprint(deposit)
+    existing = await find_idempotent_request(db, deposit.company_id, idempotency_key, request_hash)
+    if existing:
+        return existing
+
+    if not await acquire_blackout_slot(db, DepositTransaction, deposit.recipient, "CASHIN"):
+        existing = await find_blackout_winner(db, deposit.company_id, idempotency_key, request_hash)
+        if existing:
+            return existing
         raise Exception("Deposit blackout: please wait 10 minutes.")
 
     pending = PendingTransaction(
@@ -107,19 +164,25 @@ async def create_deposit(db: Session, deposit: DepositCreate):
         country_iso=deposit.destination_country_iso,
         company_id=deposit.company_id,  # <-- THIS IS REQUIRED
         status="pending",
+        idempotency_key=idempotency_key,
+        request_hash=request_hash,
     )
-    db.add(pending)
-    db.commit()
-    db.refresh(pending)
-
-    return pending
+    return await queue_pending_transaction(db, pending)
 
 
 # ====================================================
 # WITHDRAWAL (QUEUE MODE)
 # ====================================================
-async def initiate_withdrawal_transaction(db: Session, withdrawal: WithdrawalCreate):
-    if check_blackout(db, WithdrawalTransaction, withdrawal.sender, "CASHOUT"):
+async def initiate_withdrawal_transaction(db: AsyncSession, withdrawal: WithdrawalCreate, idempotency_key: Optional[str] = None):
+    request_hash = request_fingerprint(withdrawal)
+    existing = await find_idempotent_request(db, withdrawal.company_id, idempotency_key, request_hash)
+    if existing:
+        return existing
+
+    if not await acquire_blackout_slot(db, WithdrawalTransaction, withdrawal.sender, "CASHOUT"):
+        existing = await find_blackout_winner(db, withdrawal.company_id, idempotency_key, request_hash)
+        if existing:
+            return existing
         raise Exception("Withdrawal blackout: please wait 10 minutes.")
 
     pending = PendingTransaction(
@@ -130,19 +193,25 @@ async def initiate_withdrawal_transaction(db: Session, withdrawal: WithdrawalCre
         country_iso=withdrawal.destination_country_iso,
         company_id=withdrawal.company_id,
         status="pending",
+        idempotency_key=idempotency_key,
+        request_hash=request_hash,
     )
-    db.add(pending)
-    db.commit()
-    db.refresh(pending)
-
-    return pending
+    return await queue_pending_transaction(db, pending)
 
 
 # ====================================================
 # AIRTIME (QUEUE MODE)
 # ====================================================
-async def create_airtime_purchase(db: Session, airtime: AirtimeCreate):
-    if check_blackout(db, AirtimePurchase, airtime.recipient, "AIRTIME"):
+async def create_airtime_purchase(db: AsyncSession, airtime: AirtimeCreate, idempotency_key: Optional[str] = None):
+    request_hash = request_fingerprint(airtime)
+    existing = await find_idempotent_request(db, airtime.company_id, idempotency_key, request_hash)
+    if existing:
+        return existing
+
+    if not await acquire_blackout_slot(db, AirtimePurchase, airtime.recipient, "AIRTIME"):
+        existing = await find_blackout_winner(db, airtime.company_id, idempotency_key, request_hash)
+        if existing:
+            return existing
         raise Exception("Airtime blackout: wait 4 minutes.")
 
     pending = PendingTransaction(
@@ -153,65 +222,200 @@ async def create_airtime_purchase(db: Session, airtime: AirtimeCreate):
         country_iso=airtime.destination_country_iso,
         company_id=airtime.company_id,
         status="pending",
+        idempotency_key=idempotency_key,
+        request_hash=request_hash,
     )
-    db.add(pending)
-    db.commit()
-    db.refresh(pending)
+    return await queue_pending_transaction(db, pending)
+
+# ====================================================
+# BULK DEPOSIT / AIRTIME (QUEUE MODE)
+# ====================================================
+BULK_TYPES = {
+    TransactionType.CASHIN: (DepositCreate, DepositTransaction, "CASHIN"),
+    TransactionType.AIRTIME: (AirtimeCreate, AirtimePurchase, "AIRTIME"),
+}
+
+
+def create_bulk_transactions(db: Session, payload: BulkTransactionCreate) -> dict:
+    """
+    Queue many deposit/airtime items at once.
+
+    Items are validated against the single-item schemas, blackout windows are
+    claimed with one Redis pipeline per transaction type, and accepted items go
+    in as one multi-row INSERT. A recipient may appear once per type per batch.
+    """
+    results = [None] * len(payload.items)
+    accepted = []  # (index, validated item, transaction type)
+
+    for index, raw in enumerate(payload.items):
+        try:
+            tx_type = TransactionType(str(raw.get("transaction_type", "")).lower())
+            schema = BULK_TYPES[tx_type][0]
+            item = schema.model_validate({**raw, "transaction_type": tx_type, "company_id": payload.company_id})
+        except ValidationError as e:
+            error = e.errors()[0]
+            field = ".".join(str(part) for part in error["loc"])
+            results[index] = {"index": index, "status": "rejected", "error": f"{field}: {error['msg']}"}
+            continue
+        except (ValueError, KeyError):
+            results[index] = {"index": index, "status": "rejected", "error": "transaction_type must be cashin or airtime"}
+            continue
+        accepted.append((index, item, tx_type))
+
+    rows, row_indexes = [], []
+    try:
+        for tx_type, (_, model, blackout_type) in BULK_TYPES.items():
+            typed = [(index, item) for index, item, t in accepted if t == tx_type]
+            blocked = acquire_blackout_slots(db, model, [item.recipient for _, item in typed], blackout_type)
+            seen = set()
+            for index, item in typed:
+                recipient = item.recipient.strip()
+                if recipient in blocked:
+                    results[index] = {"index": index, "status": "rejected", "error": "Recipient in blackout window"}
+                    continue
+                if recipient in seen:
+                    results[index] = {"index": index, "status": "rejected", "error": "Duplicate recipient in batch"}
+                    continue
+                seen.add(recipient)
+                row_indexes.append(index)
+                rows.append({
+                    "transaction_type": tx_type,
+                    "msisdn": recipient,
+                    "amount": item.amount,
+                    "partner_id": item.partner_id,
+                    "country_iso": item.destination_country_iso,
+                    "company_id": payload.company_id,
+                    "status": "pending",
+                })
+    except Exception:
+        # Slots already claimed for an earlier transaction type
+        for row in rows:
+            release_blackout_slot(row["transaction_type"], row["msisdn"])
+        raise
+
+    if rows:
+        try:
+            ids = db.scalars(
+                insert(PendingTransaction).returning(PendingTransaction.id, sort_by_parameter_order=True),
+                rows
+            ).all()
+            db.commit()
+        except Exception:
+            db.rollback()
+            for row in rows:
+                release_blackout_slot(row["transaction_type"], row["msisdn"])
+            raise
+        for index, pending_id in zip(row_indexes, ids):
+            results[index] = {"index": index, "status": "queued", "pending_transaction_id": pending_id}
+        for tx_type in {row["transaction_type"] for row in rows}:
+            wake_queue_lane(tx_type)
+
+    queued = len(rows)
+    return {
+        "total": len(results),
+        "queued": queued,
+        "rejected": len(results) - queued,
+        "results": results,
+    }
+
+
+# ====================================================
+# QUEUE DEPTH METRICS
+# ====================================================
+def get_queue_depth(db: Session, company_id: Optional[int] = None) -> list:
+    """Pending/processing counts and oldest pending age per company and transaction type."""
+    query = db.query(
+        PendingTransaction.company_id,
+        PendingTransaction.transaction_type,
+        func.count().filter(PendingTransaction.status == "pending").label("pending"),
+        func.count().filter(PendingTransaction.status == "processing").label("processing"),
+        func.min(PendingTransaction.created_at).filter(PendingTransaction.status == "pending").label("oldest_pending"),
+    ).filter(
+        PendingTransaction.status.in_(["pending", "processing"])
+    )
+    if company_id is not None:
+        query = query.filter(PendingTransaction.company_id == company_id)
+
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "company_id": row.company_id,
+            "transaction_type": row.transaction_type,
+            "pending": row.pending,
+            "processing": row.processing,
+            "oldest_pending_seconds": int((now - row.oldest_pending).total_seconds()) if row.oldest_pending else None,
+        }
+        for row in query.group_by(PendingTransaction.company_id, PendingTransaction.transaction_type)
+        .order_by(PendingTransaction.company_id)
+        .all()
+    ]
 
-    return pending
 
 # ++++++++++++++++++ GET REQUEST FOR DEPOSIT, AIRTIME, WITHDRAWAL +++++++++++++++++++++++++++++++++++++++++++
 
-def get_deposit_transactions(
-    db: Session,
+async def _list_page(db: AsyncSession, query, model, limit: int, after, before, with_total: bool) -> dict:
+    """Keyset page on (created_at, id), newest first; total is the planner's estimate."""
+    total = plan_rows(await db.scalar(explain_rows(query))) if with_total else None
+    stmt = keyset(query, model.created_at, model.id, limit, after, before)
+    rows = (await db.execute(stmt)).scalars().all()
+    return {**keyset_page(rows, limit, "created_at", before, after), "total": total}
+
+async def get_deposit_transactions(
+    db: AsyncSession,
     recipient: Optional[str] = None,
     partner_id: Optional[int] = None,
     status: Optional[str] = None,
     limit: int = 50,
-    offset: int = 0
-) -> List[DepositTransaction]:
-    query = db.query(DepositTransaction)
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    with_total: bool = False
+) -> dict:
+    query = select(DepositTransaction)
     if recipient:
-        query = query.filter(DepositTransaction.recipient == recipient)
+        query = query.where(DepositTransaction.recipient == recipient)
     if partner_id:
-        query = query.filter(DepositTransaction.partner_id == partner_id)
+        query = query.where(DepositTransaction.partner_id == partner_id)
     if status:
-        query = query.filter(DepositTransaction.status == status)
-    return query.order_by(DepositTransaction.id.desc()).limit(limit).offset(offset).all()
+        query = query.where(DepositTransaction.status == status)
+    return await _list_page(db, query, DepositTransaction, limit, after, before, with_total)
 
-def get_withdrawal_transactions(
-    db: Session,
+async def get_withdrawal_transactions(
+    db: AsyncSession,
     sender: Optional[str] = None,
     partner_id: Optional[int] = None,
     status: Optional[str] = None,
     limit: int = 50,
-    offset: int = 0
-) -> List[WithdrawalTransaction]:
-    query = db.query(WithdrawalTransaction)
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    with_total: bool = False
+) -> dict:
+    query = select(WithdrawalTransaction)
     if sender:
-        query = query.filter(WithdrawalTransaction.sender == sender)
+        query = query.where(WithdrawalTransaction.sender == sender)
     if partner_id:
-        query = query.filter(WithdrawalTransaction.partner_id == partner_id)
+        query = query.where(WithdrawalTransaction.partner_id == partner_id)
     if status:
-        query = query.filter(WithdrawalTransaction.status == status)
-    return query.order_by(WithdrawalTransaction.id.desc()).limit(limit).offset(offset).all()
+        query = query.where(WithdrawalTransaction.status == status)
+    return await _list_page(db, query, WithdrawalTransaction, limit, after, before, with_total)
 
-def get_airtime_purchase_transactions(
-    db: Session,
+async def get_airtime_purchase_transactions(
+    db: AsyncSession,
     recipient: Optional[str] = None,
     partner_id: Optional[int] = None,
     status: Optional[str] = None,
     limit: int = 50,
-    offset: int = 0
-) -> List[AirtimePurchase]:
-    query = db.query(AirtimePurchase)
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    with_total: bool = False
+) -> dict:
+    query = select(AirtimePurchase)
     if recipient:
-        query = query.filter(AirtimePurchase.recipient == recipient)
+        query = query.where(AirtimePurchase.recipient == recipient)
     if partner_id:
-        query = query.filter(AirtimePurchase.partner_id == partner_id)
+        query = query.where(AirtimePurchase.partner_id == partner_id)
     if status:
-        query = query.filter(AirtimePurchase.status == status)
-    return query.order_by(AirtimePurchase.id.desc()).limit(limit).offset(offset).all()
+        query = query.where(AirtimePurchase.status == status)
+    return await _list_page(db, query, AirtimePurchase, limit, after, before, with_total)
 
 
 # ++++++++++++++++++ COUNTRY SERVICE LAYER +++++++++++++++++++++++++++++++++++++++++++
@@ -221,6 +425,7 @@ def create_country(db: Session, data: CountryCreate):
     db.add(country)
     db.commit()
     db.refresh(country)
+    invalidate_routing_table()
     return country
 
 def list_countries(db: Session):
@@ -237,6 +442,7 @@ def update_country(db: Session, country_id: int, data: CountryUpdate):
         setattr(country, key, value)
     db.commit()
     db.refresh(country)
+    invalidate_routing_table()
     return country
 
 
@@ -503,6 +709,8 @@ def update_or_version_fee_config(
 
         db.commit()
         db.refresh(config)
+        if "is_active" in data.model_fields_set:
+            invalidate_fee_rules()
         return config
 
     # ==========================
@@ -535,6 +743,8 @@ def update_or_version_fee_config(
         db.add(new_config)
         db.commit()
         db.refresh(new_config)
+        # The approved config was deactivated above
+        invalidate_fee_rules()
         return new_config
 
     # ==========================
@@ -570,4 +780,5 @@ def approve_fee_config(db: Session, config_id: int, user: User):
 
     db.commit()
     db.refresh(config)
+    invalidate_fee_rules()
     return config
@@ -0,0 +1,185 @@
+# src/services/ussd_session.py
+import logging
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import update, exists
+from sqlalchemy.orm import Session
+from src.core.config import settings
+from src.models.transaction import UssdSession, UssdSessionState as S, DepositTransaction
+
+logger = logging.getLogger(__name__)
+
+STEP_TASK = "src.tasks.ussd_sessions.advance_ussd_sessions"
+
+
+class DepositSessionMachine:
+    """
+    Step-by-step USSD deposit (*142*1...# -> "1" -> PIN) persisted in ussd_sessions.
+
+    Every step is two compare-and-set transitions around one gateway call:
+    the "sending" state is committed before the USSD request and the result
+    state after it. A session found in a sending state by anyone other than
+    the worker that set it means that worker died mid-request.
+
+    Money only moves once the confirmation ("1") or the PIN has been sent, so
+    a session that stops before CONFIRMING (or in PIN_REQUESTED) can be failed
+    and its hold released straight away. CONFIRMING/SENDING_PIN are ambiguous
+    and are left to the confirmation email.
+
+    Steps are independent: each one runs as its own task from the persisted
+    state (see tasks.ussd_sessions.advance_ussd_sessions), so nothing blocks
+    between the USSD round trips. A GSM port carries one USSD session at a
+    time, so an unfinished session keeps its SIM's lane from opening another
+    one (port_busy).
+    """
+
+    TERMINAL = {S.COMPLETED.value, S.FAILED.value, S.EXPIRED.value}
+    IN_FLIGHT = {S.INITIATING.value, S.CONFIRMING.value, S.SENDING_PIN.value}
+    SAFE_TO_FAIL = {S.NEW.value, S.INITIATING.value, S.MENU_RECEIVED.value, S.PIN_REQUESTED.value}
+    RESUMABLE = {S.NEW.value, S.MENU_RECEIVED.value, S.PIN_REQUESTED.value}
+    # Resumable state -> state committed while its USSD request is out
+    SENDING = {
+        S.NEW.value: S.INITIATING.value,
+        S.MENU_RECEIVED.value: S.CONFIRMING.value,
+        S.PIN_REQUESTED.value: S.SENDING_PIN.value,
+    }
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def _deadline() -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=settings.USSD_STEP_TIMEOUT_SECONDS)
+
+    @staticmethod
+    def start(db: Session, transaction: DepositTransaction, sim_name: str, port_index: int,
+              commit: bool = True) -> UssdSession:
+        session = UssdSession(
+            deposit_transaction_id=transaction.id,
+            pending_transaction_id=transaction.pending_transaction_id,
+            sim_name=sim_name,
+            port_index=port_index,
+            state=S.NEW.value,
+            expires_at=DepositSessionMachine._deadline(),
+        )
+        db.add(session)
+        if commit:
+            db.commit()
+            db.refresh(session)
+        else:
+            db.flush()
+        return session
+
+    @staticmethod
+    def transition(db: Session, session: UssdSession, expected: str, new: str, commit: bool = True, **fields) -> bool:
+        """
+        Move expected -> new atomically; False if someone else moved it first.
+
+        commit=False leaves the update in the caller's transaction so it can
+        commit together with other changes (e.g. failing the deposit).
+        """
+        moved = db.execute(
+            update(UssdSession)
+            .where(UssdSession.id == session.id, UssdSession.state == expected)
+            .values(state=new, expires_at=DepositSessionMachine._deadline(), **fields)
+            .returning(UssdSession.id)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if not commit:
+            return moved is not None
+        db.commit()
+        db.refresh(session)
+        if moved is None:
+            logger.warning(f"USSD session {session.id}: expected {expected}, found {session.state}")
+        return moved is not None
+
+    @staticmethod
+    def port_busy(db: Session, sim_name: str) -> bool:
+        """True while an unfinished deposit session holds the SIM's port."""
+        return db.query(
+            exists().where(UssdSession.sim_name == sim_name, UssdSession.state.notin_(DepositSessionMachine.TERMINAL))
+        ).scalar()
+
+    def begin_step(self, db: Session, session: UssdSession):
+        """
+        Commit the sending state of the session's next step.
+
+        Returns (ussd_code, rate_limited) for the caller to send, or None when
+        the session has no step to run or someone else moved it first.
+        """
+        state = session.state
+        sending = self.SENDING.get(state)
+        if sending is None or not self.transition(db, session, state, sending):
+            return None
+        if sending == S.INITIATING.value:
+            tx = session.deposit_transaction
+            return self.client._deposit_code(tx.recipient, int(tx.amount)), True
+        if sending == S.CONFIRMING.value:
+            return "1", False
+        return self.client.orange_pin, False
+
+    def finish_step(self, db: Session, session: UssdSession, response: str):
+        """
+        Record the response of the step begun by begin_step(); returns the new state.
+
+        Every transition is committed here except one to FAILED, which stays in
+        the caller's transaction so it commits together with the deposit
+        failure and the hold release. None if someone else moved the session.
+        """
+        state = session.state
+        if state == S.INITIATING.value:
+            if self.client._has_confirmation_menu(response):
+                new, fields = S.MENU_RECEIVED.value, {"step1_response": response}
+            else:
+                new, fields = S.FAILED.value, {"step1_response": response, "error_message": "No confirmation menu received"}
+        elif state == S.CONFIRMING.value:
+            new = S.PIN_REQUESTED.value if self.client._asks_for_pin(response) else S.COMPLETED.value
+            fields = {"step2_response": response}
+        elif state == S.SENDING_PIN.value:
+            new, fields = S.COMPLETED.value, {"step3_response": response}
+        else:
+            return None
+
+        if not self.transition(db, session, state, new, commit=new != S.FAILED.value, **fields):
+            return None
+        return new
+
+    @staticmethod
+    def result(session: UssdSession) -> dict:
+        """Same shape as NeoGateTG400Client.send_deposit_with_confirmation()."""
+        if session.state == S.FAILED.value:
+            return {
+                'status': 'failed',
+                'sim_used': session.sim_name,
+                'response': session.step1_response,
+                'reason': session.error_message,
+            }
+        last = session.step3_response or session.step2_response
+        return {
+            'status': 'completed' if session.state == S.COMPLETED.value else session.state,
+            'sim_used': session.sim_name,
+            'step1_response': session.step1_response,
+            'step2_response': session.step2_response,
+            'step3_response': session.step3_response,
+            'final_status': 'success' if last and "success" in last.lower() else 'pending',
+        }
+
+
+def schedule_ussd_steps(session_ids: list, expires: datetime) -> None:
+    """
+    Queue the next step of each session; one task runs them concurrently.
+
+    The message expires with the earliest step deadline: a step that did not
+    start in time is resolved by the sweeper instead. Failures are only
+    logged, the sweeper also resumes sessions left between steps.
+    """
+    if not session_ids:
+        return
+    try:
+        from src.worker_app import celery_app
+        celery_app.send_task(STEP_TASK, args=[list(session_ids)], expires=expires)
+    except Exception as e:
+        logger.warning(f"Could not schedule USSD sessions {session_ids}: {e}")
+
+
+def schedule_ussd_step(session: UssdSession) -> None:
+    schedule_ussd_steps([session.id], session.expires_at)
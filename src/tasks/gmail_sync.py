@@ -101,12 +101,26 @@
 #         db.close()
 #         logger.info(f"[{label}] DB session closed.")
 from datetime import datetime, timezone, timedelta
+from celery.exceptions import Retry
+from redis.exceptions import LockError
+from sqlalchemy.exc import OperationalError, InterfaceError
+from src.core.config import settings
 from src.core.database import SessionLocal
-from src.services.gmail_service import fetch_recent_emails
-from src.services.email_service import create_email, get_email_by_message_id
+from src.core.redis_client import get_redis
+from src.services.gmail_service import (
+    build_service_for_token,
+    start_watch,
+    current_history_id,
+    fetch_messages,
+    list_history,
+    list_message_ids,
+    HistoryExpired,
+)
+from src.services.email_service import create_email
+from src.services.gmail_push import mailbox_tokens, sync_dirty_key
 from src.utils.parser import parse_transaction_email
 from src.worker_app import celery_app
-from src.models.email_message import EmailMessage
+from src.models.email_message import EmailMessage, GmailSyncState
 import logging
 
 logger = logging.getLogger("gmail_sync")
@@ -116,93 +130,206 @@ formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s")
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+BOOTSTRAP_WINDOW = timedelta(hours=1)
+# Mailbox label -> transaction types its confirmations are classified into
+MAILBOX_TYPES = {
+    "orange_money": ("cashin", "cashout"),
+    "airtime": ("airtime",),
+}
+SYNC_LOCK_TIMEOUT = 300
+# Ticks a message may fail transiently before it is skipped
+MESSAGE_RETRY_LIMIT = 5
+MESSAGE_FAILURE_TTL = 86400
+
+
+def get_sync_state(db, label: str) -> GmailSyncState:
+    state = db.query(GmailSyncState).filter_by(account=label).first()
+    if not state:
+        state = GmailSyncState(account=label)
+        db.add(state)
+        db.commit()
+        db.refresh(state)
+    return state
+
+
+def full_sync_ids(db, svc, label: str) -> tuple:
+    """
+    Message ids for a sync without a usable historyId (first run or expired cursor).
+
+    The profile historyId is read before listing, so anything arriving during
+    the listing shows up again in the next history delta and is deduplicated.
+    """
+    history_id = current_history_id(svc)
+    latest_email = (
+        db.query(EmailMessage)
+        .filter(EmailMessage.gmail_account.in_(MAILBOX_TYPES.get(label, (label,))))
+        .order_by(EmailMessage.received_at.desc())
+        .first()
+    )
+    if latest_email:
+        since = latest_email.received_at
+        logger.info(f"[{label}] Full resync from {since}")
+    else:
+        since = datetime.now(timezone.utc) - BOOTSTRAP_WINDOW
+        logger.info(f"[{label}] Bootstrap: fetching emails since {since}")
+    # after: has second granularity; re-listed messages are deduplicated below
+    return list_message_ids(svc, query=f"after:{int(since.timestamp())}"), history_id
+
+
+def store_message(db, label: str, msg: dict) -> bool:
+    """
+    Persist one fetched message and schedule its confirmation.
+
+    Returns False only for a transient failure (database unreachable,
+    connection dropped) that the next tick should retry; the cursor is held
+    back for those. A message that fails for any other reason, or keeps
+    failing transiently past MESSAGE_RETRY_LIMIT ticks, is logged and
+    skipped so it cannot pin the cursor.
+    """
+    msg_id = msg.get("id")
+    body_text = msg.get("body") or ""
+
+    # Auto detect transaction type
+    body_lower = body_text.lower()
+    if "retrait de" in body_lower:
+        detected_type = "cashout"
+    elif "depot vers" in body_lower:
+        detected_type = "cashin"
+    elif "rechargement" in body_lower:
+        detected_type = "airtime"
+    else:
+        detected_type = "unknown"
+
+    # Parse transaction info
+    try:
+        parsed = parse_transaction_email(body_text)
+    except Exception as parse_err:
+        logger.warning(f"[{label}] Failed to parse email {msg_id}: {parse_err}")
+        parsed = {}
+
+    # Prepare payload
+    payload = {
+        "gmail_account": detected_type,
+        "message_id": msg_id,
+        "subject": msg.get("subject"),
+        "sender": msg.get("sender"),
+        "body": body_text,
+        "parsed_transaction_id": parsed.get("transaction_id"),
+        "received_at": msg.get("internalDate") or datetime.now(timezone.utc),
+    }
+
+    # Store in DB
+    try:
+        email_obj = create_email(db, payload)
+        from src.tasks.email_confirmation import process_email_confirmation
+        process_email_confirmation.delay(email_obj.id)
+        logger.info(f"[{label}] Stored email and scheduled confirmation for {msg_id}.")
+        return True
+    except (OperationalError, InterfaceError) as db_err:
+        db.rollback()
+        failures_key = f"gmail:sync:{label}:failures:{msg_id}"
+        failures = get_redis().incr(failures_key)
+        get_redis().expire(failures_key, MESSAGE_FAILURE_TTL)
+        if failures >= MESSAGE_RETRY_LIMIT:
+            logger.error(f"[{label}] Giving up on email {msg_id} after {failures} attempts: {db_err}")
+            return True
+        logger.warning(f"[{label}] Transient DB error storing email {msg_id} ({failures}/{MESSAGE_RETRY_LIMIT}): {db_err}")
+        return False
+    except Exception as db_err:
+        db.rollback()
+        logger.error(f"[{label}] Skipping email {msg_id}, cannot be stored: {db_err}", exc_info=True)
+        return True
+
 
 @celery_app.task(bind=True, max_retries=3, name="src.tasks.gmail_sync.sync_account")
 def sync_account(self, label: str, token_path: str):
+    """
+    Store every message added to the mailbox since the last run.
+
+    Runs on the beat schedule and, in push mode, as soon as Gmail reports a
+    change. A trigger that finds a sync already running leaves the dirty
+    flag behind; the running sync sees it and schedules one more pass, so a
+    notification arriving mid-sync is never lost.
+    """
+    redis_client = get_redis()
+    dirty_key = sync_dirty_key(label)
+    lock = redis_client.lock(f"gmail:sync:{label}", timeout=SYNC_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        redis_client.set(dirty_key, 1, ex=SYNC_LOCK_TIMEOUT)
+        logger.info(f"[{label}] Sync already running, flagged for another pass")
+        return
+
     db = SessionLocal()
     try:
-        # --- Determine latest email timestamp ---
-        latest_email = (
-            db.query(EmailMessage)
-            .filter_by(gmail_account=label)
-            .order_by(EmailMessage.received_at.desc())
-            .first()
-        )
-        # after_ts = int(latest_email.received_at.timestamp()) if latest_email else 0
-        if latest_email:
-            after_ts = int(latest_email.received_at.timestamp())
-            logger.info(f"[{label}] Incremental sync from {latest_email.received_at}")
-        else:
-            # Bootstrap: fetch last 1 hour
-            bootstrap_since = datetime.now(timezone.utc) - timedelta(hours=1)
-            after_ts = int(bootstrap_since.timestamp())
-            logger.info(f"[{label}] Fetching emails since {bootstrap_since}")
-
-        # --- Fetch emails ---
+        redis_client.delete(dirty_key)
+        state = get_sync_state(db, label)
+
+        # --- Collect ids of new messages ---
         try:
-            emails = fetch_recent_emails(
-                token_path, max_results=10, query=f"after:{after_ts}"
-            )
+            svc = build_service_for_token(token_path)
+            try:
+                if not state.history_id:
+                    raise HistoryExpired(None)
+                message_ids, next_history_id = list_history(svc, state.history_id)
+                logger.info(f"[{label}] History delta since {state.history_id}: {len(message_ids)} new")
+            except HistoryExpired:
+                message_ids, next_history_id = full_sync_ids(db, svc, label)
+                state.last_full_sync_at = datetime.now(timezone.utc)
+        except Exception as fetch_err:
+            logger.error(f"[{label}] Error fetching emails: {fetch_err}")
+            raise self.retry(exc=fetch_err, countdown=5)
 
+        # --- Skip messages already stored (one query for the whole delta) ---
+        known = {
+            row[0] for row in
+            db.query(EmailMessage.message_id).filter(EmailMessage.message_id.in_(message_ids)).all()
+        } if message_ids else set()
+        new_ids = [m for m in message_ids if m not in known]
+
+        try:
+            emails = fetch_messages(svc, new_ids)
             logger.info(f"[{label}] Fetched {len(emails)} emails.")
         except Exception as fetch_err:
             logger.error(f"[{label}] Error fetching emails: {fetch_err}")
             raise self.retry(exc=fetch_err, countdown=5)
 
         # --- Process each email ---
+        stored_all = True
         for msg in emails:
-            msg_id = msg.get("id")
-
-            # Skip duplicates
-            if get_email_by_message_id(db, msg_id):
-                logger.info(f"[{label}] Skipping duplicate email: {msg_id}")
-                continue
-            
-            body_text = msg.get("body") or ""
-
-            # Auto detect transaction type
-            body_lower = body_text.lower()
-            if "retrait de" in body_lower:
-                detected_type = "cashout"
-            elif "depot vers" in body_lower:
-                detected_type = "cashin"
-            elif "rechargement" in body_lower:
-                detected_type = "airtime"
-            else:
-                detected_type = "unknown"
-
-            # Parse transaction info
-            try:
-                parsed = parse_transaction_email(body_text)
-            except Exception as parse_err:
-                logger.warning(f"[{label}] Failed to parse email {msg_id}: {parse_err}")
-                parsed = {}
-
-            # Prepare payload
-            payload = {
-                "gmail_account": detected_type,
-                "message_id": msg_id,
-                "subject": msg.get("subject"),
-                "sender": msg.get("sender"),
-                "body": body_text,
-                "parsed_transaction_id": parsed.get("transaction_id"),
-                "received_at": msg.get("received_at", datetime.now(timezone.utc)),
-            }
-
-            # Store in DB
-            try:
-                email_obj = create_email(db, payload)
-                from src.tasks.email_confirmation import process_email_confirmation
-                process_email_confirmation.delay(email_obj.id)
-                logger.info(f"[{label}] Stored email and scheduled confirmation for {msg_id}.")
-            except Exception as db_err:
-                logger.error(f"[{label}] DB error storing email {msg_id}: {db_err}")
-                continue
+            stored_all = store_message(db, label, msg) and stored_all
 
+        # Hold the cursor back only for transient failures; the next tick
+        # replays the delta and skips what already landed.
+        if stored_all:
+            state.history_id = next_history_id
+        db.commit()
+
+    except Retry:
+        raise
     except Exception as exc:
         logger.error(f"[{label}] Unexpected error: {exc}")
         raise self.retry(exc=exc, countdown=10)
 
     finally:
         db.close()
+        try:
+            lock.release()
+        except LockError:
+            logger.warning(f"[{label}] Sync lock expired before the run finished")
         logger.info(f"[{label}] DB session closed.")
+
+    if redis_client.exists(dirty_key):
+        sync_account.delay(label, token_path)
+
+
+@celery_app.task(name="src.tasks.gmail_sync.renew_gmail_watches")
+def renew_gmail_watches():
+    """Re-register every mailbox with Gmail push; a watch lapses after 7 days."""
+    if not settings.GMAIL_PUSH_ENABLED or not settings.GMAIL_PUSH_TOPIC:
+        return
+    for label, token_path in mailbox_tokens().items():
+        try:
+            watch = start_watch(build_service_for_token(token_path), settings.GMAIL_PUSH_TOPIC)
+            logger.info(f"[{label}] Gmail watch active until {watch.get('expiration')} (historyId {watch.get('historyId')})")
+        except Exception as e:
+            logger.error(f"[{label}] Could not renew Gmail watch: {e}")
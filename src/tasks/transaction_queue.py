@@ -1,23 +1,36 @@
 # src/tasks/transaction_queue.py
 import logging
+import uuid
 from decimal import Decimal
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import select, update, insert, exists, or_, tuple_, case, func, literal
 from sqlalchemy.orm import Session
+from redis.exceptions import LockError
 from src.worker_app import celery_app
+from src.core.config import settings
+from src.core.constants import transaction_type_key
 from src.core.database import SessionLocal
+from src.core.redis_client import get_redis
 from src.models.transaction import (
     PendingTransaction,
     CompanyCountryBalance,
-    FeeConfig,
-    Country,
     DepositTransaction,
     WithdrawalTransaction,
-    AirtimePurchase
+    AirtimePurchase,
+    DeadLetterTransaction,
+    UssdSession,
+    UssdSessionState,
 )
-from src.services.neogate_client import NeoGateTG400Client
+from src.services.neogate_client import NeoGateTG400Client, TransientGatewayError
+from src.services.ussd_session import DepositSessionMachine, schedule_ussd_step
+from src.services.sim_manager import SIMManager
+from src.services.queue_notifier import lane_dirty_key
+from src.services import fee_service, msisdn_router
+from src.services.blackout import release_blackout_slot
+from src.services.dead_letter import dead_letter, next_attempt_at, EXHAUSTED, REJECTED, UNKNOWN
 
-MAX_REQUESTS_PER_MINUTE = 6
 om_client = NeoGateTG400Client()
+sim_manager = SIMManager()
 
 logger = logging.getLogger("transaction_queue")
 logger.setLevel(logging.INFO)
@@ -30,26 +43,48 @@ logger.addHandler(handler)
 # ----------------- BALANCE MANAGER ----------------- #
 class BalanceManager:
     @staticmethod
-    def hold_balance(db: Session, company_id: int, country_id: int, amount: Decimal):
-        balance = db.query(CompanyCountryBalance).filter(
-            CompanyCountryBalance.company_id == company_id,
-            CompanyCountryBalance.country_id == country_id
-        ).with_for_update().first()
+    def hold_balance(db: Session, company_id: int, country_id: int, amount: Decimal, commit: bool = True):
+        """
+        Move amount from available to held in one conditional UPDATE.
+
+        The balance row is locked only for the statement and its commit instead
+        of across a SELECT ... FOR UPDATE round trip. With commit=False the
+        caller commits it together with the rest of its unit of work.
+        """
+        held = db.execute(
+            update(CompanyCountryBalance)
+            .where(
+                CompanyCountryBalance.company_id == company_id,
+                CompanyCountryBalance.country_id == country_id,
+                CompanyCountryBalance.available_balance >= amount
+            )
+            .values(
+                available_balance=CompanyCountryBalance.available_balance - amount,
+                held_balance=CompanyCountryBalance.held_balance + amount
+            )
+            .returning(
+                CompanyCountryBalance.id,
+                CompanyCountryBalance.available_balance,
+                CompanyCountryBalance.held_balance
+            )
+            .execution_options(synchronize_session=False)
+        ).first()
 
-        if not balance:
-            raise Exception(f"No balance found for company {company_id} in country {country_id}")
-        if balance.available_balance < amount:
+        if held is None:
+            balance = db.query(CompanyCountryBalance).filter(
+                CompanyCountryBalance.company_id == company_id,
+                CompanyCountryBalance.country_id == country_id
+            ).first()
+            if not balance:
+                raise Exception(f"No balance found for company {company_id} in country {country_id}")
             raise Exception(f"Insufficient available balance. Available: {balance.available_balance}, Required: {amount}")
 
-        balance.available_balance -= amount
-        balance.held_balance += amount
-        db.add(balance)
-        db.commit()
-        db.refresh(balance)
-        return balance
+        if commit:
+            db.commit()
+        return held
 
     @staticmethod
-    def release_balance(db: Session, company_id: int, country_id: int, amount: Decimal, success: bool = False):
+    def release_balance(db: Session, company_id: int, country_id: int, amount: Decimal, success: bool = False, commit: bool = True):
         balance = db.query(CompanyCountryBalance).filter(
             CompanyCountryBalance.company_id == company_id,
             CompanyCountryBalance.country_id == country_id
@@ -64,8 +99,9 @@ class BalanceManager:
             balance.available_balance += amount
 
         db.add(balance)
-        db.commit()
-        db.refresh(balance)
+        if commit:
+            db.commit()
+            db.refresh(balance)
         return True
 
 
@@ -73,196 +109,618 @@ class BalanceManager:
 class FeeCalculator:
     @staticmethod
     def calculate_fee(db: Session, destination_country_id: int, transaction_type, amount: Decimal) -> dict:
-        fee_config: FeeConfig = db.query(FeeConfig).filter(
-            FeeConfig.destination_country_id == destination_country_id,
-            FeeConfig.transaction_type == transaction_type,
-            FeeConfig.is_active == True
-        ).first()
-
-        if not fee_config:
-            return {"fee_amount": Decimal('0'), "net_amount": amount}
-
-        if fee_config.fee_type == "flat":
-            fee_amount = Decimal(fee_config.flat_fee)
-        elif fee_config.fee_type == "percent":
-            fee_amount = (amount * Decimal(fee_config.percent_fee)) / Decimal('100')
-        else:
-            fee_amount = Decimal('0')
-
-        if fee_config.min_fee and fee_amount < Decimal(fee_config.min_fee):
-            fee_amount = Decimal(fee_config.min_fee)
-        if fee_config.max_fee and fee_amount > Decimal(fee_config.max_fee):
-            fee_amount = Decimal(fee_config.max_fee)
-
-        return {"fee_amount": fee_amount, "net_amount": amount - fee_amount}
+        rule = fee_service.get_fee_rule(db, destination_country_id, transaction_type)
+        return fee_service.apply_fee(rule, amount)
 
 
 # ----------------- COUNTRY ROUTER ----------------- #
 class CountryRouter:
-    COUNTRY_CODES = {
-        '221': 'SN', '224': 'GN', '223': 'ML', '225': 'CI', '226': 'BF'
-    }
+    """Country lookups served from the cached MSISDN routing table (no DB round trip)."""
 
     @staticmethod
     def get_destination_country(db: Session, country_iso: str):
         if not country_iso:
             return None
-        return db.query(Country).filter(
-            Country.iso_code == country_iso.upper(),
-            Country.is_active == True
-        ).first()
+        return msisdn_router.get_routing_table(db).active_country(country_iso)
 
     @staticmethod
     def get_country_from_msisdn(db: Session, msisdn: str):
-        clean_msisdn = msisdn.lstrip('+')
-        for code, iso in CountryRouter.COUNTRY_CODES.items():
-            if clean_msisdn.startswith(code):
-                return db.query(Country).filter(Country.iso_code == iso, Country.is_active == True).first()
-        return db.query(Country).filter(Country.iso_code == 'SN').first()
+        return msisdn_router.get_routing_table(db).route(msisdn).country
 
 
-# ----------------- PROCESS TRANSACTION QUEUE ----------------- #
-@celery_app.task(bind=True, max_retries=3, name='src.tasks.transaction_queue.process_transaction_queue')
-def process_transaction_queue(self):
-    db: Session = SessionLocal()
+# ----------------- BATCH REFERENCE DATA ----------------- #
+class BatchReferenceData:
+    """
+    Balances for one claimed batch, loaded in a single set-based query so
+    per-row lookups are served from memory. Countries and fee rules come from
+    the shared caches (see msisdn_router and fee_service).
+
+    Balance rows are detached from the session so the per-row commits do not
+    expire them and trigger a reload on the next attribute access.
+    """
+
+    def __init__(self, db: Session, balances: dict):
+        self.db = db
+        self.balances = balances
+
+    @classmethod
+    def load(cls, db: Session, requests: list) -> "BatchReferenceData":
+        refs = cls(db, {})
+
+        pairs = set()
+        for req in requests:
+            country = refs.destination_country(req)
+            if country:
+                pairs.add((req.company_id, country.id))
+
+        balances = db.query(CompanyCountryBalance).filter(
+            tuple_(CompanyCountryBalance.company_id, CompanyCountryBalance.country_id).in_(pairs)
+        ).all() if pairs else []
+        for balance in balances:
+            db.expunge(balance)
+        refs.balances = {(b.company_id, b.country_id): b for b in balances}
+        return refs
+
+    def destination_country(self, req: PendingTransaction):
+        """country_iso if active, then longest MSISDN prefix, then SN."""
+        return msisdn_router.resolve_destination_country(self.db, req.country_iso, req.msisdn)
+
+    def balance(self, company_id: int, country_id: int):
+        return self.balances.get((company_id, country_id))
+
+
+# ----------------- QUEUE CLAIMER ----------------- #
+class QueueClaimer:
+    """
+    Lease-based claiming of pending_transactions rows.
+
+    A claim is a single UPDATE over a FOR UPDATE SKIP LOCKED subselect, so
+    concurrent workers never pick the same row. Claimed rows carry a lease;
+    rows whose worker died are returned to the queue by reclaim_expired().
+    """
+
+    @staticmethod
+    def _weight(column, weights: dict, key_type):
+        # Keys arrive as strings when the setting comes from the environment
+        whens = [(column == key_type(key), float(weight)) for key, weight in weights.items()]
+        return case(*whens, else_=1.0) if whens else literal(1.0)
+
+    @staticmethod
+    def fair_order(transaction_types: list, limit: int):
+        """
+        Pending ids in weighted-fair order.
+
+        Each (company, transaction type) flow is its own queue. A row's virtual
+        time is its position in that flow divided by the flow's weight, so a
+        partner with 2,000 queued rows gets one slot per round like everyone
+        else instead of the whole batch. Company priority tiers are served
+        strictly first; created_at breaks ties.
+        """
+        position = func.row_number().over(
+            partition_by=(PendingTransaction.company_id, PendingTransaction.transaction_type),
+            order_by=PendingTransaction.created_at.asc()
+        )
+        weight = (
+            QueueClaimer._weight(PendingTransaction.company_id, settings.QUEUE_COMPANY_WEIGHTS, int)
+            * QueueClaimer._weight(PendingTransaction.transaction_type, settings.QUEUE_TYPE_WEIGHTS, transaction_type_key)
+        )
+        priority = case(
+            *[(PendingTransaction.company_id == int(cid), int(prio)) for cid, prio in settings.QUEUE_COMPANY_PRIORITIES.items()],
+            else_=0
+        ) if settings.QUEUE_COMPANY_PRIORITIES else literal(0)
+
+        ranked = (
+            select(
+                PendingTransaction.id.label("id"),
+                PendingTransaction.created_at.label("created_at"),
+                (position / weight).label("virtual_time"),
+                priority.label("priority"),
+            )
+            .where(
+                PendingTransaction.status == "pending",
+                PendingTransaction.transaction_type.in_(transaction_types),
+                or_(
+                    PendingTransaction.next_attempt_at.is_(None),
+                    PendingTransaction.next_attempt_at <= func.now()
+                )
+            )
+            .subquery()
+        )
+        return (
+            select(ranked.c.id)
+            .order_by(ranked.c.priority.desc(), ranked.c.virtual_time.asc(), ranked.c.created_at.asc())
+            .limit(limit)
+        )
+
+    @staticmethod
+    def claim_update(ordered_ids: list, claim_token: str, now: datetime):
+        """Lease the still pending rows among `ordered_ids`, skipping ones another worker holds."""
+        candidates = (
+            select(PendingTransaction.id)
+            .where(
+                PendingTransaction.id.in_(ordered_ids),
+                PendingTransaction.status == "pending"
+            )
+            .with_for_update(skip_locked=True)
+        )
+        return (
+            update(PendingTransaction)
+            .where(PendingTransaction.id.in_(candidates.scalar_subquery()))
+            .values(
+                status="processing",
+                claim_token=claim_token,
+                claimed_at=now,
+                lease_expires_at=now + timedelta(seconds=settings.QUEUE_LEASE_SECONDS),
+            )
+            .returning(PendingTransaction.id)
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def claim_batch(db: Session, transaction_types: list, limit: int, claim_token: str) -> list:
+        now = datetime.now(timezone.utc)
+        # Window functions cannot be combined with FOR UPDATE, so rank first
+        # and lock the chosen rows in the claiming UPDATE.
+        ordered_ids = db.execute(QueueClaimer.fair_order(transaction_types, limit)).scalars().all()
+        if not ordered_ids:
+            db.commit()
+            return []
+
+        claimed_ids = db.execute(QueueClaimer.claim_update(ordered_ids, claim_token, now)).scalars().all()
+        db.commit()
+
+        if not claimed_ids:
+            return []
+        rows = db.query(PendingTransaction).filter(PendingTransaction.id.in_(claimed_ids)).all()
+        position = {pending_id: i for i, pending_id in enumerate(ordered_ids)}
+        return sorted(rows, key=lambda r: position[r.id])
+
+    @staticmethod
+    def renew_lease(db: Session, req: PendingTransaction, claim_token: str, commit: bool = True) -> bool:
+        """Extend the lease before working on a row; False means it was reclaimed."""
+        now = datetime.now(timezone.utc)
+        renewed = db.execute(
+            update(PendingTransaction)
+            .where(
+                PendingTransaction.id == req.id,
+                PendingTransaction.status == "processing",
+                PendingTransaction.claim_token == claim_token
+            )
+            .values(lease_expires_at=now + timedelta(seconds=settings.QUEUE_LEASE_SECONDS))
+            .returning(PendingTransaction.id)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if commit:
+            db.commit()
+        return renewed is not None
+
+    @staticmethod
+    def release(db: Session, ids: list, claim_token: str) -> int:
+        """Hand claimed but never dispatched rows back to the queue."""
+        if not ids:
+            return 0
+        released = db.execute(
+            update(PendingTransaction)
+            .where(
+                PendingTransaction.id.in_(ids),
+                PendingTransaction.status == "processing",
+                PendingTransaction.claim_token == claim_token,
+                PendingTransaction.dispatched_at.is_(None)
+            )
+            .values(status="pending", claim_token=None, claimed_at=None, lease_expires_at=None)
+            .returning(PendingTransaction.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        db.commit()
+        return len(released)
+
+    @staticmethod
+    def reclaim_expired(db: Session) -> dict:
+        """
+        Recover rows whose lease expired:
+        - never dispatched (no hold, no USSD sent) -> back to pending
+        - dispatched with a transaction row -> done, confirmation takes over
+        - dispatched without a transaction row -> failed; the gateway outcome
+          is unknown so the held amount is left for manual reconciliation
+          (only rows dispatched before hold and insert shared a commit)
+        """
+        now = datetime.now(timezone.utc)
+        expired = (
+            PendingTransaction.status == "processing",
+            PendingTransaction.lease_expires_at < now,
+        )
+        has_transaction = or_(
+            exists().where(DepositTransaction.pending_transaction_id == PendingTransaction.id),
+            exists().where(WithdrawalTransaction.pending_transaction_id == PendingTransaction.id),
+            exists().where(AirtimePurchase.pending_transaction_id == PendingTransaction.id),
+        )
+
+        requeued = db.execute(
+            update(PendingTransaction)
+            .where(*expired, PendingTransaction.dispatched_at.is_(None))
+            .values(status="pending", claim_token=None, claimed_at=None, lease_expires_at=None)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        completed = db.execute(
+            update(PendingTransaction)
+            .where(*expired, PendingTransaction.dispatched_at.isnot(None), has_transaction)
+            .values(status="done", processed_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        reason = "Lease expired after dispatch; gateway outcome unknown, held balance kept for reconciliation"
+        failed_rows = db.execute(
+            update(PendingTransaction)
+            .where(*expired, PendingTransaction.dispatched_at.isnot(None), ~has_transaction)
+            .values(status="failed", error_message=reason)
+            .returning(
+                PendingTransaction.id,
+                PendingTransaction.company_id,
+                PendingTransaction.transaction_type,
+                PendingTransaction.msisdn,
+                PendingTransaction.amount,
+                PendingTransaction.attempts,
+            )
+            .execution_options(synchronize_session=False)
+        ).all()
+        if failed_rows:
+            db.execute(insert(DeadLetterTransaction), [
+                {
+                    "pending_transaction_id": row.id,
+                    "company_id": row.company_id,
+                    "transaction_type": row.transaction_type,
+                    "msisdn": row.msisdn,
+                    "amount": row.amount,
+                    "failure_class": UNKNOWN,
+                    "attempts": row.attempts,
+                    "error_message": reason,
+                }
+                for row in failed_rows
+            ])
+        failed = len(failed_rows)
+        db.commit()
+        for row in failed_rows:
+            # No open transaction behind it, so the number is not blacked out either
+            release_blackout_slot(row.transaction_type, row.msisdn)
+
+        if requeued or completed or failed:
+            logger.warning(f"Reclaimed expired leases: requeued={requeued} done={completed} failed={failed}")
+        return {"requeued": requeued, "done": completed, "failed": failed}
+
+
+# ----------------- FAILURE ----------------- #
+def fail_request(db: Session, req: PendingTransaction, transaction, reason: str, failure_class: str,
+                 transient: bool = False, hold: tuple = None):
+    """
+    Fail a request in one commit with whatever the caller already staged
+    (e.g. the USSD session's FAILED transition).
+
+    hold=(company_id, country_id, amount) goes back to available and the
+    transaction row is failed. A transient failure with attempts left puts
+    the request back in the queue after a backoff; anything else is
+    dead-lettered. Returns the retry time, None once dead-lettered.
+    """
+    attempts = (req.attempts or 0) + 1
+    retry_at = next_attempt_at(attempts) if transient else None
+
+    if hold:
+        BalanceManager.release_balance(db, *hold, success=False, commit=False)
+
+    req.attempts = attempts
+    req.error_message = reason[:500]
+    if retry_at:
+        # Nothing ran on the network: back to the queue after a backoff
+        req.status = "pending"
+        req.next_attempt_at = retry_at
+        req.claim_token = None
+        req.claimed_at = None
+        req.lease_expires_at = None
+        req.dispatched_at = None
+    else:
+        req.status = "failed"
+        dead_letter(db, req, EXHAUSTED if transient else failure_class, reason)
+    db.add(req)
+
+    if transaction is not None:
+        transaction.status = "failed"
+        transaction.error_message = reason[:1000]
+        db.add(transaction)
+
+    db.commit()
+    if not retry_at:
+        # A failed request no longer holds the number's blackout window
+        release_blackout_slot(req.transaction_type, req.msisdn)
+    return retry_at
+
+
+# ----------------- PROCESS ONE PENDING REQUEST ----------------- #
+def _fail_deposit_session(db: Session, transaction: DepositTransaction, reason: str) -> bool:
+    """
+    Fail the USSD session behind an errored deposit, uncommitted.
+
+    True when no money can have moved (session already failed, or failed now
+    from a SAFE_TO_FAIL state), so the caller may release the hold in the same
+    commit. False when the session is past the confirmation or was moved by
+    someone else meanwhile; the sweeper would otherwise resume a session whose
+    deposit is already failed.
+    """
+    session = db.query(UssdSession).filter(UssdSession.deposit_transaction_id == transaction.id).first()
+    if session is None or session.state == UssdSessionState.FAILED.value:
+        return True
+    if session.state in DepositSessionMachine.SAFE_TO_FAIL:
+        return DepositSessionMachine.transition(
+            db, session, session.state, UssdSessionState.FAILED.value, commit=False, error_message=reason[:1000]
+        )
+    return False
+
+
+def process_pending_request(db: Session, req: PendingTransaction, sim_name: str, claim_token: str,
+                            refs: BatchReferenceData = None):
+    """
+    Run one claimed request as two short units of work around the gateway call.
+
+    1. dispatch: lease check, hold and transaction row (plus the USSD session
+       for deposits) commit together, so a dispatched request always has its
+       transaction row and a held amount is never left without one.
+    2. outcome: gateway response and the request's final status commit together.
+
+    Deposits stop after dispatch: their USSD steps run as separate tasks
+    (tasks.ussd_sessions) and the last step settles the request.
+    """
     balance_manager = BalanceManager()
     fee_calculator = FeeCalculator()
-    country_router = CountryRouter()
+
+    transaction = None
+    held_amount = None
+    destination_country = None
+    company_id = req.company_id
+    dispatched = False
 
     try:
-        pending_requests = db.query(PendingTransaction).filter(
-            PendingTransaction.status == "pending"
-        ).order_by(PendingTransaction.created_at.asc()).limit(MAX_REQUESTS_PER_MINUTE).all()
+        logger.info(f"[{sim_name}] Processing pending transaction id={req.id} type={req.transaction_type} msisdn={req.msisdn}")
 
-        for req in pending_requests:
-            transaction = None
-            held_amount = None
-            destination_country = None
-
-            try:
-                logger.info(f"Processing pending transaction id={req.id} type={req.transaction_type} msisdn={req.msisdn}")
-                req.status = "processing"
-                db.add(req)
-                db.commit()
-
-                req_type = (req.transaction_type or "").strip().lower()
-                company_id = req.company_id
-
-                # Determine destination country
-                if req.country_iso:
-                    destination_country = country_router.get_destination_country(db, req.country_iso)
-                if not destination_country:
-                    destination_country = country_router.get_country_from_msisdn(db, req.msisdn)
-                if not destination_country:
-                    raise Exception(f"Cannot determine country for MSISDN {req.msisdn}")
-
-                # Company balance
-                balance = db.query(CompanyCountryBalance).filter(
-                    CompanyCountryBalance.company_id == company_id,
-                    CompanyCountryBalance.country_id == destination_country.id
-                ).first()
-                if not balance:
-                    raise Exception(f"No balance for company {company_id} in {destination_country.iso_code}")
-
-                amount_decimal = Decimal(str(req.amount))
-
-                # Calculate fees
-                fee_info = fee_calculator.calculate_fee(
-                    db,
-                    destination_country_id=destination_country.id,
-                    transaction_type=req_type,
-                    amount=amount_decimal
-                )
+        req_type = transaction_type_key(req.transaction_type)
+        if refs is None:
+            refs = BatchReferenceData.load(db, [req])
 
-                # Hold full amount only for debit-type transactions
-                if req_type in ("cashin", "airtime"):
-                    held_amount = amount_decimal
-                    balance_manager.hold_balance(db, company_id, destination_country.id, held_amount)
-
-                tx_data = {
-                    "company_id": company_id,
-                    "pending_transaction_id": req.id,
-                    "amount": amount_decimal,
-                    "country_id": destination_country.id,
-                    "balance_id": balance.id,
-                    "partner_id": req.partner_id,
-                    "service_partner_id": None,
-                    "status": "initiated",
-                    "fee_amount": fee_info["fee_amount"],
-                    "net_amount": amount_decimal,
-                    "before_balance": balance.available_balance + balance.held_balance,
-                    "after_balance": balance.available_balance + balance.held_balance,
-                }
+        # Determine destination country
+        destination_country = refs.destination_country(req)
+        if not destination_country:
+            raise Exception(f"Cannot determine country for MSISDN {req.msisdn}")
+
+        # Company balance
+        balance = refs.balance(company_id, destination_country.id)
+        if not balance:
+            raise Exception(f"No balance for company {company_id} in {destination_country.iso_code}")
+        total_balance = balance.available_balance + balance.held_balance
+
+        amount_decimal = Decimal(str(req.amount))
+
+        # Calculate fees
+        fee_info = fee_calculator.calculate_fee(
+            db,
+            destination_country_id=destination_country.id,
+            transaction_type=req_type,
+            amount=amount_decimal
+        )
+
+        # ---- Unit of work 1: dispatch ----
+        if not QueueClaimer.renew_lease(db, req, claim_token, commit=False):
+            db.rollback()
+            logger.warning(f"[{sim_name}] Lease lost for pending id={req.id}, skipping")
+            return
+
+        # Hold full amount only for debit-type transactions
+        if req_type in ("cashin", "airtime"):
+            held = balance_manager.hold_balance(db, company_id, destination_country.id, amount_decimal, commit=False)
+            total_balance = held.available_balance + held.held_balance
+
+        tx_data = {
+            "company_id": company_id,
+            "pending_transaction_id": req.id,
+            "amount": amount_decimal,
+            "country_id": destination_country.id,
+            "balance_id": balance.id,
+            "partner_id": req.partner_id,
+            "service_partner_id": None,
+            "status": "initiated",
+            "sim_used": sim_name,
+            "fee_amount": fee_info["fee_amount"],
+            "net_amount": amount_decimal,
+            "before_balance": total_balance,
+            "after_balance": total_balance,
+        }
+
+        if req_type == "airtime":
+            transaction = AirtimePurchase(recipient=req.msisdn, **tx_data)
+        elif req_type == "cashin":
+            transaction = DepositTransaction(recipient=req.msisdn, **tx_data)
+        elif req_type == "cashout":
+            transaction = WithdrawalTransaction(sender=req.msisdn, **tx_data)
+        else:
+            raise Exception(f"Unknown transaction type '{req.transaction_type}'")
+
+        # From here on the request may move money: an expired lease on a
+        # dispatched request is never blindly re-queued.
+        req.dispatched_at = datetime.now(timezone.utc)
+        db.add(req)
+        db.add(transaction)
+        db.flush()
+
+        session = None
+        if req_type == "cashin":
+            # Deposits run as a persisted USSD session, one task per step, so a
+            # crash mid-flow is resolved by the session sweeper within seconds.
+            _, port_index = om_client._resolve_sim("cashin", sim_name)
+            session = DepositSessionMachine.start(db, transaction, sim_name, port_index, commit=False)
+
+        db.commit()
+        dispatched = True
+        held_amount = amount_decimal if req_type in ("cashin", "airtime") else None
+        transaction_id = transaction.id
+
+        # Convert amount to int for gateway
+        gateway_amount = int(amount_decimal)
+
+        # ---- Gateway ----
+        if req_type == "airtime":
+            response = om_client.purchase_credit(req.msisdn, gateway_amount, sim_name=sim_name)
+
+        elif req_type == "cashin":
+            schedule_ussd_step(session)
+            logger.info(f"[{sim_name}] Deposit {transaction_id} (pending_id={req.id}) handed to USSD session {session.id}")
+            return
+
+        else:
+            response = om_client.withdraw_cash(req.msisdn, gateway_amount, sim_name=sim_name)
+
+        # ---- Unit of work 2: outcome ----
+        if response:
+            if isinstance(response, dict):
+                transaction.gateway_response = response.get("response") or str(response)
+                transaction.gateway_transaction_id = response.get("transaction_id")
+            else:
+                transaction.gateway_response = str(response)
+
+        req.status = "done"
+        req.processed_at = datetime.now(timezone.utc)
+        db.add(transaction)
+        db.add(req)
+        db.commit()
+
+        logger.info(f"[{sim_name}] Processed transaction {transaction_id} (pending_id={req.id}) - amount={amount_decimal} fee={fee_info['fee_amount']}")
+
+    except Exception as e:
+        logger.error(f"[{sim_name}] Failed transaction id={req.id if req else 'N/A'}: {str(e)}", exc_info=True)
+        db.rollback()
+        if not dispatched:
+            # Nothing was committed for this request beyond the claim
+            transaction = None
 
-                # Convert amount to int for gateway
-                gateway_amount = int(amount_decimal)
-
-                # Transaction Routing
-                if req_type == "airtime":
-                    transaction = AirtimePurchase(recipient=req.msisdn, **tx_data)
-                    response = om_client.purchase_credit(req.msisdn, gateway_amount)
-
-                elif req_type == "cashin":
-                    transaction = DepositTransaction(recipient=req.msisdn, **tx_data)
-                    response = om_client.send_deposit_with_confirmation(req.msisdn, gateway_amount)
-
-                elif req_type == "cashout":
-                    transaction = WithdrawalTransaction(sender=req.msisdn, **tx_data)
-                    response = om_client.withdraw_cash(req.msisdn, gateway_amount)
-
-                else:
-                    raise Exception(f"Unknown transaction type '{req.transaction_type}'")
-
-                # Save transaction response
-                if response:
-                    if isinstance(response, dict):
-                        transaction.gateway_response = response.get("response") or str(response)
-                        transaction.gateway_transaction_id = response.get("transaction_id")
-                    else:
-                        transaction.gateway_response = str(response)
-
-                db.add(transaction)
-                db.commit()
-                db.refresh(transaction)
-
-                # Finalize pending transaction
-                req.status = "done"
-                req.processed_at = datetime.now(timezone.utc)
-                db.add(req)
-                db.commit()
-
-                logger.info(f"Processed transaction {transaction.id} (pending_id={req.id}) - amount={amount_decimal} fee={fee_info['fee_amount']}")
-
-            except Exception as e:
-                logger.error(f"Failed transaction id={req.id if req else 'N/A'}: {str(e)}", exc_info=True)
-                # Release held amount if applicable
-                if held_amount and destination_country:
-                    try:
-                        balance_manager.release_balance(db, company_id, destination_country.id, held_amount, success=False)
-                    except Exception as release_err:
-                        logger.error(f"Failed to release held balance for pending id={getattr(req, 'id', 'N/A')}: {release_err}")
-
-                # Mark as failed
+        rejected = not dispatched
+        if transaction is not None and transaction_type_key(req.transaction_type) == "cashin":
+            # True: the session failed before the confirmation, nothing moved
+            rejected = _fail_deposit_session(db, transaction, str(e))
+            if not rejected:
+                # The confirmation or PIN may have gone out: keep the hold and the
+                # open deposit for the confirmation email / expiry path.
                 try:
-                    req.status = "failed"
+                    req.status = "done"
+                    req.processed_at = datetime.now(timezone.utc)
                     req.error_message = str(e)[:500]
                     db.add(req)
-
-                    if transaction:
-                        transaction.status = "failed"
-                        transaction.error_message = str(e)[:1000]
-                        db.add(transaction)
-
                     db.commit()
                 except Exception as persist_err:
-                    logger.error(f"Failed to persist failure for pending id={getattr(req, 'id', 'N/A')}: {persist_err}")
+                    logger.error(f"Failed to persist failure for pending id={req.id}: {persist_err}")
                     db.rollback()
+                logger.warning(f"[{sim_name}] Deposit {transaction.id} errored after money may have moved; hold kept, awaiting confirmation")
+                return
+
+        transient = isinstance(e, TransientGatewayError)
+        hold = (company_id, destination_country.id, held_amount) if held_amount and destination_country else None
+
+        # Release held amount and record the outcome in one commit
+        try:
+            retry_at = fail_request(
+                db, req, transaction, str(e), REJECTED if rejected else UNKNOWN,
+                transient=transient, hold=hold
+            )
+        except Exception as persist_err:
+            logger.error(f"Failed to persist failure for pending id={getattr(req, 'id', 'N/A')}: {persist_err}")
+            db.rollback()
+        else:
+            if retry_at:
+                logger.warning(f"[{sim_name}] Pending id={req.id} retry {req.attempts}/{settings.QUEUE_MAX_ATTEMPTS} at {retry_at.isoformat()}")
+
+
+# ----------------- SIM LANE ----------------- #
+@celery_app.task(bind=True, max_retries=3, name='src.tasks.transaction_queue.process_sim_lane')
+def process_sim_lane(self, sim_name: str):
+    """
+    Drain the pending requests routed to one SIM.
+
+    Each SIM/GSM port is its own lane with its own rate budget, so a slow
+    deposit on one port never holds up airtime on the other. A Redis lock keeps
+    a single consumer per port across all worker processes and containers,
+    because a USSD session on a port cannot be interleaved with another one.
+
+    Lanes are woken by submissions (see queue_notifier.wake_queue_lane). A
+    wake-up that finds the lane busy only leaves the dirty flag behind; the
+    running lane sees it and schedules another run before it exits.
+    """
+    lane_types = sim_manager.lane_types(sim_name)
+    if not lane_types:
+        return
+
+    redis_client = get_redis()
+    dirty_key = lane_dirty_key(sim_name)
+    lock = redis_client.lock(f"queue:lane:{sim_name}", timeout=settings.LANE_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        logger.info(f"[{sim_name}] Lane busy in another worker, skipping")
+        return
+
+    db: Session = SessionLocal()
+    batch_full = False
+    try:
+        if DepositSessionMachine.port_busy(db, sim_name):
+            # The port still carries a deposit session; its last step wakes the lane
+            logger.info(f"[{sim_name}] USSD session in progress on the port, skipping")
+            return
+        redis_client.delete(dirty_key)
+        claim_token = uuid.uuid4().hex
+        pending_requests = QueueClaimer.claim_batch(db, lane_types, settings.LANE_MAX_REQUESTS_PER_RUN, claim_token)
+        batch_full = len(pending_requests) >= settings.LANE_MAX_REQUESTS_PER_RUN
+        refs = BatchReferenceData.load(db, pending_requests) if pending_requests else None
+
+        for position, req in enumerate(pending_requests):
+            if not sim_manager.health.allows_request(sim_name):
+                # Circuit opened mid-batch: let the rows route to a healthy SIM
+                remaining = [r.id for r in pending_requests[position:]]
+                released = QueueClaimer.release(db, remaining, claim_token)
+                logger.warning(f"[{sim_name}] Circuit open, released {released} request(s) back to the queue")
+                batch_full = False
+                break
+            lock.reacquire()
+            process_pending_request(db, req, sim_name, claim_token, refs=refs)
+            if transaction_type_key(req.transaction_type) == "cashin" and DepositSessionMachine.port_busy(db, sim_name):
+                # A deposit session now owns the port until its last step
+                remaining = [r.id for r in pending_requests[position + 1:]]
+                QueueClaimer.release(db, remaining, claim_token)
+                batch_full = False
+                break
 
     except Exception as e:
-        logger.error(f"Transaction queue processing failed: {str(e)}", exc_info=True)
+        logger.error(f"[{sim_name}] Lane processing failed: {str(e)}", exc_info=True)
         try:
             self.retry(countdown=60)
         except Exception:
             logger.error("Celery retry failed or not allowed")
+        return
     finally:
         db.close()
+        try:
+            lock.release()
+        except LockError:
+            logger.warning(f"[{sim_name}] Lane lock expired before release")
+
+    # Keep draining: the NeoGate token bucket paces the port, not the batch size
+    if batch_full:
+        process_sim_lane.apply_async(args=[sim_name], countdown=settings.LANE_BACKLOG_COUNTDOWN)
+    elif redis_client.exists(dirty_key):
+        process_sim_lane.delay(sim_name)
+
+
+# ----------------- PROCESS TRANSACTION QUEUE ----------------- #
+@celery_app.task(bind=True, max_retries=3, name='src.tasks.transaction_queue.process_transaction_queue')
+def process_transaction_queue(self):
+    """Fan the pending queue out to one lane per SIM; lanes run concurrently."""
+    db: Session = SessionLocal()
+    try:
+        QueueClaimer.reclaim_expired(db)
+    except Exception as e:
+        logger.error(f"Lease reclaim failed: {str(e)}", exc_info=True)
+        db.rollback()
+    finally:
+        db.close()
+
+    for sim_name in sim_manager.lanes():
+        process_sim_lane.delay(sim_name)
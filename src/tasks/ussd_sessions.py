@@ -0,0 +1,232 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+from src.worker_app import celery_app
+from src.core.config import settings
+from src.core.database import SessionLocal
+from src.models.transaction import UssdSession, UssdSessionState
+from src.services.ussd_session import DepositSessionMachine, schedule_ussd_steps
+from src.services.neogate_client import AsyncNeoGateTG400Client, TransientGatewayError
+from src.services.queue_notifier import wake_lane
+from src.services.dead_letter import REJECTED
+from src.tasks.transaction_queue import om_client, fail_request
+import logging
+
+logger = logging.getLogger("ussd_sessions")
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s")
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+OPEN_STATUSES = ["created", "initiated", "pending", "processing"]
+
+# The machine only builds USSD codes and reads replies with the client's helpers;
+# requests go out through the async client in advance_ussd_sessions
+deposit_machine = DepositSessionMachine(om_client)
+
+
+def fail_deposit(db, session: UssdSession, reason: str, transient: bool = False):
+    """
+    Fail the deposit behind a session whose FAILED transition is already
+    staged (uncommitted), releasing its hold.
+
+    The session transition, deposit failure, dead letter and hold release
+    share one commit, so a crash can never leave a terminal session in front
+    of an open deposit that still holds its balance. transient=True (nothing
+    reached the network) lets the request retry after a backoff.
+    """
+    tx = session.deposit_transaction
+    return fail_request(
+        db, session.pending_transaction, tx, reason, REJECTED,
+        transient=transient, hold=(tx.company_id, tx.country_id, tx.amount)
+    )
+
+
+def fail_session(db, session: UssdSession, observed: str, reason: str, transient: bool = False) -> bool:
+    """observed -> FAILED for a session that never moved money, committed with fail_deposit()."""
+    if not DepositSessionMachine.transition(
+        db, session, observed, UssdSessionState.FAILED.value, commit=False, error_message=reason[:1000]
+    ):
+        db.rollback()
+        return False
+    fail_deposit(db, session, reason, transient=transient)
+    return True
+
+
+def complete_deposit(db, session: UssdSession):
+    """Last step done: record the gateway outcome; the confirmation email settles the money."""
+    req = session.pending_transaction
+    tx = session.deposit_transaction
+    tx.gateway_response = str(DepositSessionMachine.result(session))
+    db.add(tx)
+    if req and req.status == "processing":
+        req.status = "done"
+        req.processed_at = datetime.now(timezone.utc)
+        db.add(req)
+    db.commit()
+
+
+def _begin_step(db, session_id: int):
+    session = db.get(UssdSession, session_id)
+    if session is None or session.state not in DepositSessionMachine.RESUMABLE:
+        return session, None
+    if session.deposit_transaction.status not in OPEN_STATUSES:
+        # Never send "1" or the PIN for a deposit that is already failed/settled
+        return session, None
+    return session, deposit_machine.begin_step(db, session)
+
+
+def _abort_step(db, session: UssdSession, error: Exception):
+    # Only the opening request raises TransientGatewayError, and it never ran
+    fail_session(db, session, UssdSessionState.INITIATING.value, f"Deposit USSD session failed: {error}", transient=True)
+    wake_lane(session.sim_name)
+
+
+def _finish_step(db, session: UssdSession, response: str):
+    """Record a step's response; the session's next deadline if it has another step."""
+    state = deposit_machine.finish_step(db, session, response)
+    if state is None:
+        # Moved by the sweeper while the request was out
+        db.rollback()
+        return None
+
+    if state == UssdSessionState.FAILED.value:
+        fail_deposit(db, session, "Deposit USSD session failed: No confirmation menu received")
+        logger.warning(f"USSD session {session.id} failed without a confirmation menu; deposit {session.deposit_transaction_id} released")
+    elif state == UssdSessionState.COMPLETED.value:
+        complete_deposit(db, session)
+        logger.info(f"USSD session {session.id} completed; deposit {session.deposit_transaction_id} awaits confirmation")
+    else:
+        return session.expires_at
+
+    # The port is free again
+    wake_lane(session.sim_name)
+    return None
+
+
+async def _run_step(client: AsyncNeoGateTG400Client, session_id: int):
+    """
+    One step of one session. Database work runs off the event loop on the
+    session's own Session; only the USSD round trip is awaited on the loop.
+    """
+    db = SessionLocal()
+    try:
+        session, step = await asyncio.to_thread(_begin_step, db, session_id)
+        if step is None:
+            return None
+        code, rate_limited = step
+        try:
+            response = await client.send_ussd_request(
+                session.port_index, code, sim_name=session.sim_name, rate_limited=rate_limited
+            )
+        except TransientGatewayError as e:
+            await asyncio.to_thread(_abort_step, db, session, e)
+            return None
+        return await asyncio.to_thread(_finish_step, db, session, response)
+    except Exception as e:
+        logger.error(f"USSD session {session_id} step failed: {e}", exc_info=True)
+        await asyncio.to_thread(db.rollback)
+        return None
+    finally:
+        await asyncio.to_thread(db.close)
+
+
+async def _run_steps(session_ids: list) -> dict:
+    async with AsyncNeoGateTG400Client() as client:
+        deadlines = await asyncio.gather(*(_run_step(client, session_id) for session_id in session_ids))
+    return {session_id: deadline for session_id, deadline in zip(session_ids, deadlines) if deadline}
+
+
+@celery_app.task(name="src.tasks.ussd_sessions.advance_ussd_sessions")
+def advance_ussd_sessions(session_ids: list):
+    """
+    Run the next step of each deposit USSD session from its persisted state.
+
+    Each step is its own task: no worker waits between the USSD round trips
+    and no lane lock is held across them. Sessions sit on different ports, so
+    their requests go out concurrently over one pooled async client; the
+    ones with another step left are queued again as one task. The port stays
+    reserved for a session until it is terminal (DepositSessionMachine.port_busy).
+    """
+    pending = asyncio.run(_run_steps(session_ids))
+    if pending:
+        schedule_ussd_steps(list(pending), min(pending.values()))
+
+
+def resolve_expired_session(db, session: UssdSession):
+    """Close a session whose step deadline passed, releasing the hold when safe."""
+    observed = session.state
+    tx = session.deposit_transaction
+    req = session.pending_transaction
+    now = datetime.now(timezone.utc)
+
+    if tx.status not in OPEN_STATUSES:
+        # Deposit already settled elsewhere: just close the session, money untouched
+        if DepositSessionMachine.transition(
+            db, session, observed, UssdSessionState.EXPIRED.value,
+            error_message=f"Deposit already {tx.status}"
+        ):
+            wake_lane(session.sim_name)
+        return
+
+    if observed in DepositSessionMachine.SAFE_TO_FAIL:
+        reason = f"USSD session timed out in state '{observed}' before money moved"
+        if not fail_session(db, session, observed, reason):
+            return
+        logger.warning(f"USSD session {session.id} failed ({observed}); deposit {tx.id} released")
+    else:
+        reason = f"Worker lost in state '{observed}'; outcome left to the confirmation email"
+        if not DepositSessionMachine.transition(
+            db, session, observed, UssdSessionState.EXPIRED.value, commit=False, error_message=reason
+        ):
+            db.rollback()
+            return
+
+        if req and req.status == "processing":
+            req.status = "done"
+            req.processed_at = now
+            db.add(req)
+        db.commit()
+        logger.warning(f"USSD session {session.id} expired ({observed}); deposit {tx.id} awaits confirmation")
+
+    wake_lane(session.sim_name)
+
+
+def resumable_session(session: UssdSession) -> bool:
+    """A session whose step task was lost between steps and can be picked up again."""
+    return session.deposit_transaction.status in OPEN_STATUSES
+
+
+@celery_app.task(bind=True, max_retries=3, name="src.tasks.ussd_sessions.resolve_ussd_sessions")
+def resolve_ussd_sessions(self):
+    db = SessionLocal()
+    now = datetime.now(timezone.utc)
+    try:
+        expired = db.query(UssdSession).filter(
+            UssdSession.state.notin_(DepositSessionMachine.TERMINAL),
+            UssdSession.expires_at < now
+        ).all()
+        for session in expired:
+            try:
+                resolve_expired_session(db, session)
+            except Exception as e:
+                logger.error(f"Failed to resolve USSD session {session.id}: {e}", exc_info=True)
+                db.rollback()
+
+        # Idle for a whole sweep interval: its step task never ran
+        idle_since = now + timedelta(seconds=settings.USSD_STEP_TIMEOUT_SECONDS - settings.USSD_SWEEP_INTERVAL)
+        resumable = db.query(UssdSession).filter(
+            UssdSession.state.in_(DepositSessionMachine.RESUMABLE),
+            UssdSession.expires_at >= now,
+            UssdSession.expires_at < idle_since
+        ).all()
+        resumable = [session for session in resumable if resumable_session(session)]
+        if resumable:
+            logger.info(f"Resuming USSD sessions {[session.id for session in resumable]}")
+            # One task drives them all concurrently
+            schedule_ussd_steps([session.id for session in resumable], min(s.expires_at for s in resumable))
+
+    except Exception as e:
+        raise self.retry(exc=e, countdown=10)
+    finally:
+        db.close()
@@ -0,0 +1,107 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import tuple_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+
+# ----------------- CURSORS ----------------- #
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    """Opaque token for a position in a (timestamp, id) ordering."""
+    raw = json.dumps([sort_value.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> tuple:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid pagination cursor")
+
+
+def keyset(stmt, sort_column, id_column, limit: int, after: Optional[str] = None, before: Optional[str] = None,
+           offset: int = 0):
+    """
+    Newest-first page of `stmt` seeking past a cursor instead of OFFSET.
+
+    `after` continues to older rows, `before` goes back to newer ones. One
+    extra row is fetched so keyset_page() can tell whether more exist; the
+    cost of a page no longer depends on how deep it is.
+
+    `offset` is only kept for legacy callers of the first pages (deprecated)
+    and is refused together with a cursor: it would bring the linear scan
+    back and skip rows past the cursor unpredictably.
+    """
+    if after and before:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Use either 'after' or 'before', not both")
+    if offset and (after or before):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Offset pagination cannot be combined with a cursor")
+
+    position = tuple_(sort_column, id_column)
+    if before:
+        stmt = stmt.where(position > tuple_(*decode_cursor(before))).order_by(sort_column.asc(), id_column.asc())
+    else:
+        if after:
+            stmt = stmt.where(position < tuple_(*decode_cursor(after)))
+        stmt = stmt.order_by(sort_column.desc(), id_column.desc())
+    if offset:
+        stmt = stmt.offset(offset)
+    return stmt.limit(limit + 1)
+
+
+def keyset_page(rows: list, limit: int, sort_attr: str, before: Optional[str] = None, after: Optional[str] = None) -> dict:
+    """Trim the look-ahead row and build the next/prev cursors for a keyset() result."""
+    rows = list(rows)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        rows.reverse()
+
+    def cursor(row):
+        return encode_cursor(getattr(row, sort_attr), row.id)
+
+    if before:
+        next_cursor = cursor(rows[-1]) if rows else None
+        prev_cursor = cursor(rows[0]) if rows and has_more else None
+    else:
+        next_cursor = cursor(rows[-1]) if rows and has_more else None
+        prev_cursor = cursor(rows[0]) if rows and after else None
+
+    return {"items": rows, "next_cursor": next_cursor, "prev_cursor": prev_cursor, "has_more": has_more}
+
+
+def set_cursor_headers(response, page: dict):
+    """Expose the cursors of a plain-list endpoint without changing its body."""
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    if page["prev_cursor"]:
+        response.headers["X-Prev-Cursor"] = page["prev_cursor"]
+    if page.get("total") is not None:
+        response.headers["X-Total-Count-Estimate"] = str(page["total"])
+
+
+# ----------------- APPROXIMATE TOTALS ----------------- #
+class explain_rows(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) of a SELECT; the planner's row estimate costs no scan."""
+    inherit_cache = False
+
+    def __init__(self, stmt):
+        self.statement = stmt
+
+
+@compiles(explain_rows, "postgresql")
+def _compile_explain_rows(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+def plan_rows(plan) -> int:
+    """Row estimate out of an explain_rows() result."""
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
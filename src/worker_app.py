@@ -1,4 +1,5 @@
 from celery import Celery
+from celery.signals import worker_process_init
 from datetime import timedelta
 from src.core.config import settings
 
@@ -8,6 +9,13 @@ celery_app = Celery(
     backend=settings.CELERY_RESULT_BACKEND,
 )
 
+@worker_process_init.connect
+def _reset_db_pool(**kwargs):
+    """Forked children must not reuse the parent's pooled connections."""
+    from src.core.database import engine
+    engine.dispose(close=False)
+
+
 # Autodiscover task modules
 celery_app.autodiscover_tasks(["src.tasks"])
 
@@ -16,31 +24,30 @@ import src.tasks.gmail_sync
 import src.tasks.email_confirmation
 import src.tasks.transaction_checker
 import src.tasks.transaction_queue
+import src.tasks.ussd_sessions
 
 
-celery_app.conf.beat_schedule = {
+# With push notifications on, polling is only a safety net for missed pushes
+GMAIL_FETCH_INTERVAL = int(settings.GMAIL_FETCH_INTERVAL)
+GMAIL_AIRTIME_INTERVAL = int(settings.GMAIL_AIRTIME_INTERVAL)
+if settings.GMAIL_PUSH_ENABLED:
+    GMAIL_FETCH_INTERVAL = max(GMAIL_FETCH_INTERVAL, settings.GMAIL_PUSH_FALLBACK_INTERVAL)
+    GMAIL_AIRTIME_INTERVAL = max(GMAIL_AIRTIME_INTERVAL, settings.GMAIL_PUSH_FALLBACK_INTERVAL)
 
-    # --------------------------------------------------------
-    # 1. WITHDRAWAL (Same Gmail account as deposit)
-    # --------------------------------------------------------
-    "sync-withdrawal": {
-        "task": "src.tasks.gmail_sync.sync_account",
-        "schedule": timedelta(seconds=int(settings.GMAIL_FETCH_INTERVAL)),
-        "args": (
-            "cashout",
-            settings.GMAIL_WITHDRAWAL_TOKEN,  # SAME TOKEN for deposit/withdrawal
-        ),
-    },
+
+celery_app.conf.beat_schedule = {
 
     # --------------------------------------------------------
-    # 2. DEPOSIT (Same Gmail account as withdrawal)
+    # 1-2. DEPOSIT + WITHDRAWAL (one Orange Money mailbox)
     # --------------------------------------------------------
-    "sync-deposit": {
+    # Both confirmation types land in the same inbox; one pass lists it and
+    # sync_account classifies each message as cashin/cashout by its body.
+    "sync-orange-money": {
         "task": "src.tasks.gmail_sync.sync_account",
-        "schedule": timedelta(seconds=int(settings.GMAIL_FETCH_INTERVAL)),
+        "schedule": timedelta(seconds=GMAIL_FETCH_INTERVAL),
         "args": (
-            "cashin",
-            settings.GMAIL_WITHDRAWAL_TOKEN,  # SAME TOKEN
+            "orange_money",
+            settings.GMAIL_WITHDRAWAL_TOKEN,
         ),
     },
 
@@ -49,7 +56,7 @@ celery_app.conf.beat_schedule = {
     # --------------------------------------------------------
     "sync-airtime": {
         "task": "src.tasks.gmail_sync.sync_account",
-        "schedule": timedelta(seconds=int(settings.GMAIL_AIRTIME_INTERVAL)),
+        "schedule": timedelta(seconds=GMAIL_AIRTIME_INTERVAL),
         "args": (
             "airtime",
             settings.GMAIL_AIRTIME_TOKEN,  # NEW TOKEN for AIRTIME
@@ -65,12 +72,28 @@ celery_app.conf.beat_schedule = {
     },
 
     # --------------------------------------------------------
-    # 5. Transaction Queue Manager
+    # 5. Transaction Queue Manager (safety sweep; submissions wake lanes)
     # --------------------------------------------------------
     "sync-queued-transactions": {
         "task": "src.tasks.transaction_queue.process_transaction_queue",
-        "schedule": timedelta(seconds=15),
+        "schedule": timedelta(seconds=settings.QUEUE_SWEEP_INTERVAL),
+    },
+
+    # --------------------------------------------------------
+    # 6. Resolve timed-out / orphaned deposit USSD sessions
+    # --------------------------------------------------------
+    "resolve-ussd-sessions": {
+        "task": "src.tasks.ussd_sessions.resolve_ussd_sessions",
+        "schedule": timedelta(seconds=settings.USSD_SWEEP_INTERVAL),
     },
 
 }
 
+if settings.GMAIL_PUSH_ENABLED:
+    # --------------------------------------------------------
+    # 7. Keep Gmail push watches alive (they lapse after 7 days)
+    # --------------------------------------------------------
+    celery_app.conf.beat_schedule["renew-gmail-watches"] = {
+        "task": "src.tasks.gmail_sync.renew_gmail_watches",
+        "schedule": timedelta(hours=12),
+    }